@@ -4,9 +4,321 @@ import os
 import re
 import json
 import sys
+import time
+import random
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+# On-disk cache for scraped pages and parsed results. Disabled until
+# configure_cache() is called with a directory.
+_cache_dir = None
+_cache_ttl = 3600
+_parsed_cache_ttl = 86400
+_cache_lock = threading.Lock()
+
+# Signed mp3-128 stream URLs keyed by track page URL: page_url -> (stream_url, expires_at)
+_stream_urls = {}
+_stream_urls_lock = threading.Lock()
+STREAM_URL_DEFAULT_LIFETIME = 3600
+STREAM_URL_EXPIRY_MARGIN = 120
+
+# Album covers are served from bcbits by art id; size code 2 is a 350x350 JPEG
+ART_URL_TEMPLATE = "https://f4.bcbits.com/img/a{art_id:010d}_{size}.jpg"
+ART_THUMBNAIL_SIZE = 2
+
+
+class TokenBucket:
+    # Thread-safe token bucket; acquire() blocks until a token is available
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class FetchStats:
+    # Per-import counters, shared by the worker threads of one import
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failed_requests = 0
+        self.failed_tracks = 0
+
+    def add(self, field, amount=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def summary(self):
+        return (f"{self.requests} requests, {self.retries} retries, "
+                f"{self.failed_requests} failed requests, {self.failed_tracks} failed tracks")
+
+
+class RequestScheduler:
+    # Paces requests per host with a token bucket and a concurrency cap,
+    # retrying 429/5xx and connection errors with jittered exponential backoff.
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    def __init__(self, rate=2.0, burst=4, max_concurrency=4, max_retries=4,
+                 backoff_base=0.5, backoff_max=30.0, timeout=(5, 20)):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+
+    def _host_limits(self, url):
+        host = urlparse(url).netloc
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = (TokenBucket(self.rate, self.burst),
+                                     threading.BoundedSemaphore(self.max_concurrency))
+            return self._hosts[host]
+
+    def _backoff_delay(self, attempt, response):
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    return min(self.backoff_max, max(0.0, float(retry_after)))
+                except ValueError:
+                    pass
+        # "Equal jitter": half the exponential step is fixed, half is random
+        step = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return step / 2 + random.uniform(0, step / 2)
+
+    def get(self, url, headers=None, stats=None):
+        bucket, semaphore = self._host_limits(url)
+        response = None
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            response = None
+            last_error = None
+            with semaphore:
+                if stats:
+                    stats.add('requests')
+                try:
+                    response = requests.get(url, headers=headers, timeout=self.timeout)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    last_error = e
+
+            if response is not None and response.status_code not in self.RETRY_STATUS_CODES:
+                return response
+            if attempt == self.max_retries:
+                break
+
+            delay = self._backoff_delay(attempt, response)
+            reason = response.status_code if response is not None else last_error
+            print(f"Request to {url} failed ({reason}), retrying in {delay:.1f}s "
+                  f"(attempt {attempt + 1}/{self.max_retries})", file=sys.stderr)
+            if stats:
+                stats.add('retries')
+            time.sleep(delay)
+
+        if stats:
+            stats.add('failed_requests')
+        if response is not None:
+            print(f"Giving up on {url} after {self.max_retries} retries (status {response.status_code})", file=sys.stderr)
+            return response
+        print(f"Giving up on {url} after {self.max_retries} retries ({last_error})", file=sys.stderr)
+        raise last_error
+
+
+_scheduler = RequestScheduler()
+
+
+def configure_requests(rate=2.0, burst=4, max_concurrency=4, max_retries=4, timeout=(5, 20)):
+    global _scheduler
+    _scheduler = RequestScheduler(rate=rate, burst=burst, max_concurrency=max_concurrency,
+                                  max_retries=max_retries, timeout=timeout)
+
+
+class CachedResponse:
+    # Minimal stand-in for requests.Response, served from the page cache
+    def __init__(self, url, content, status_code=200):
+        self.url = url
+        self.content = content
+        self.status_code = status_code
+        self.from_cache = True
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+
+def configure_cache(cache_dir, ttl=3600, parsed_ttl=86400):
+    global _cache_dir, _cache_ttl, _parsed_cache_ttl
+    _cache_dir = cache_dir
+    _cache_ttl = ttl
+    _parsed_cache_ttl = parsed_ttl
+    if _cache_dir:
+        os.makedirs(os.path.join(_cache_dir, "pages"), exist_ok=True)
+        os.makedirs(os.path.join(_cache_dir, "parsed"), exist_ok=True)
+        os.makedirs(os.path.join(_cache_dir, "art"), exist_ok=True)
+        print(f"Bandcamp cache enabled at {_cache_dir} (ttl={ttl}s, parsed ttl={parsed_ttl}s)")
+
+def _cache_key(url):
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+def _write_atomic(path, data, mode='wb'):
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, mode) as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _read_page_entry(url):
+    base = os.path.join(_cache_dir, "pages", _cache_key(url))
+    try:
+        with open(base + ".json", 'r') as f:
+            meta = json.load(f)
+        with open(base + ".body", 'rb') as f:
+            body = f.read()
+        return meta, body
+    except (OSError, ValueError):
+        return None, None
+
+def _write_page_entry(url, meta, body=None):
+    base = os.path.join(_cache_dir, "pages", _cache_key(url))
+    with _cache_lock:
+        try:
+            if body is not None:
+                _write_atomic(base + ".body", body)
+            _write_atomic(base + ".json", json.dumps(meta), mode='w')
+        except OSError as e:
+            print(f"Could not write page cache for {url}: {e}", file=sys.stderr)
+
+def fetch_url(url, max_age=None, stats=None, conditional=True):
+    """Fetches a page through the on-disk cache, revalidating stale entries
+    with If-None-Match / If-Modified-Since. Returns a response-like object.
+    conditional=False forces a full download (for pages with volatile content)."""
+    if not _cache_dir:
+        return _scheduler.get(url, stats=stats)
+
+    max_age = _cache_ttl if max_age is None else max_age
+    meta, body = _read_page_entry(url)
+    if meta is not None and time.time() - meta.get('fetched_at', 0) < max_age:
+        print(f"Page cache hit: {url}")
+        return CachedResponse(url, body)
+
+    headers = {}
+    if meta is not None and conditional:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        response = _scheduler.get(url, headers=headers, stats=stats)
+    except requests.RequestException as e:
+        if meta is not None:
+            print(f"Network error for {url} ({e}), serving stale cache entry.", file=sys.stderr)
+            return CachedResponse(url, body)
+        raise
+
+    # The scheduler returns the last 429/5xx once its retries are exhausted
+    if response.status_code in RequestScheduler.RETRY_STATUS_CODES and meta is not None:
+        print(f"Status {response.status_code} for {url}, serving stale cache entry.", file=sys.stderr)
+        return CachedResponse(url, body)
+
+    if response.status_code == 304 and meta is not None:
+        print(f"Page cache revalidated: {url}")
+        meta['fetched_at'] = time.time()
+        _write_page_entry(url, meta)
+        return CachedResponse(url, body)
+
+    if response.status_code == 200:
+        _write_page_entry(url, {
+            'url': url,
+            'fetched_at': time.time(),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }, response.content)
+    return response
+
+def _load_parsed(kind, url):
+    if not _cache_dir:
+        return None
+    path = os.path.join(_cache_dir, "parsed", f"{kind}-{_cache_key(url)}.json")
+    try:
+        with open(path, 'r') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - entry.get('stored_at', 0) >= _parsed_cache_ttl:
+        return None
+    return entry.get('data')
+
+def _store_parsed(kind, url, data):
+    if not _cache_dir:
+        return
+    path = os.path.join(_cache_dir, "parsed", f"{kind}-{_cache_key(url)}.json")
+    with _cache_lock:
+        try:
+            _write_atomic(path, json.dumps({'url': url, 'stored_at': time.time(), 'data': data}), mode='w')
+        except OSError as e:
+            print(f"Could not write parsed cache for {url}: {e}", file=sys.stderr)
+
+def album_art_url(art_id, size=ART_THUMBNAIL_SIZE):
+    """Returns the cover image URL for a data-tralbum art_id, or None."""
+    try:
+        return ART_URL_TEMPLATE.format(art_id=int(art_id), size=size)
+    except (TypeError, ValueError):
+        return None
+
+def fetch_album_art(art_url, stats=None):
+    """Returns the image bytes for a cover URL, or None. Covers are immutable,
+    so cached copies are used without revalidation."""
+    path = os.path.join(_cache_dir, "art", _cache_key(art_url) + ".img") if _cache_dir else None
+    if path:
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            pass
+    try:
+        response = _scheduler.get(art_url, stats=stats)
+    except requests.RequestException as e:
+        print(f"Failed to fetch album art {art_url}: {e}", file=sys.stderr)
+        return None
+    if response.status_code != 200 or not response.content:
+        print(f"Failed to fetch album art {art_url}. Status code: {response.status_code}", file=sys.stderr)
+        return None
+    if path:
+        with _cache_lock:
+            try:
+                _write_atomic(path, response.content)
+            except OSError as e:
+                print(f"Could not write art cache for {art_url}: {e}", file=sys.stderr)
+    return response.content
+
+def _parse_tralbum(page_text):
+    match = re.search(r'data-tralbum="([^"]*)"', page_text)
+    if not match:
+        return None
+    return json.loads(match.group(1).replace("&quot;", '"'))
 
 def get_artist_album_urls(artist_url):
-    response = requests.get(artist_url)
+    response = fetch_url(artist_url)
     soup = BeautifulSoup(response.content, 'html.parser')
     album_urls = []
 
@@ -40,11 +352,29 @@ def get_artist_album_urls(artist_url):
                      print(f"Found album URL (data-client): {full_url}")
     return album_urls
 
-def get_album_track_info(album_url):
+def get_album_track_info(album_url, stats=None, on_art_url=None):
+    """Returns the track infos of an album. on_art_url(art_url) is called as soon
+    as the cover URL is known, before the track pages are fetched, so the caller
+    can download the cover concurrently."""
     print(f"Getting track info for album: {album_url}")
-    response = requests.get(album_url)
+    cached_infos = _load_parsed("album", album_url)
+    if cached_infos is not None:
+        print(f"Using cached track info for album: {album_url} ({len(cached_infos)} tracks)")
+        if on_art_url and cached_infos and cached_infos[0].get("art_url"):
+            on_art_url(cached_infos[0]["art_url"])
+        return cached_infos
+
+    response = fetch_url(album_url, stats=stats)
+    if response.status_code != 200:
+        print(f"Failed to access album page {album_url}. Status code: {response.status_code}", file=sys.stderr)
+        return []
+    tralbum_data = _parse_tralbum(response.text)
+    art_url = album_art_url(tralbum_data.get('art_id')) if tralbum_data else None
+    if art_url and on_art_url:
+        on_art_url(art_url)
+
     soup = BeautifulSoup(response.content, 'html.parser')
-    track_infos = []
+    track_page_urls = []
 
     # Extract artist name from album URL if possible (heuristic)
     artist_name_match = re.search(r"https://([^.]+)\.bandcamp\.com", album_url)
@@ -70,32 +400,130 @@ def get_album_track_info(album_url):
                     base_url = base_url_match.group(1)
                     track_page_url = base_url + track_link['href']
                     print(f"Found track page URL: {track_page_url}")
-                    track_info = get_bandcamp_track_info(track_page_url, artist_name, album_title)
-                    if track_info:
-                        track_infos.append(track_info)
+                    track_page_urls.append(track_page_url)
                 else:
                     print(f"Could not determine base URL from album URL: {album_url}")
         else:
             print("Could not find title for a track, skipping...")
 
+    # Track pages are fetched concurrently; the scheduler enforces the
+    # per-host rate and concurrency limits. map() keeps album order.
+    with ThreadPoolExecutor(max_workers=_scheduler.max_concurrency) as pool:
+        results = pool.map(lambda page_url: get_bandcamp_track_info(page_url, artist_name, album_title, stats=stats),
+                           track_page_urls)
+        track_infos = [info for info in results if info]
+    for info in track_infos:
+        # Every track of the album gets the album cover
+        if art_url:
+            info["art_url"] = art_url
+    if stats:
+        stats.add('failed_tracks', len(track_page_urls) - len(track_infos))
+
     print(f"Found {len(track_infos)} tracks for album '{album_title}'")
+    if track_infos and len(track_infos) == len(track_page_urls):
+        _store_parsed("album", album_url, track_infos)
     return track_infos
 
-def get_bandcamp_track_info(track_page_url, default_artist="Unknown Artist", default_album="Unknown Album"):
+def _stream_url_expiry(stream_url, fetched_at):
+    # bcbits stream URLs carry their expiry as a unix timestamp in "ts"
+    # (also the prefix of "token"); fall back to a fixed lifetime.
+    query = parse_qs(urlparse(stream_url).query)
+    candidates = query.get('ts', []) + [t.split('_', 1)[0] for t in query.get('token', [])]
+    for candidate in candidates:
+        try:
+            expires_at = int(candidate)
+        except ValueError:
+            continue
+        if expires_at > fetched_at:
+            return expires_at
+    return fetched_at + STREAM_URL_DEFAULT_LIFETIME
+
+def _remember_stream_url(track_page_url, stream_url, fetched_at):
+    with _stream_urls_lock:
+        _stream_urls[track_page_url] = (stream_url, _stream_url_expiry(stream_url, fetched_at))
+
+def cached_stream_url(track_page_url):
+    """Returns a still-valid stream URL for a track page, or None."""
+    with _stream_urls_lock:
+        entry = _stream_urls.get(track_page_url)
+    if entry and entry[1] - STREAM_URL_EXPIRY_MARGIN > time.time():
+        return entry[0]
+    return None
+
+def invalidate_stream_url(track_page_url):
+    with _stream_urls_lock:
+        _stream_urls.pop(track_page_url, None)
+
+def _stream_url_entry_size(track_page_url, entry):
+    return sys.getsizeof(track_page_url) + sys.getsizeof(entry[0]) + sys.getsizeof(entry)
+
+def stream_url_cache_usage():
+    """Returns (approximate bytes, entries) held by the in-memory stream URL cache."""
+    with _stream_urls_lock:
+        return (sum(_stream_url_entry_size(url, entry) for url, entry in _stream_urls.items()),
+                len(_stream_urls))
+
+def trim_stream_urls(max_bytes):
+    """Drops expired stream URLs, then the ones expiring soonest, until the cache fits in max_bytes."""
+    now = time.time()
+    with _stream_urls_lock:
+        for url in [url for url, entry in _stream_urls.items() if entry[1] - STREAM_URL_EXPIRY_MARGIN <= now]:
+            del _stream_urls[url]
+        used = sum(_stream_url_entry_size(url, entry) for url, entry in _stream_urls.items())
+        for url, entry in sorted(_stream_urls.items(), key=lambda item: item[1][1]):
+            if used <= max_bytes:
+                break
+            used -= _stream_url_entry_size(url, entry)
+            del _stream_urls[url]
+
+def resolve_stream_url(track_page_url):
+    """Returns a playable stream URL for a track page, refetching the page
+    when the cached signed URL is missing or about to expire."""
+    stream_url = cached_stream_url(track_page_url)
+    if stream_url:
+        return stream_url
+    print(f"Resolving stream URL for: {track_page_url}")
+    track_info = get_bandcamp_track_info(track_page_url, use_cache=False)
+    if not track_info:
+        return None
+    # A freshly fetched page remembers its stream URL. A stale page served
+    # after a network error does not, so its signed URL is only returned if
+    # the expiry it carries is still ahead of us.
+    stream_url = cached_stream_url(track_page_url)
+    if stream_url:
+        return stream_url
+    if _stream_url_expiry(track_info["stream_url"], 0) - STREAM_URL_EXPIRY_MARGIN > time.time():
+        return track_info["stream_url"]
+    print(f"Stream URL from stale page has expired: {track_page_url}", file=sys.stderr)
+    return None
+
+def get_bandcamp_track_info(track_page_url, default_artist="Unknown Artist", default_album="Unknown Album", stats=None, use_cache=True):
     print(f"Getting track info for page: {track_page_url}")
-    response = requests.get(track_page_url)
+    if use_cache:
+        cached_info = _load_parsed("track", track_page_url)
+        if cached_info is not None:
+            print(f"Using cached track info for page: {track_page_url}")
+            return cached_info
+
+    try:
+        fetched_at = time.time()
+        if use_cache:
+            response = fetch_url(track_page_url, stats=stats)
+        else:
+            response = fetch_url(track_page_url, max_age=0, stats=stats, conditional=False)
+    except requests.RequestException as e:
+        print(f"Failed to access track page {track_page_url}: {e}", file=sys.stderr)
+        return None
 
     if response.status_code != 200:
-        print(f"Failed to access track page {track_page_url}. Status code: {response.status_code}")
+        print(f"Failed to access track page {track_page_url}. Status code: {response.status_code}", file=sys.stderr)
         return None
 
-    tralbum_data_match = re.search(r'data-tralbum="([^"]*)"', response.text)
-    if not tralbum_data_match:
+    tralbum_data = _parse_tralbum(response.text)
+    if not tralbum_data:
         print(f"Failed to find track data on page: {track_page_url}")
         return None
 
-    tralbum_data = json.loads(tralbum_data_match.group(1).replace("&quot;", '"'))
-
     track_info = tralbum_data['trackinfo'][0]
     track_title = track_info['title']
     stream_url = track_info.get('file', {}).get('mp3-128')
@@ -114,13 +542,18 @@ def get_bandcamp_track_info(track_page_url, default_artist="Unknown Artist", def
 
     print(f"Found track info: Title='{track_title}', Artist='{artist}', Album='{album_title}', Duration={duration}, URL='{stream_url}'")
 
-    return {
+    track_result = {
         "title": track_title,
         "artist": artist,
         "album": album_title,
         "duration": duration, # Store duration in seconds
         "stream_url": stream_url,
-        "track_page_url": track_page_url # Keep original page for reference
+        "track_page_url": track_page_url, # Keep original page for reference
+        "art_url": album_art_url(tralbum_data.get('art_id')),
     }
+    if not getattr(response, 'from_cache', False):
+        _remember_stream_url(track_page_url, stream_url, fetched_at)
+    _store_parsed("track", track_page_url, track_result)
+    return track_result
 
 # Removed main execution block
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Checks Namo's album loudness analysis end to end: renders a 3-track album of sine tones
+at different levels, runs it through ReplayGainAnalyzer's album pipeline, and verifies
+that every track got its own track gain and the same album gain, and that the album gain
+covers the whole album rather than only the last track. The quietest track comes last,
+so an album gain taken from it alone stands out. Also checks that shutdown() stops an
+analysis in progress.
+
+Usage: python3 benchmarks/replaygain_album.py [--seconds N]
+Exits non-zero if a check fails.
+"""
+
+import argparse
+import os
+import pathlib
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from namo import Gst, ReplayGainAnalyzer
+
+TRACK_VOLUMES = (0.8, 0.2, 0.05)
+GAIN_TOLERANCE_DB = 0.01
+
+
+def render_track(path, volume, seconds):
+    """Writes a WAV file of a 440 Hz sine at the given volume."""
+    pipeline = Gst.parse_launch(
+        f"audiotestsrc wave=sine freq=440 volume={volume} num-buffers={int(seconds * 44100 / 1024)} "
+        "samplesperbuffer=1024 ! audio/x-raw,rate=44100,channels=2 ! audioconvert ! wavenc ! "
+        f"filesink location={path}")
+    pipeline.set_state(Gst.State.PLAYING)
+    message = pipeline.get_bus().timed_pop_filtered(60 * Gst.SECOND, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+    if message is None or message.type == Gst.MessageType.ERROR:
+        reason = message.parse_error()[0].message if message else "timed out"
+        print(f"ERROR: could not render {path}: {reason}", file=sys.stderr)
+        sys.exit(1)
+
+
+def check_album(uris):
+    started = time.monotonic()
+    results = ReplayGainAnalyzer(store=None)._run_album_pipeline(uris)
+    elapsed_ms = (time.monotonic() - started) * 1000
+    failures = []
+    for uri, volume in zip(uris, TRACK_VOLUMES):
+        gains = results.get(uri) or {}
+        print(f"volume {volume:.2f}: track gain {gains.get('track_gain')}, album gain {gains.get('album_gain')}")
+        if 'track_gain' not in gains or 'album_gain' not in gains:
+            failures.append(f"{os.path.basename(uri)} is missing its track or album gain")
+    if failures:
+        return failures, elapsed_ms
+
+    album_gains = [results[uri]['album_gain'] for uri in uris]
+    track_gains = [results[uri]['track_gain'] for uri in uris]
+    if max(album_gains) - min(album_gains) > GAIN_TOLERANCE_DB:
+        failures.append(f"tracks got different album gains: {album_gains}")
+    if len({round(gain, 1) for gain in track_gains}) != len(track_gains):
+        failures.append(f"track gains do not differ between tracks at different levels: {track_gains}")
+    if abs(album_gains[-1] - track_gains[-1]) <= GAIN_TOLERANCE_DB:
+        failures.append("album gain equals the last track's gain, so earlier tracks were not counted")
+    if not min(track_gains) - GAIN_TOLERANCE_DB <= album_gains[0] <= max(track_gains) + GAIN_TOLERANCE_DB:
+        failures.append(f"album gain {album_gains[0]} lies outside the track gains {track_gains}")
+    return failures, elapsed_ms
+
+
+def check_shutdown(uris):
+    """Starts an analysis and shuts the analyzer down while it runs; it must return None promptly."""
+    analyzer = ReplayGainAnalyzer(store=None)
+    outcome = {}
+    thread = threading.Thread(target=lambda: outcome.setdefault('results', analyzer._run_album_pipeline(uris)))
+    thread.start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    analyzer.shutdown()
+    thread.join(10)
+    stop_ms = (time.monotonic() - started) * 1000
+    if thread.is_alive():
+        return ["the analysis kept running after shutdown()"], stop_ms
+    if outcome.get('results') is not None:
+        return ["the analysis finished before shutdown(); use longer tracks with --seconds"], stop_ms
+    return [], stop_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=20, help="length of each rendered track")
+    args = parser.parse_args()
+
+    Gst.init(None)
+    for element in ("audiotestsrc", "wavenc", "rganalysis", "uridecodebin"):
+        if Gst.ElementFactory.find(element) is None:
+            print(f"ERROR: the GStreamer element {element} is not available.", file=sys.stderr)
+            return 1
+
+    with tempfile.TemporaryDirectory(prefix="namo-rg-") as directory:
+        uris = []
+        for number, volume in enumerate(TRACK_VOLUMES, 1):
+            path = os.path.join(directory, f"{number:02d}.wav")
+            render_track(path, volume, args.seconds)
+            uris.append(pathlib.Path(path).as_uri())
+
+        failures, elapsed_ms = check_album(uris)
+        print(f"Album analysis: {elapsed_ms:.0f} ms for {len(uris)} x {args.seconds:g} s")
+        shutdown_failures, stop_ms = check_shutdown(uris)
+        print(f"Shutdown during analysis: stopped in {stop_ms:.0f} ms")
+        failures += shutdown_failures
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    if not failures:
+        print("OK: every track shares one album gain covering the whole album.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Measures Namo's cold start: module import cost (from `python -X importtime`) and
+time-to-window, i.e. from spawning the process until the first frame is drawn.
+
+Usage: python3 benchmarks/startup.py [--runs N] [--top N]
+Needs a display; the launched instances are terminated once their window is up.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NAMO = os.path.join(REPO_DIR, "namo.py")
+FIRST_FRAME_MARKER = "Startup: first frame drawn"
+
+
+def import_times(top):
+    """Returns (total_us, [(cumulative_us, module), ...]) for `import namo` and its heaviest direct imports."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import namo"],
+                            cwd=REPO_DIR, capture_output=True, text=True)
+    total_us = 0
+    direct = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name_field = line.split("|")
+        name = name_field[1:]
+        level = (len(name) - len(name.lstrip())) // 2
+        if level == 0 and name.strip() == "namo":
+            total_us = int(cumulative_us)
+        elif level == 1:
+            direct.append((int(cumulative_us), name.strip()))
+    return total_us, sorted(direct, reverse=True)[:top]
+
+
+def time_to_window(timeout_s=60):
+    """Spawns Namo and returns milliseconds until it reports its first frame, or None."""
+    started = time.monotonic()
+    process = subprocess.Popen([sys.executable, "-u", NAMO], cwd=REPO_DIR,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        for line in process.stdout:
+            if line.startswith(FIRST_FRAME_MARKER):
+                return (time.monotonic() - started) * 1000
+            if time.monotonic() - started > timeout_s:
+                break
+        return None
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    total_us, heaviest = import_times(args.top)
+    print(f"== import namo: {total_us / 1000:.1f} ms ==")
+    for cumulative_us, module in heaviest:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {module}")
+
+    samples = []
+    for _ in range(args.runs):
+        latency_ms = time_to_window()
+        if latency_ms is not None:
+            samples.append(latency_ms)
+        time.sleep(0.5)
+    print("== time to window ==")
+    if samples:
+        print(f"  median {statistics.median(samples):.0f} ms, min {min(samples):.0f} ms, "
+              f"max {max(samples):.0f} ms ({len(samples)} runs)")
+    else:
+        print("  no successful runs (is a display available?)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Plays a local audio file through a throttled local HTTP server with a playbin set up like
+Namo's, driving Namo's own pause-while-buffering handler (handle_buffering) and StreamMetrics,
+and reports time-to-first-audio, stall count and time spent stalled.
+
+Usage: python3 benchmarks/stream_buffering.py [--rate KBPS] [--seconds N]
+                                              [--buffer-size BYTES] [--buffer-duration S]
+                                              [--no-download] [--fakesink] FILE
+The server honours Range requests, so seeks and progressive download behave as with a
+real host. --stall-every and --stall-seconds inject periodic network pauses.
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from namo import Gst, NamoWindow, StreamMetrics, handle_buffering
+
+CHUNK_SIZE = 4096
+
+
+def make_handler(path, rate_bytes, stall_every_bytes, stall_seconds):
+    size = os.path.getsize(path)
+
+    class ThrottledHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            start, end = 0, size - 1
+            range_header = self.headers.get("Range")
+            if range_header and range_header.startswith("bytes="):
+                first, _, last = range_header[6:].partition("-")
+                start = int(first) if first else 0
+                end = min(int(last), size - 1) if last else size - 1
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+
+            sent = 0
+            started = time.monotonic()
+            with open(path, 'rb') as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    try:
+                        self.wfile.write(chunk)
+                    except (BrokenPipeError, ConnectionResetError):
+                        return
+                    remaining -= len(chunk)
+                    before = sent
+                    sent += len(chunk)
+                    if stall_every_bytes and sent // stall_every_bytes != before // stall_every_bytes:
+                        time.sleep(stall_seconds)
+                        started += stall_seconds
+                    delay = started + sent / rate_bytes - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+
+    return ThrottledHandler
+
+
+def start_server(path, rate_bytes, stall_every_bytes, stall_seconds):
+    server = ThreadingHTTPServer(("127.0.0.1", 0),
+                                 make_handler(path, rate_bytes, stall_every_bytes, stall_seconds))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def play(uri, seconds, buffer_size, buffer_duration_s, download, fakesink):
+    player = Gst.ElementFactory.make("playbin", "player")
+    rgvolume = Gst.ElementFactory.make("rgvolume", "rgvolume")
+    if not player or not rgvolume:
+        print("ERROR: playbin or rgvolume is not available.", file=sys.stderr)
+        sys.exit(1)
+    player.set_property("audio-filter", rgvolume)
+    if fakesink:
+        player.set_property("audio-sink", Gst.ElementFactory.make("fakesink", "sink"))
+    if buffer_size > 0:
+        player.set_property("buffer-size", buffer_size)
+    if buffer_duration_s > 0:
+        player.set_property("buffer-duration", int(buffer_duration_s * Gst.SECOND))
+    if download:
+        player.set_property("flags", player.get_property("flags") | NamoWindow.PLAY_FLAG_DOWNLOAD)
+    player.set_property("uri", uri)
+
+    metrics = StreamMetrics()
+    metrics.start_track(uri)
+    buffering = False
+    is_live = player.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.NO_PREROLL
+    bus = player.get_bus()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        message = bus.timed_pop_filtered(100 * Gst.MSECOND,
+                                         Gst.MessageType.BUFFERING | Gst.MessageType.STATE_CHANGED
+                                         | Gst.MessageType.ERROR | Gst.MessageType.EOS)
+        if message is None:
+            continue
+        if message.type == Gst.MessageType.ERROR:
+            err, dbg = message.parse_error()
+            print(f"ERROR: {err.message} ({dbg})", file=sys.stderr)
+            break
+        if message.type == Gst.MessageType.EOS:
+            break
+        if message.type == Gst.MessageType.BUFFERING:
+            if not is_live:
+                buffering = handle_buffering(player, metrics, message.parse_buffering(), buffering, True)
+        elif message.src == player:
+            _, new_state, _ = message.parse_state_changed()
+            if new_state == Gst.State.PLAYING:
+                metrics.first_audio()
+    metrics.finish_track()
+    player.set_state(Gst.State.NULL)
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=32, help="server bandwidth in KB/s")
+    parser.add_argument("--seconds", type=float, default=30, help="how long to play")
+    parser.add_argument("--buffer-size", type=int, default=4 * 1024 * 1024)
+    parser.add_argument("--buffer-duration", type=float, default=8, help="seconds")
+    parser.add_argument("--no-download", action="store_true", help="disable progressive download")
+    parser.add_argument("--stall-every", type=int, default=0, help="pause the server every N KB")
+    parser.add_argument("--stall-seconds", type=float, default=3)
+    parser.add_argument("--fakesink", action="store_true", help="decode without an audio device")
+    parser.add_argument("file")
+    args = parser.parse_args()
+
+    Gst.init(None)
+    server = start_server(args.file, args.rate * 1024, args.stall_every * 1024, args.stall_seconds)
+    uri = f"http://127.0.0.1:{server.server_address[1]}/{os.path.basename(args.file)}"
+    print(f"Serving {args.file} at {args.rate:g} KB/s on {uri}")
+    metrics = play(uri, args.seconds, args.buffer_size, args.buffer_duration,
+                   not args.no_download, args.fakesink)
+    server.shutdown()
+
+    if not metrics.first_audio_ms:
+        print("No audio within the run.")
+        return 1
+    print(f"Time-to-first-audio: {metrics.first_audio_ms[0]:.0f} ms")
+    print(f"Stalls: {metrics.stalls} ({metrics.stall_seconds:.1f} s stalled)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
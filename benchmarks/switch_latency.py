@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Measures click-to-first-audio latency of track switches in a playbin set up like Namo's
+(rgvolume audio filter), comparing a full NULL teardown with the READY fast-switch path.
+
+Usage: python3 benchmarks/switch_latency.py [--runs N] URI [URI ...]
+Pass local (file://) and remote (http[s]://) URIs to compare both.
+"""
+
+import argparse
+import statistics
+import sys
+import time
+
+import gi
+
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+
+def make_player():
+    player = Gst.ElementFactory.make("playbin", "player")
+    rgvolume = Gst.ElementFactory.make("rgvolume", "rgvolume")
+    if not player or not rgvolume:
+        print("ERROR: playbin or rgvolume is not available.", file=sys.stderr)
+        sys.exit(1)
+    player.set_property("audio-filter", rgvolume)
+    return player
+
+
+def wait_until_playing(player, timeout_s=30):
+    """Blocks until the pipeline reaches PLAYING; returns False on error or timeout."""
+    bus = player.get_bus()
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        message = bus.timed_pop_filtered(100 * Gst.MSECOND,
+                                         Gst.MessageType.STATE_CHANGED | Gst.MessageType.ERROR)
+        if message is None:
+            continue
+        if message.type == Gst.MessageType.ERROR:
+            err, dbg = message.parse_error()
+            print(f"ERROR: {err.message} ({dbg})", file=sys.stderr)
+            return False
+        if message.src == player:
+            _, new_state, _ = message.parse_state_changed()
+            if new_state == Gst.State.PLAYING:
+                return True
+    return False
+
+
+def switch(player, uri, down_state):
+    started = time.monotonic()
+    player.set_state(down_state)
+    player.set_property("uri", uri)
+    player.set_state(Gst.State.PLAYING)
+    if not wait_until_playing(player):
+        return None
+    return (time.monotonic() - started) * 1000
+
+
+def measure(uris, runs, down_state):
+    player = make_player()
+    results = {uri: [] for uri in uris}
+    # Warm up once so both modes start from a running pipeline
+    switch(player, uris[0], Gst.State.NULL)
+    for _ in range(runs):
+        for uri in uris:
+            latency_ms = switch(player, uri, down_state)
+            if latency_ms is not None:
+                results[uri].append(latency_ms)
+            time.sleep(0.5)
+    player.set_state(Gst.State.NULL)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("uris", nargs="+")
+    args = parser.parse_args()
+
+    Gst.init(None)
+    for label, down_state in (("NULL teardown", Gst.State.NULL), ("READY fast switch", Gst.State.READY)):
+        results = measure(args.uris, args.runs, down_state)
+        print(f"== {label} ==")
+        for uri, samples in results.items():
+            kind = "remote" if uri.startswith(("http://", "https://")) else "local"
+            if samples:
+                print(f"  [{kind}] {uri}: median {statistics.median(samples):.1f} ms, "
+                      f"min {min(samples):.1f} ms, max {max(samples):.1f} ms ({len(samples)} runs)")
+            else:
+                print(f"  [{kind}] {uri}: no successful runs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -15,66 +15,2954 @@ import importlib.util
 import html 
 import json 
 import base64 
-import mutagen
+import hashlib
+import time
+import math
+import urllib.request
+import weakref
+import unicodedata
+import locale
+import bisect
+import random
+import sqlite3
+import shutil
+import subprocess
+import traceback
+from array import array
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 import pathlib 
-from urllib.parse import urlparse, unquote
+from urllib.parse import urlparse, unquote, unquote_to_bytes, urljoin
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape as xml_escape
 from gi.repository import Gtk, Adw, Gio, GLib, GObject, Gst, GstPbutils, GdkPixbuf, Gdk, Pango 
 
 
+STARTED_AT = time.monotonic()
+
+SETTINGS_FILE_PATH = os.path.expanduser("~/.config/namo/settings.json")
+CACHE_DIR = os.path.expanduser("~/.cache/namo")
+LIBRARY_FILE_PATH = os.path.expanduser("~/.config/namo/library.db")
+
+DEFAULT_SETTINGS = {
+    "bandcamp_cache_enabled": True,
+    "bandcamp_page_cache_ttl": 3600,
+    "bandcamp_track_info_cache_ttl": 86400,
+    "bandcamp_requests_per_second": 2.0,
+    "bandcamp_request_burst": 4,
+    "bandcamp_max_concurrent_requests": 4,
+    "bandcamp_max_retries": 4,
+    "bandcamp_request_timeout": 20,
+    "stream_prefetch_count": 3,
+    "media_cache_enabled": False,
+    "media_cache_max_bytes": 1024 * 1024 * 1024,
+    "gapless_playback": True,
+    "stream_buffer_size": 4 * 1024 * 1024,
+    "stream_buffer_duration_s": 8,
+    "progressive_download": True,
+    "live_scrubbing": True,
+    "replaygain_album_mode": True,
+    "replaygain_workers": 0,
+    "waveform_enabled": True,
+    "waveform_workers": 0,
+    "waveform_prefetch_count": 3,
+    "duplicate_fingerprints": False,
+    "duplicate_workers": 0,
+    "memory_budget_bytes": 128 * 1024 * 1024,
+    "art_memory_max_bytes": 64 * 1024 * 1024,
+    "texture_memory_max_bytes": 8 * 1024 * 1024,
+    "metadata_memory_max_bytes": 32 * 1024 * 1024,
+    "waveform_memory_max_bytes": 4 * 1024 * 1024,
+    "stream_url_memory_max_bytes": 1024 * 1024,
+    "watchdog_enabled": False,
+    "watchdog_stall_ms": 200,
+    "scan_low_priority": True,
+    "scan_max_files_per_second": 0,
+    "scan_max_bytes_per_second": 0,
+    "scan_backoff_latency_ms": 50,
+}
+
+
+def load_settings():
+    """Loads user settings from settings.json, falling back to defaults for missing keys."""
+    settings = dict(DEFAULT_SETTINGS)
+    if os.path.exists(SETTINGS_FILE_PATH):
+        try:
+            with open(SETTINGS_FILE_PATH, 'r') as f:
+                user_settings = json.load(f)
+            if isinstance(user_settings, dict):
+                settings.update(user_settings)
+            else:
+                print(f"Warning: Ignoring invalid settings file (not an object): {SETTINGS_FILE_PATH}", file=sys.stderr)
+        except Exception as e:
+            print(f"Warning: Could not read settings from {SETTINGS_FILE_PATH}: {e}", file=sys.stderr)
+    return settings
+
+
+settings = load_settings()
+
+
+BC_SCRAPER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "3rdp", "bandcamp-scraper.py")
+
 bc_scraper = None
-try:
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    scraper_path = os.path.join(script_dir, "3rdp", "bandcamp-scraper.py")
-    if os.path.exists(scraper_path):
-        spec = importlib.util.spec_from_file_location("bc_scraper", scraper_path)
-        if spec and spec.loader:
-            bc_scraper = importlib.util.module_from_spec(spec)
+_bc_scraper_failed = False
+_bc_scraper_lock = threading.Lock()
+
+mutagen = None
+_mutagen_lock = threading.Lock()
+
+
+def bandcamp_available():
+    """Cheap check that does not import the scraper: False if it is missing or failed to load."""
+    return not _bc_scraper_failed and os.path.exists(BC_SCRAPER_PATH)
+
+
+def load_bc_scraper():
+    """
+    Imports and configures the Bandcamp scraper on first use, so requests and bs4 stay out
+    of startup. Returns the module, or None if it is unavailable. Safe to call from any thread.
+    """
+    global bc_scraper, _bc_scraper_failed
+    with _bc_scraper_lock:
+        if bc_scraper is not None or _bc_scraper_failed:
+            return bc_scraper
+        try:
+            if not os.path.exists(BC_SCRAPER_PATH):
+                raise FileNotFoundError(f"scraper file not found at {BC_SCRAPER_PATH}")
+            spec = importlib.util.spec_from_file_location("bc_scraper", BC_SCRAPER_PATH)
+            if not spec or not spec.loader:
+                raise ImportError(f"could not create spec/loader for {BC_SCRAPER_PATH}")
+            module = importlib.util.module_from_spec(spec)
             
-            sys.modules["bc_scraper"] = bc_scraper
-            spec.loader.exec_module(bc_scraper)
+            sys.modules["bc_scraper"] = module
+            spec.loader.exec_module(module)
             print("Successfully imported bandcamp_scraper.")
-        else:
-             print(f"Warning: Could not create spec/loader for {scraper_path}.", file=sys.stderr)
-    else:
-        print(f"Warning: Scraper file not found at {scraper_path}", file=sys.stderr)
+            if settings["bandcamp_cache_enabled"]:
+                module.configure_cache(os.path.join(CACHE_DIR, "bandcamp"),
+                                       ttl=settings["bandcamp_page_cache_ttl"],
+                                       parsed_ttl=settings["bandcamp_track_info_cache_ttl"])
+            module.configure_requests(rate=settings["bandcamp_requests_per_second"],
+                                      burst=settings["bandcamp_request_burst"],
+                                      max_concurrency=settings["bandcamp_max_concurrent_requests"],
+                                      max_retries=settings["bandcamp_max_retries"],
+                                      timeout=(5, settings["bandcamp_request_timeout"]))
+            bc_scraper = module
+        except Exception as e:
+            print(f"Warning: Could not import bandcamp_scraper ({e}). Bandcamp functionality disabled.", file=sys.stderr)
+            sys.modules.pop("bc_scraper", None)
+            _bc_scraper_failed = True
+        return bc_scraper
+
 
-except Exception as e:
-    print(f"Warning: Could not import bandcamp_scraper ({e}). Bandcamp functionality disabled.", file=sys.stderr)
-    bc_scraper = None
+def load_mutagen():
+    """Imports mutagen (with the ID3 and MP4 modules used for cover art) on first use."""
+    global mutagen
+    with _mutagen_lock:
+        if mutagen is None:
+            module = importlib.import_module("mutagen")
+            importlib.import_module("mutagen.id3")
+            importlib.import_module("mutagen.mp4")
+            mutagen = module
+        return mutagen
 
 
 
 class Song(GObject.Object):
+    """
+    A track as shown in the UI. title and artist fall back to "Unknown" placeholders for
+    display; known_title and known_artist keep what the tags said (None when missing) and
+    are what gets stored or exported.
+    """
     __gtype_name__ = 'Song'
 
     title = GObject.Property(type=str, default="Unknown Title")
     uri = GObject.Property(type=str) 
     artist = GObject.Property(type=str, default="Unknown Artist")
+    album = GObject.Property(type=str, default="")
     duration = GObject.Property(type=GObject.TYPE_INT64, default=0) 
     album_art_data = GObject.Property(type=GLib.Bytes) 
 
+    row_id = 0 
+
     def __init__(self, uri, title=None, artist=None, duration=None):
         super().__init__()
         self.uri = uri
         self.title = title if title else "Unknown Title"
         self.artist = artist if artist else "Unknown Artist"
+        self.known_title = title or None
+        self.known_artist = artist or None
         
         self.duration = duration if isinstance(duration, int) and duration >= 0 else 0
         
 
 
+class ArtStore:
+    """
+    Deduplicated album art shared by playlist rows. Rows hold an integer handle
+    (0 means no art), so an album's cover is stored once however many tracks use it.
+    With a loader (digest -> GLib.Bytes or None) set, least recently used covers that the
+    loader can restore may be evicted and are then reloaded on the next get().
+    """
+
+    def __init__(self):
+        self._art = [None]
+        self._digests = [None]
+        self._sizes = array('I', [0])
+        self._handles_by_digest = {}
+        self._handles_by_id = {}
+        self._resident = {}
+        self.resident_bytes = 0
+        self.loader = None
+        self.persisted = None
+        self.on_growth = None
+
+    def _make_resident(self, handle, glib_bytes):
+        self._art[handle] = glib_bytes
+        self._handles_by_id[id(glib_bytes)] = handle
+        self._resident[handle] = None
+        self.resident_bytes += self._sizes[handle]
+        if self.on_growth:
+            self.on_growth()
+
+    def add(self, glib_bytes):
+        """
+        Returns the handle for glib_bytes, storing it if this image has not been seen before.
+        An object that is already stored (e.g. a folder cover shared by an album's tracks)
+        is recognised by identity without hashing it again.
+        """
+        if glib_bytes is None:
+            return 0
+        handle = self._handles_by_id.get(id(glib_bytes))
+        if handle is not None and self._art[handle] is glib_bytes:
+            return handle
+        digest = hashlib.sha1(glib_bytes.get_data()).digest()
+        handle = self._handles_by_digest.get(digest)
+        if handle is None:
+            handle = len(self._art)
+            self._art.append(None)
+            self._digests.append(digest)
+            self._sizes.append(glib_bytes.get_size())
+            self._handles_by_digest[digest] = handle
+            self._make_resident(handle, glib_bytes)
+        elif self._art[handle] is None:
+            self._make_resident(handle, glib_bytes)
+        return handle
+
+    def get(self, handle):
+        if not handle:
+            return None
+        art = self._art[handle]
+        if art is None:
+            art = self.loader(self._digests[handle]) if self.loader else None
+            if art is not None:
+                self._make_resident(handle, art)
+        else:
+            del self._resident[handle]
+            self._resident[handle] = None
+        return art
+
+    def memory_usage(self):
+        return self.resident_bytes, len(self._resident)
+
+    def evict(self, target_bytes):
+        """Drops least recently used covers until at most target_bytes remain, keeping those the loader could not restore."""
+        if self.loader is None or self.resident_bytes <= target_bytes:
+            return
+        candidates = []
+        excess = self.resident_bytes - target_bytes
+        for handle in self._resident:
+            if excess <= 0:
+                break
+            candidates.append(handle)
+            excess -= self._sizes[handle]
+        restorable = self.persisted({self._digests[handle] for handle in candidates}) if self.persisted else set()
+        for handle in candidates:
+            if self._digests[handle] in restorable:
+                del self._resident[handle]
+                self._handles_by_id.pop(id(self._art[handle]), None)
+                self._art[handle] = None
+                self.resident_bytes -= self._sizes[handle]
+
+
+def fold_text(text):
+    """Case- and accent-folds text for searching ("Björk" -> "bjork")."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+
+def file_uri(path):
+    """
+    Returns the file URI for a local path. Every local URI Namo keeps is built here (or passed
+    through normalize_uri), so a file always maps to the same library key: GIO leaves
+    characters such as ()!$&'+,;=@ unescaped where pathlib escapes them.
+    """
+    return pathlib.Path(os.path.abspath(path)).as_uri()
+
+
+def normalize_uri(uri):
+    """Re-escapes a local file:// URI the way file_uri does; other URIs are returned unchanged."""
+    parsed = urlparse(uri)
+    if parsed.scheme != "file" or parsed.netloc not in ("", "localhost") or not parsed.path:
+        return uri
+    return file_uri(os.fsdecode(unquote_to_bytes(parsed.path)))
+
+
+class SearchIndex:
+    """
+    Trigram index over the folded "artist title" text of playlist rows, keyed by stable row id.
+    Each query word of three or more characters is answered by intersecting posting sets and
+    verifying the candidates; shorter words only filter the remaining candidates.
+    """
+
+    def __init__(self):
+        self._texts = {}
+        self._postings = {}
+
+    @staticmethod
+    def _trigrams(folded):
+        return {folded[i:i + 3] for i in range(len(folded) - 2)}
+
+    def add(self, row_id, artist, title):
+        folded = fold_text(f"{artist} {title}")
+        self._texts[row_id] = folded
+        for trigram in self._trigrams(folded):
+            posting = self._postings.get(trigram)
+            if posting is None:
+                self._postings[trigram] = {row_id}
+            else:
+                posting.add(row_id)
+
+    def remove(self, row_id):
+        folded = self._texts.pop(row_id, None)
+        if folded is None:
+            return
+        for trigram in self._trigrams(folded):
+            posting = self._postings.get(trigram)
+            if posting is not None:
+                posting.discard(row_id)
+                if not posting:
+                    del self._postings[trigram]
+
+    def clear(self):
+        self._texts.clear()
+        self._postings.clear()
+
+    def matches(self, row_id, query):
+        folded = self._texts.get(row_id, "")
+        return all(word in folded for word in fold_text(query).split())
+
+    def search(self, query):
+        """Returns the set of row ids whose text contains every word of the query."""
+        words = fold_text(query).split()
+        if not words:
+            return set(self._texts)
+        long_words = [word for word in words if len(word) >= 3]
+        short_words = [word for word in words if len(word) < 3]
+
+        if long_words:
+            candidates = None
+            for word in long_words:
+                postings = [self._postings.get(trigram) for trigram in self._trigrams(word)]
+                if any(posting is None for posting in postings):
+                    return set()
+                postings.sort(key=len)
+                word_candidates = set(postings[0]).intersection(*postings[1:])
+                candidates = word_candidates if candidates is None else candidates & word_candidates
+                if not candidates:
+                    return set()
+            texts = self._texts
+            return {row_id for row_id in candidates if all(word in texts[row_id] for word in words)}
+
+        return {row_id for row_id, folded in self._texts.items() if all(word in folded for word in short_words)}
+
+
+class PlaylistModel(GObject.Object, Gio.ListModel):
+    """
+    Array-backed playlist implementing Gio.ListModel.
+
+    Rows are stored column-wise (URI and title lists, interned artist ids, int64 durations,
+    art handles, stable row ids). Song objects are only created as lightweight views when
+    a row is requested, e.g. when the Gtk.ListView binds it, and are reused while alive.
+    Rows without a title show their file name and rows without an artist "Unknown Artist";
+    a per-row bit mask remembers which fields were missing, so iter_rows hands out None.
+    """
+    __gtype_name__ = 'NamoPlaylistModel'
+    MISSING_TITLE = 1
+    MISSING_ARTIST = 2
+
+    SORT_SPECS = {
+        "artist": ("artist", "title"),
+        "title": ("title", "artist"),
+        "duration": ("duration", "artist", "title"),
+        "path": ("path",),
+    }
+
+    def __init__(self):
+        super().__init__()
+        self.art_store = ArtStore()
+        self._uris = []
+        self._titles = []
+        self._artist_ids = array('I')
+        self._durations = array('q')
+        self._art_handles = array('I')
+        self._row_ids = array('Q')
+        self._track_ids = array('q')
+        self._missing = array('B')
+        self._artists = []
+        self._artist_ids_by_name = {}
+        self._next_row_id = 1
+        self._positions_by_row_id = {}
+        self._positions_valid = True
+        self._views = weakref.WeakValueDictionary()
+        self.search_index = None
+        self._artist_sort_keys = []
+        self._title_sort_keys = None
+
+    def do_get_item_type(self):
+        return Song.__gtype__
+
+    def do_get_n_items(self):
+        return len(self._row_ids)
+
+    def enable_search_index(self):
+        """Builds the search index on first use; from then on it is updated as rows change."""
+        if self.search_index is None:
+            self.search_index = SearchIndex()
+            for position, row_id in enumerate(self._row_ids):
+                self.search_index.add(row_id, self._artists[self._artist_ids[position]], self._titles[position])
+        return self.search_index
+
+    def do_get_item(self, position):
+        if position >= len(self._row_ids):
+            return None
+        row_id = self._row_ids[position]
+        song = self._views.get(row_id)
+        if song is None:
+            song = Song(uri=self._uris[position],
+                        title=self._titles[position],
+                        artist=self._artists[self._artist_ids[position]],
+                        duration=self._durations[position])
+            art = self.art_store.get(self._art_handles[position])
+            if art:
+                song.album_art_data = art
+            song.row_id = row_id
+            self._views[row_id] = song
+        return song
+
+    def _intern_artist(self, artist):
+        artist_id = self._artist_ids_by_name.get(artist)
+        if artist_id is None:
+            artist_id = len(self._artists)
+            self._artists.append(artist)
+            self._artist_ids_by_name[artist] = artist_id
+        return artist_id
+
+    def _append_values(self, uri, title, artist, duration_ns, album_art_data, track_id=0):
+        row_id = self._next_row_id
+        self._next_row_id += 1
+        self._positions_by_row_id[row_id] = len(self._row_ids)
+        self._row_ids.append(row_id)
+        self._track_ids.append(track_id)
+        self._missing.append((0 if title else self.MISSING_TITLE) | (0 if artist else self.MISSING_ARTIST))
+        self._uris.append(uri)
+        self._titles.append(title if title else _title_from_uri(uri))
+        self._artist_ids.append(self._intern_artist(artist if artist else "Unknown Artist"))
+        self._durations.append(duration_ns if isinstance(duration_ns, int) and duration_ns >= 0 else 0)
+        self._art_handles.append(self.art_store.add(album_art_data))
+        if self._title_sort_keys is not None:
+            self._title_sort_keys.append(locale.strxfrm(self._titles[-1]))
+        if self.search_index is not None:
+            self.search_index.add(row_id, self._artists[self._artist_ids[-1]], self._titles[-1])
+        return row_id
+
+    def _append_row(self, song):
+        row_id = self._append_values(song.uri, song.known_title, song.known_artist, song.duration, song.album_art_data)
+        if song.title != self._titles[-1]:
+            song.title = self._titles[-1]
+        song.row_id = row_id
+        self._views[row_id] = song
+
+    def append(self, song):
+        """Appends a song; the given Song becomes the view object for the new row."""
+        position = len(self._row_ids)
+        self._append_row(song)
+        self.items_changed(position, 0, 1)
+
+    def extend(self, songs):
+        """Appends many songs with a single items-changed emission."""
+        position = len(self._row_ids)
+        for song in songs:
+            self._append_row(song)
+        added = len(self._row_ids) - position
+        if added:
+            self.items_changed(position, 0, added)
+
+    def extend_rows(self, rows):
+        """
+        Appends (uri, title, artist, duration_ns, art GLib.Bytes or None[, library track id])
+        tuples without creating Song objects.
+        """
+        position = len(self._row_ids)
+        for row in rows:
+            self._append_values(*row)
+        added = len(self._row_ids) - position
+        if added:
+            self.items_changed(position, 0, added)
+
+    def remove(self, position):
+        if position >= len(self._row_ids):
+            return
+        self._views.pop(self._row_ids[position], None)
+        if self.search_index is not None:
+            self.search_index.remove(self._row_ids[position])
+        for column in (self._uris, self._titles, self._artist_ids, self._durations,
+                       self._art_handles, self._row_ids, self._track_ids, self._missing):
+            del column[position]
+        if self._title_sort_keys is not None:
+            del self._title_sort_keys[position]
+        self._positions_valid = False
+        self.items_changed(position, 1, 0)
+
+    def remove_rows(self, row_ids):
+        """Removes every row whose id is in the set row_ids, with a single items-changed emission."""
+        keep = [position for position, row_id in enumerate(self._row_ids) if row_id not in row_ids]
+        old_n_items = len(self._row_ids)
+        if len(keep) == old_n_items:
+            return
+        for row_id in row_ids:
+            self._views.pop(row_id, None)
+            if self.search_index is not None:
+                self.search_index.remove(row_id)
+        self._uris = [self._uris[position] for position in keep]
+        self._titles = [self._titles[position] for position in keep]
+        self._artist_ids = array('I', (self._artist_ids[position] for position in keep))
+        self._durations = array('q', (self._durations[position] for position in keep))
+        self._art_handles = array('I', (self._art_handles[position] for position in keep))
+        self._row_ids = array('Q', (self._row_ids[position] for position in keep))
+        self._track_ids = array('q', (self._track_ids[position] for position in keep))
+        self._missing = array('B', (self._missing[position] for position in keep))
+        if self._title_sort_keys is not None:
+            self._title_sort_keys = [self._title_sort_keys[position] for position in keep]
+        self._positions_valid = False
+        self.items_changed(0, old_n_items, len(keep))
+
+    def remove_all(self):
+        removed = len(self._row_ids)
+        self._uris = []
+        self._titles = []
+        self._artist_ids = array('I')
+        self._durations = array('q')
+        self._art_handles = array('I')
+        self._row_ids = array('Q')
+        self._track_ids = array('q')
+        self._missing = array('B')
+        self._positions_by_row_id = {}
+        self._positions_valid = True
+        self._views = weakref.WeakValueDictionary()
+        self._title_sort_keys = None
+        previous_store = self.art_store
+        self.art_store = ArtStore()
+        self.art_store.loader = previous_store.loader
+        self.art_store.persisted = previous_store.persisted
+        self.art_store.on_growth = previous_store.on_growth
+        if self.search_index is not None:
+            self.search_index.clear()
+        if removed:
+            self.items_changed(0, removed, 0)
+
+    def _sort_key_getter(self, column):
+        """Returns position -> collation key for one column. Keys are computed once and cached:
+        per distinct artist, and per row for titles (kept in step with appends and removals)."""
+        if column == "artist":
+            keys = self._artist_sort_keys
+            for artist in self._artists[len(keys):]:
+                keys.append(locale.strxfrm(artist))
+            artist_ids = self._artist_ids
+            return lambda position: keys[artist_ids[position]]
+        if column == "title":
+            if self._title_sort_keys is None:
+                self._title_sort_keys = [locale.strxfrm(title) for title in self._titles]
+            return self._title_sort_keys.__getitem__
+        if column == "duration":
+            return self._durations.__getitem__
+        if column == "path":
+            return self._uris.__getitem__
+        raise ValueError(f"Unknown sort column: {column}")
+
+    def sort_positions(self, positions, field):
+        """Sorts a list of positions in place by SORT_SPECS[field], least significant key first (stable sorts)."""
+        for column in reversed(self.SORT_SPECS[field]):
+            positions.sort(key=self._sort_key_getter(column))
+
+    def sort_key(self, position, field):
+        """Composite sort key of one row, for incremental inserts into a sorted view."""
+        return tuple(self._sort_key_getter(column)(position) for column in self.SORT_SPECS[field])
+
+    def row_id_at(self, position):
+        return self._row_ids[position]
+
+    def position_of_row(self, row_id):
+        """Returns the current position of a stable row id, or None if it was removed."""
+        if not self._positions_valid:
+            self._positions_by_row_id = {row_id: position for position, row_id in enumerate(self._row_ids)}
+            self._positions_valid = True
+        return self._positions_by_row_id.get(row_id)
+
+    def find(self, song):
+        """Same contract as Gio.ListStore.find: returns (found, position)."""
+        position = self.position_of_row(song.row_id) if song and song.row_id else None
+        return (position is not None, position if position is not None else 0)
+
+    def find_uri(self, uri):
+        """Returns the position of the first row with this URI, or None."""
+        try:
+            return self._uris.index(uri)
+        except ValueError:
+            return None
+
+    def get_uri(self, position):
+        return self._uris[position]
+
+    def get_duration(self, position):
+        return self._durations[position]
+
+    def total_duration(self, start=0):
+        """Sum of known durations from `start` to the end, in nanoseconds."""
+        return sum(self._durations[start:])
+
+    def track_ids(self):
+        """Returns the library track ids of all rows; 0 marks rows not yet in the library."""
+        return array('q', self._track_ids)
+
+    def row_ids(self):
+        """Returns the stable row ids of all rows, in playlist order."""
+        return array('Q', self._row_ids)
+
+    def assign_track_ids(self, positions, track_ids):
+        for position, track_id in zip(positions, track_ids):
+            self._track_ids[position] = track_id
+
+    def iter_rows(self, positions=None, with_art=True):
+        """
+        Yields (uri, title, artist, duration_ns, art GLib.Bytes or None) without creating Song views,
+        for all rows or the given positions. title and artist are None where the row has none.
+        with_art=False yields None for art, so evicted covers are not reloaded.
+        """
+        for position in (range(len(self._row_ids)) if positions is None else positions):
+            missing = self._missing[position]
+            yield (self._uris[position],
+                   None if missing & self.MISSING_TITLE else self._titles[position],
+                   None if missing & self.MISSING_ARTIST else self._artists[self._artist_ids[position]],
+                   self._durations[position],
+                   self.art_store.get(self._art_handles[position]) if with_art else None)
+
+    def memory_usage(self):
+        """Approximate (bytes, rows) of the row columns; the strings are measured one by one."""
+        total = sum(len(column) * column.itemsize for column in
+                    (self._artist_ids, self._durations, self._art_handles, self._row_ids, self._track_ids,
+                     self._missing))
+        total += sum(sys.getsizeof(text) for text in self._uris)
+        total += sum(sys.getsizeof(text) for text in self._titles)
+        total += sum(sys.getsizeof(text) for text in self._artists)
+        total += sys.getsizeof(self._uris) + sys.getsizeof(self._titles) + sys.getsizeof(self._positions_by_row_id)
+        return total, len(self._row_ids)
+
+
+class PlaylistViewModel(GObject.Object, Gio.ListModel):
+    """
+    The playlist as shown in the ListView: the PlaylistModel narrowed by the search filter
+    and ordered by the chosen sort. With neither active it passes positions straight through;
+    otherwise it holds only a list of row ids in display order, never a copy of the rows.
+    """
+    __gtype_name__ = 'NamoPlaylistViewModel'
+    INCREMENTAL_INSERT_LIMIT = 64
+
+    def __init__(self, source):
+        super().__init__()
+        self.source = source
+        self._filter_text = ""
+        self._sort_field = None
+        self._row_ids = None
+        self._positions = None
+        self.source.connect("items-changed", self._on_source_items_changed)
+
+    def do_get_item_type(self):
+        return Song.__gtype__
+
+    def do_get_n_items(self):
+        if self._row_ids is None:
+            return self.source.get_n_items()
+        return len(self._row_ids)
+
+    def do_get_item(self, position):
+        source_position = self.source_position(position)
+        return self.source.get_item(source_position) if source_position is not None else None
+
+    def source_position(self, position):
+        """Maps a view position to a PlaylistModel position (None if out of range)."""
+        if self._row_ids is None:
+            return position if position < self.source.get_n_items() else None
+        if position >= len(self._row_ids):
+            return None
+        return self.source.position_of_row(self._row_ids[position])
+
+    def view_position(self, song):
+        """Returns the view position of a song, or None if it is filtered out or gone."""
+        found, source_position = self.source.find(song)
+        if not found:
+            return None
+        if self._row_ids is None:
+            return source_position
+        return self.position_of_row(song.row_id)
+
+    def row_id_at(self, position):
+        """Returns the row id shown at a view position."""
+        if self._row_ids is None:
+            return self.source.row_id_at(position)
+        return self._row_ids[position]
+
+    def position_of_row(self, row_id):
+        """Returns the view position of a row id, or None if it is filtered out or gone."""
+        if self._row_ids is None:
+            return self.source.position_of_row(row_id)
+        if self._positions is None:
+            self._positions = {row_id: position for position, row_id in enumerate(self._row_ids)}
+        return self._positions.get(row_id)
+
+    def _is_identity(self):
+        return not self._filter_text and self._sort_field is None
+
+    def _refresh(self):
+        old_n_items = self.get_n_items()
+        self._row_ids = None if self._is_identity() else self._compute_rows()
+        self._positions = None
+        self.items_changed(0, old_n_items, self.get_n_items())
+
+    def set_filter_text(self, text):
+        text = text.strip()
+        if text == self._filter_text:
+            return
+        self._filter_text = text
+        self._refresh()
+
+    def set_sort_field(self, field):
+        """Sorts the view by one of PlaylistModel.SORT_SPECS, or restores load order with None."""
+        if field == self._sort_field:
+            return
+        self._sort_field = field
+        self._refresh()
+
+    def _compute_rows(self):
+        started = time.monotonic()
+        source = self.source
+        if self._filter_text:
+            matches = source.enable_search_index().search(self._filter_text)
+            positions = sorted(source.position_of_row(row_id) for row_id in matches)
+        else:
+            positions = list(range(source.get_n_items()))
+        if self._sort_field:
+            source.sort_positions(positions, self._sort_field)
+        row_ids = [source.row_id_at(position) for position in positions]
+        print(f"Playlist view (filter='{self._filter_text}', sort={self._sort_field}): "
+              f"{len(row_ids)} rows in {(time.monotonic() - started) * 1000:.1f} ms")
+        return row_ids
+
+    def _on_source_items_changed(self, source, position, removed, added):
+        if self._row_ids is None:
+            self.items_changed(position, removed, added)
+            return
+        if removed == 0 and position + added == source.get_n_items() and added <= self.INCREMENTAL_INSERT_LIMIT:
+            new_ids = [source.row_id_at(p) for p in range(position, position + added)]
+            if self._filter_text:
+                index = source.search_index
+                new_ids = [row_id for row_id in new_ids if index.matches(row_id, self._filter_text)]
+            if self._sort_field is None:
+                if new_ids:
+                    start = len(self._row_ids)
+                    self._row_ids.extend(new_ids)
+                    self._positions = None
+                    self.items_changed(start, 0, len(new_ids))
+                return
+            row_key = lambda row_id: source.sort_key(source.position_of_row(row_id), self._sort_field)
+            for row_id in new_ids:
+                insert_at = bisect.bisect_right(self._row_ids, row_key(row_id), key=row_key)
+                self._row_ids.insert(insert_at, row_id)
+                self._positions = None
+                self.items_changed(insert_at, 0, 1)
+            return
+        self._refresh_after_source_change()
+
+    def _refresh_after_source_change(self):
+        old_n_items = len(self._row_ids)
+        self._row_ids = self._compute_rows()
+        self._positions = None
+        self.items_changed(0, old_n_items, len(self._row_ids))
+
+
+class PlayQueue:
+    """
+    Playback order over a PlaylistModel, kept apart from the list selection.
+
+    Rows are tracked by stable row id. Linear order follows the view (the playlist as
+    filtered and sorted in the list), or playlist positions when no view is given. Shuffle
+    order is drawn lazily, one random pick from the not-yet-played rows per step, so
+    enabling it is O(n) once and next/prev are O(1). Already drawn entries never move
+    when rows are inserted (new rows join the undrawn pool) or removed (dead ids are
+    skipped). "Play next" rows wait in a FIFO that is consumed before the normal order.
+    """
+    REPEAT_MODES = ("none", "all", "one")
+    HISTORY_LIMIT = 1000
+
+    def __init__(self, playlist, view=None):
+        self.playlist = playlist
+        self.view = view or playlist
+        self.current_row_id = None
+        self.shuffle = False
+        self.repeat = "none"
+        self._anchor_position = -1
+        self._up_next = deque()
+        self._order = []
+        self._cursor = -1
+        self._remaining = []
+        self._remaining_index = {}
+        self._known = set()
+        playlist.connect("items-changed", self._on_items_changed)
+
+    def _alive(self, row_id):
+        return self.playlist.position_of_row(row_id) is not None
+
+    def _add_remaining(self, row_id):
+        self._remaining_index[row_id] = len(self._remaining)
+        self._remaining.append(row_id)
+
+    def _discard_remaining(self, row_id):
+        """Swap-removes row_id from the undrawn pool in O(1)."""
+        index = self._remaining_index.pop(row_id, None)
+        if index is None:
+            return
+        last = self._remaining.pop()
+        if last != row_id:
+            self._remaining[index] = last
+            self._remaining_index[last] = index
+
+    def _refill_remaining(self):
+        self._remaining = []
+        self._remaining_index = {}
+        self._known = set()
+        for position in range(self.playlist.get_n_items()):
+            row_id = self.playlist.row_id_at(position)
+            self._known.add(row_id)
+            if row_id != self.current_row_id:
+                self._add_remaining(row_id)
+
+    def _draw(self):
+        """Appends one random undrawn row to the shuffle order. Returns False when the cycle is exhausted."""
+        while True:
+            if not self._remaining:
+                if self.repeat != "all" or self.playlist.get_n_items() == 0:
+                    return False
+                self._refill_remaining()
+                if not self._remaining:
+                    return False
+            row_id = self._remaining[random.randrange(len(self._remaining))]
+            self._discard_remaining(row_id)
+            if self._alive(row_id):
+                self._order.append(row_id)
+                return True
+
+    def _following(self, auto):
+        """
+        Yields (source, index, row_id) for the rows that would play after the current one.
+        Shuffle order is drawn as far as it is iterated, so peeking and advancing agree.
+        """
+        current = self.current_row_id
+        if auto and self.repeat == "one" and current is not None and self._alive(current):
+            yield ("current", 0, current)
+            return
+        for index, row_id in enumerate(self._up_next):
+            if self._alive(row_id):
+                yield ("up_next", index, row_id)
+        if self.shuffle:
+            index = self._cursor + 1
+            while True:
+                if index >= len(self._order) and not self._draw():
+                    return
+                row_id = self._order[index]
+                if row_id != current and self._alive(row_id):
+                    yield ("order", index, row_id)
+                index += 1
+        else:
+            n_items = self.view.get_n_items()
+            position = self._view_position(current, n_items)
+            for step in range(1, n_items + 1):
+                next_position = position + step
+                if next_position >= n_items:
+                    if self.repeat != "all":
+                        return
+                    next_position -= n_items
+                yield ("linear", next_position, self.view.row_id_at(next_position))
+
+    def _view_position(self, row_id, n_items):
+        """
+        The view position linear order continues from. A row hidden by the filter (e.g. one
+        queued with play_next) continues after the last shown row that played; a removed
+        row continues with the row that took its place.
+        """
+        if row_id is None:
+            return -1
+        position = self.view.position_of_row(row_id)
+        if position is not None:
+            return position
+        if self._alive(row_id):
+            return min(self._anchor_position, n_items - 1)
+        return min(self._anchor_position, n_items) - 1
+
+    def upcoming(self, count, auto=True):
+        """Returns up to count row ids in the order they will play, without advancing."""
+        rows = []
+        for _, _, row_id in self._following(auto):
+            if len(rows) == count:
+                break
+            rows.append(row_id)
+        return rows
+
+    def peek_next(self, auto=True):
+        rows = self.upcoming(1, auto)
+        return rows[0] if rows else None
+
+    def advance(self, auto=True):
+        """
+        Moves to the next row and returns its id, or None at the end of the queue.
+        auto is True for track ends (repeat-one replays) and False for the Next button.
+        """
+        for source, index, row_id in self._following(auto):
+            if source == "up_next":
+                for _ in range(index + 1):
+                    self._up_next.popleft()
+                self._enter_shuffle_order(row_id)
+            elif source == "order":
+                self._cursor = index
+            self._set_current(row_id)
+            if self._cursor > 2 * self.HISTORY_LIMIT:
+                trim = self._cursor - self.HISTORY_LIMIT
+                del self._order[:trim]
+                self._cursor -= trim
+            return row_id
+        return None
+
+    def previous(self):
+        """Moves back one row (the previous shuffle pick, or the previous view position) and returns its id."""
+        if self.shuffle:
+            index = self._cursor - 1
+            while index >= 0:
+                row_id = self._order[index]
+                if self._alive(row_id):
+                    self._cursor = index
+                    self._set_current(row_id)
+                    return row_id
+                index -= 1
+            return None
+        n_items = self.view.get_n_items()
+        position = self._view_position(self.current_row_id, n_items)
+        if position < 0 or n_items == 0:
+            return None
+        if self.view.position_of_row(self.current_row_id) is None and position < n_items:
+            row_id = self.view.row_id_at(position)
+            self._set_current(row_id)
+            return row_id
+        if position == 0:
+            if self.repeat != "all":
+                return None
+            position = n_items
+        row_id = self.view.row_id_at(position - 1)
+        self._set_current(row_id)
+        return row_id
+
+    def set_current(self, row_id):
+        """Makes row_id the playing row, e.g. after the user activated it in the list."""
+        if row_id == self.current_row_id:
+            return
+        self._enter_shuffle_order(row_id)
+        self._set_current(row_id)
+
+    def _set_current(self, row_id):
+        self.current_row_id = row_id
+        position = self.view.position_of_row(row_id)
+        if position is not None:
+            self._anchor_position = position
+
+    def _enter_shuffle_order(self, row_id):
+        """Puts a row chosen outside the shuffle order right after the cursor, so Previous returns to the last track."""
+        if not self.shuffle:
+            return
+        if self._cursor + 1 < len(self._order) and self._order[self._cursor + 1] == row_id:
+            self._cursor += 1
+            return
+        if row_id in self._order[self._cursor + 1:]:
+            del self._order[self._order.index(row_id, self._cursor + 1)]
+        self._discard_remaining(row_id)
+        self._order.insert(self._cursor + 1, row_id)
+        self._cursor += 1
+
+    def play_next(self, row_ids):
+        """Queues rows to play after the current one and anything queued before, ahead of the normal order."""
+        self._up_next.extend(row_ids)
+
+    def set_shuffle(self, enabled):
+        """Turns shuffle on or off. Turning it on starts a fresh permutation from the current row."""
+        self.shuffle = enabled
+        self._order = [self.current_row_id] if self.current_row_id is not None else []
+        self._cursor = len(self._order) - 1
+        if enabled:
+            self._refill_remaining()
+        else:
+            self._remaining = []
+            self._remaining_index = {}
+            self._known = set()
+
+    def set_repeat(self, mode):
+        if mode not in self.REPEAT_MODES:
+            raise ValueError(f"Unknown repeat mode: {mode}")
+        self.repeat = mode
+
+    def _on_items_changed(self, playlist, position, removed, added):
+        if playlist.get_n_items() == 0:
+            self.current_row_id = None
+            self._anchor_position = -1
+            self._up_next.clear()
+            if self.shuffle:
+                self.set_shuffle(True)
+            return
+        if not self.shuffle:
+            return
+        for new_position in range(position, position + added):
+            row_id = playlist.row_id_at(new_position)
+            if row_id not in self._known:
+                self._known.add(row_id)
+                self._add_remaining(row_id)
+
+
+class Library:
+    """
+    The music library: one SQLite row per track (keyed by URI) and each distinct cover
+    stored once. Playlists are ordered lists of track ids packed into a single BLOB, so
+    saving one is a single small write and loading one is a few indexed lookups.
+    Smart playlists store a query instead (see compile_query). Their results are computed
+    once per session with indexed lookups and then kept up to date as tracks are added,
+    changed or removed, by matching only the affected tracks.
+    Safe to use from any thread.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS art (
+            id INTEGER PRIMARY KEY,
+            digest BLOB NOT NULL UNIQUE,
+            data BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS tracks (
+            id INTEGER PRIMARY KEY,
+            uri TEXT NOT NULL UNIQUE,
+            title TEXT,
+            artist TEXT,
+            album TEXT,
+            duration_ns INTEGER NOT NULL DEFAULT 0,
+            art_id INTEGER REFERENCES art(id),
+            added_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS tracks_artist ON tracks (artist COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS tracks_album ON tracks (album COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS tracks_duration ON tracks (duration_ns);
+        CREATE INDEX IF NOT EXISTS tracks_added_at ON tracks (added_at);
+        CREATE TABLE IF NOT EXISTS playlists (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            track_ids BLOB NOT NULL DEFAULT x'',
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS smart_playlists (
+            playlist_id INTEGER PRIMARY KEY REFERENCES playlists(id),
+            query TEXT NOT NULL
+        );
+    """
+    QUERY_CHUNK = 500
+    QUERY_FIELDS = ("artist", "album", "min_duration_s", "max_duration_s", "added_within_days", "folder")
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(self.SCHEMA)
+        if self._db.execute("PRAGMA user_version").fetchone()[0] < 1:
+            with self._db:
+                self._normalize_uris()
+                self._db.execute("PRAGMA user_version = 1")
+        self._art_ids = {}
+        self._art_bytes = {}
+        self._smart = {}
+        for name, query in self._db.execute(
+                "SELECT p.name, s.query FROM smart_playlists s JOIN playlists p ON p.id = s.playlist_id"):
+            self._smart[name] = {"query": json.loads(query), "ids": None, "members": None}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _normalize_uris(self):
+        """
+        One-time upgrade of libraries written before file_uri: re-escapes stored file URIs and
+        merges tracks that turn out to be the same file, pointing playlists at the kept track.
+        """
+        merged = {}
+        for track_id, uri in self._db.execute("SELECT id, uri FROM tracks WHERE uri LIKE 'file:%'").fetchall():
+            normalized = normalize_uri(uri)
+            if normalized == uri:
+                continue
+            existing = self._db.execute("SELECT id FROM tracks WHERE uri = ?", (normalized,)).fetchone()
+            if existing:
+                merged[track_id] = existing[0]
+                self._db.execute("DELETE FROM tracks WHERE id = ?", (track_id,))
+            else:
+                self._db.execute("UPDATE tracks SET uri = ? WHERE id = ?", (normalized, track_id))
+        if not merged:
+            return
+        for playlist_id, blob in self._db.execute("SELECT id, track_ids FROM playlists").fetchall():
+            track_ids = array('q')
+            track_ids.frombytes(blob)
+            if any(track_id in merged for track_id in track_ids):
+                remapped = array('q', (merged.get(track_id, track_id) for track_id in track_ids))
+                self._db.execute("UPDATE playlists SET track_ids = ? WHERE id = ?", (remapped.tobytes(), playlist_id))
+
+    def _art_id_locked(self, glib_bytes):
+        """Returns the art row id for glib_bytes, inserting it once. Repeated objects skip rehashing."""
+        if glib_bytes is None:
+            return None
+        cached = self._art_ids.get(id(glib_bytes))
+        if cached is not None and cached[0] is glib_bytes:
+            return cached[1]
+        data = glib_bytes.get_data()
+        digest = hashlib.sha1(data).digest()
+        self._db.execute("INSERT OR IGNORE INTO art (digest, data) VALUES (?, ?)", (digest, data))
+        art_id = self._db.execute("SELECT id FROM art WHERE digest = ?", (digest,)).fetchone()[0]
+        self._art_ids[id(glib_bytes)] = (glib_bytes, art_id)
+        self._art_bytes.setdefault(art_id, glib_bytes)
+        return art_id
+
+    @staticmethod
+    def folder_uri_range(folder_path):
+        """Returns (low, high) so that low <= uri < high holds exactly for file URIs inside folder_path."""
+        prefix = file_uri(folder_path).rstrip("/") + "/"
+        return prefix, prefix[:-1] + "0"
+
+    @classmethod
+    def compile_query(cls, query):
+        """
+        Turns a smart playlist query into an SQL condition and its parameters. Every field is
+        optional and they are combined with AND:
+        artist, album: exact name, ignoring case; min_duration_s, max_duration_s: length range;
+        added_within_days: tracks added to the library recently; folder: files inside a folder.
+        Each field maps onto an index (a folder becomes a range over the URI index).
+        Raises ValueError for unknown fields or bad values: names that are not strings, and
+        numbers that are not finite or do not fit SQLite's 64-bit integers once scaled.
+        """
+        if not isinstance(query, dict):
+            raise ValueError("a smart playlist query must be an object")
+        unknown = set(query) - set(cls.QUERY_FIELDS)
+        if unknown:
+            raise ValueError(f"unknown smart playlist fields: {', '.join(sorted(unknown))}")
+        clauses = []
+        params = []
+        for field in ("artist", "album", "folder"):
+            if query.get(field) is not None and not isinstance(query[field], str):
+                raise ValueError(f"bad smart playlist value for {field}: expected text")
+        for field in ("artist", "album"):
+            if query.get(field):
+                clauses.append(f"{field} = ? COLLATE NOCASE")
+                params.append(query[field])
+        if query.get("min_duration_s") is not None:
+            clauses.append("duration_ns >= ?")
+            params.append(cls._query_integer(query, "min_duration_s", Gst.SECOND))
+        if query.get("max_duration_s") is not None:
+            clauses.append("duration_ns > 0 AND duration_ns <= ?")
+            params.append(cls._query_integer(query, "max_duration_s", Gst.SECOND))
+        if query.get("added_within_days") is not None:
+            clauses.append("added_at >= ?")
+            params.append(time.time() - cls._query_integer(query, "added_within_days", 86400))
+        if query.get("folder"):
+            clauses.append("uri >= ? AND uri < ?")
+            params.extend(cls.folder_uri_range(os.path.expanduser(query["folder"])))
+        return (" AND ".join(clauses) or "1"), params
+
+    @staticmethod
+    def _query_integer(query, field, scale):
+        """Returns query[field] * scale as an int, raising ValueError unless it is a finite number within int64."""
+        value = query[field]
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError(f"bad smart playlist value for {field}: expected a number")
+        try:
+            value = float(value)
+        except ValueError:
+            raise ValueError(f"bad smart playlist value for {field}: {query[field]!r} is not a number") from None
+        if not math.isfinite(value) or not -2**63 <= value * scale < 2**63:
+            raise ValueError(f"bad smart playlist value for {field}: {query[field]!r} is out of range")
+        return int(value * scale)
+
+    def _evaluate_smart_locked(self, entry):
+        """Computes a smart playlist's tracks. A stored query that is no longer valid matches nothing."""
+        try:
+            where, params = self.compile_query(entry["query"])
+        except ValueError as e:
+            print(f"Library: ignoring smart playlist query {entry['query']}: {e}", file=sys.stderr)
+            entry["ids"], entry["members"] = array('q'), set()
+            return
+        entry["ids"] = array('q', sorted(track_id for (track_id,) in self._db.execute(
+            f"SELECT id FROM tracks WHERE {where}", params)))
+        entry["members"] = set(entry["ids"])
+
+    def _update_smart_locked(self, changed_ids=(), removed_ids=()):
+        """Brings materialized smart playlists up to date by matching only the changed tracks."""
+        removed = set(removed_ids)
+        for entry in self._smart.values():
+            if entry["ids"] is None:
+                continue
+            members = entry["members"]
+            matched = set()
+            if changed_ids:
+                try:
+                    where, params = self.compile_query(entry["query"])
+                except ValueError:
+                    continue
+                unique_ids = list(dict.fromkeys(changed_ids))
+                for start in range(0, len(unique_ids), self.QUERY_CHUNK):
+                    chunk = unique_ids[start:start + self.QUERY_CHUNK]
+                    query = f"SELECT id FROM tracks WHERE id IN ({','.join('?' * len(chunk))}) AND {where}"
+                    matched.update(track_id for (track_id,) in self._db.execute(query, chunk + params))
+                dropped = (members.intersection(changed_ids) - matched) | (removed & members)
+            else:
+                dropped = removed & members
+            if dropped:
+                members.difference_update(dropped)
+                entry["ids"] = array('q', (track_id for track_id in entry["ids"] if track_id not in dropped))
+            for track_id in dict.fromkeys(changed_ids):
+                if track_id in matched and track_id not in members:
+                    members.add(track_id)
+                    entry["ids"].append(track_id)
+
+    def add_tracks(self, rows):
+        """
+        Inserts or updates (uri, title, artist, album, duration_ns, art GLib.Bytes or None) rows
+        in one transaction and returns their track ids in the same order. Known fields of an
+        existing track are kept when the new row lacks them (None, or a duration of 0); known
+        new values replace the stored ones, so a re-encoded file gets its new duration.
+        """
+        now = time.time()
+        track_ids = []
+        with self._lock, self._db:
+            for uri, title, artist, album, duration_ns, art in rows:
+                self._db.execute(
+                    "INSERT INTO tracks (uri, title, artist, album, duration_ns, art_id, added_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (uri) DO UPDATE SET title = COALESCE(excluded.title, title), "
+                    "artist = COALESCE(excluded.artist, artist), "
+                    "album = COALESCE(excluded.album, album), "
+                    "duration_ns = CASE WHEN excluded.duration_ns > 0 THEN excluded.duration_ns ELSE duration_ns END, "
+                    "art_id = COALESCE(excluded.art_id, art_id)",
+                    (uri, title, artist, album, duration_ns, self._art_id_locked(art), now))
+                track_ids.append(self._db.execute("SELECT id FROM tracks WHERE uri = ?", (uri,)).fetchone()[0])
+            self._update_smart_locked(changed_ids=track_ids)
+        return track_ids
+
+    def remove_missing(self, folder_path, present_uris):
+        """
+        Deletes the tracks inside folder_path whose URI is not in present_uris and whose file
+        no longer exists. Files the scan does not pick up, such as other formats added from a
+        playlist, stay. Returns the deleted ids.
+        """
+        low, high = self.folder_uri_range(folder_path)
+        with self._lock:
+            unseen = [(track_id, uri) for track_id, uri in
+                      self._db.execute("SELECT id, uri FROM tracks WHERE uri >= ? AND uri < ?", (low, high))
+                      if uri not in present_uris]
+        gone = [track_id for track_id, uri in unseen if not os.path.exists(unquote(urlparse(uri).path))]
+        with self._lock, self._db:
+            for start in range(0, len(gone), self.QUERY_CHUNK):
+                chunk = gone[start:start + self.QUERY_CHUNK]
+                self._db.execute(f"DELETE FROM tracks WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+            self._update_smart_locked(removed_ids=gone)
+        return gone
+
+    def art_by_digest(self, digest):
+        """Returns the stored cover with this SHA-1 digest as GLib.Bytes, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT data FROM art WHERE digest = ?", (digest,)).fetchone()
+        return GLib.Bytes.new(row[0]) if row else None
+
+    def stored_art_digests(self, digests):
+        """Returns the subset of digests whose covers are stored in the library."""
+        digests = list(digests)
+        found = set()
+        with self._lock:
+            for start in range(0, len(digests), self.QUERY_CHUNK):
+                chunk = digests[start:start + self.QUERY_CHUNK]
+                query = f"SELECT digest FROM art WHERE digest IN ({','.join('?' * len(chunk))})"
+                found.update(digest for (digest,) in self._db.execute(query, chunk))
+        return found
+
+    def cache_usage(self):
+        """Returns (bytes, entries) of covers held by the in-memory lookup caches."""
+        with self._lock:
+            held = {id(glib_bytes): glib_bytes for glib_bytes in self._art_bytes.values()}
+            held.update((key, entry[0]) for key, entry in self._art_ids.items())
+            return sum(glib_bytes.get_size() for glib_bytes in held.values()), len(held)
+
+    def trim_cache(self, target_bytes):
+        """Empties the lookup caches if they hold more than target_bytes; they refill from the database."""
+        if self.cache_usage()[0] > target_bytes:
+            with self._lock:
+                self._art_bytes.clear()
+                self._art_ids.clear()
+
+    def _art_bytes_locked(self, art_ids):
+        missing = [art_id for art_id in art_ids if art_id not in self._art_bytes]
+        for start in range(0, len(missing), self.QUERY_CHUNK):
+            chunk = missing[start:start + self.QUERY_CHUNK]
+            query = f"SELECT id, data FROM art WHERE id IN ({','.join('?' * len(chunk))})"
+            for art_id, data in self._db.execute(query, chunk):
+                self._art_bytes[art_id] = GLib.Bytes.new(data)
+
+    def get_rows(self, track_ids):
+        """
+        Returns (uri, title, artist, duration_ns, art GLib.Bytes or None, track_id) for each id
+        that still exists, in the given order, ready for PlaylistModel.extend_rows. Covers are
+        decoded once and the same GLib.Bytes is handed out for every track that uses them.
+        """
+        found = {}
+        with self._lock:
+            unique_ids = list(dict.fromkeys(track_ids))
+            for start in range(0, len(unique_ids), self.QUERY_CHUNK):
+                chunk = unique_ids[start:start + self.QUERY_CHUNK]
+                query = (f"SELECT id, uri, title, artist, duration_ns, art_id FROM tracks "
+                         f"WHERE id IN ({','.join('?' * len(chunk))})")
+                for row in self._db.execute(query, chunk):
+                    found[row[0]] = row
+            self._art_bytes_locked({row[5] for row in found.values() if row[5] is not None})
+            art_bytes = self._art_bytes
+            return [(row[1], row[2], row[3], row[4], art_bytes.get(row[5]), row[0])
+                    for row in (found.get(track_id) for track_id in track_ids) if row]
+
+    def playlist_names(self):
+        with self._lock:
+            return [name for (name,) in self._db.execute("SELECT name FROM playlists ORDER BY id")]
+
+    def create_playlist(self, name):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO playlists (name, updated_at) VALUES (?, ?)", (name, time.time()))
+
+    def create_smart_playlist(self, name, query):
+        """Stores a smart playlist; raises ValueError if the query does not compile or the name is taken."""
+        self.compile_query(query)
+        with self._lock, self._db:
+            try:
+                cursor = self._db.execute("INSERT INTO playlists (name, updated_at) VALUES (?, ?)", (name, time.time()))
+            except sqlite3.IntegrityError:
+                raise ValueError(f"a playlist named '{name}' already exists") from None
+            self._db.execute("INSERT INTO smart_playlists (playlist_id, query) VALUES (?, ?)",
+                             (cursor.lastrowid, json.dumps(query)))
+            self._smart[name] = {"query": query, "ids": None, "members": None}
+
+    def is_smart(self, name):
+        return name in self._smart
+
+    def delete_playlist(self, name):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM smart_playlists WHERE playlist_id IN (SELECT id FROM playlists WHERE name = ?)",
+                             (name,))
+            self._db.execute("DELETE FROM playlists WHERE name = ?", (name,))
+            self._smart.pop(name, None)
+
+    def load_playlist(self, name):
+        """Returns the playlist's track ids as an array, or None if there is no such playlist."""
+        with self._lock:
+            entry = self._smart.get(name)
+            if entry is not None:
+                if entry["ids"] is None or entry["query"].get("added_within_days") is not None:
+                    self._evaluate_smart_locked(entry)
+                return array('q', entry["ids"])
+            row = self._db.execute("SELECT track_ids FROM playlists WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        track_ids = array('q')
+        track_ids.frombytes(row[0])
+        return track_ids
+
+    def append_to_playlist(self, name, track_ids):
+        """Appends track ids to a stored regular playlist. Smart and unknown playlists are left alone."""
+        if name in self._smart:
+            return
+        with self._lock, self._db:
+            row = self._db.execute("SELECT track_ids FROM playlists WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return
+            self._db.execute("UPDATE playlists SET track_ids = ?, updated_at = ? WHERE name = ?",
+                             (row[0] + array('q', track_ids).tobytes(), time.time(), name))
+
+    def save_playlist(self, name, track_ids):
+        """Stores the track ids of a regular playlist. Smart playlists are left alone."""
+        if name in self._smart:
+            return
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO playlists (name, track_ids, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET track_ids = excluded.track_ids, updated_at = excluded.updated_at",
+                (name, array('q', track_ids).tobytes(), time.time()))
+
+
+class StreamMetrics:
+    """
+    Time-to-first-audio and rebuffering stalls of remote tracks. Buffering before the first
+    audio counts towards time-to-first-audio; buffering right after a seek is counted apart
+    from stalls, since the user asked for it.
+    """
+    def __init__(self):
+        self.tracks = 0
+        self.first_audio_ms = []
+        self.stalls = 0
+        self.stall_seconds = 0.0
+        self.seek_rebuffers = 0
+        self._track = None
+
+    def start_track(self, uri):
+        self.finish_track()
+        self._track = {"uri": uri, "started": time.monotonic(), "first_audio_ms": None,
+                       "stalls": 0, "stall_seconds": 0.0, "stall_started": None,
+                       "seek_pending": False, "seek_rebuffer": False}
+
+    def first_audio(self):
+        track = self._track
+        if track and track["first_audio_ms"] is None:
+            track["first_audio_ms"] = (time.monotonic() - track["started"]) * 1000
+            self.first_audio_ms.append(track["first_audio_ms"])
+            print(f"Stream: first audio after {track['first_audio_ms']:.0f} ms")
+
+    def note_seek(self):
+        if self._track:
+            self._track["seek_pending"] = True
+
+    def seek_done(self):
+        if self._track and self._track["stall_started"] is None:
+            self._track["seek_pending"] = False
+
+    def stall_started(self):
+        track = self._track
+        if not track or track["first_audio_ms"] is None or track["stall_started"] is not None:
+            return
+        track["stall_started"] = time.monotonic()
+        track["seek_rebuffer"] = track["seek_pending"]
+        track["seek_pending"] = False
+
+    def stall_ended(self):
+        track = self._track
+        if not track or track["stall_started"] is None:
+            return
+        seconds = time.monotonic() - track["stall_started"]
+        track["stall_started"] = None
+        if track["seek_rebuffer"]:
+            self.seek_rebuffers += 1
+            print(f"Stream: rebuffered {seconds:.1f} s after seeking")
+        else:
+            track["stalls"] += 1
+            track["stall_seconds"] += seconds
+            print(f"Stream: stalled for {seconds:.1f} s")
+
+    def finish_track(self):
+        """Closes the current remote track, if any, and logs its numbers."""
+        track = self._track
+        self._track = None
+        if not track:
+            return
+        self.stall_ended()
+        self.tracks += 1
+        self.stalls += track["stalls"]
+        self.stall_seconds += track["stall_seconds"]
+        first_audio = f"{track['first_audio_ms']:.0f} ms" if track["first_audio_ms"] is not None else "never"
+        print(f"Stream stats for {track['uri']}: first audio {first_audio}, "
+              f"{track['stalls']} stalls ({track['stall_seconds']:.1f} s)")
+
+    def summary(self):
+        if not self.tracks:
+            return "no remote tracks played"
+        samples = sorted(self.first_audio_ms)
+        median = f"{samples[len(samples) // 2]:.0f} ms" if samples else "n/a"
+        return (f"{self.tracks} remote tracks, median time-to-first-audio {median}, "
+                f"{self.stalls} stalls ({self.stall_seconds:.1f} s), {self.seek_rebuffers} rebuffers after seeks")
+
+
+def handle_buffering(player, metrics, percent, buffering, wants_playing):
+    """
+    Applies one BUFFERING message to a network playbin: pauses it while the source refills its
+    buffer and resumes it once the buffer is full, instead of letting the sink run dry and
+    stutter, and reports the stall to metrics (a StreamMetrics). The player is only paused or
+    resumed when wants_playing is set. Returns whether the source is still buffering.
+    """
+    if percent < 100:
+        if not buffering:
+            metrics.stall_started()
+            if wants_playing:
+                player.set_state(Gst.State.PAUSED)
+        return True
+    if buffering:
+        metrics.stall_ended()
+        if wants_playing:
+            player.set_state(Gst.State.PLAYING)
+    return False
+
+
+class ScanGovernor:
+    """
+    Keeps background folder scans from competing with playback. Scan threads drop to idle I/O
+    priority and a higher nice value. They are held to a shared files-per-second and
+    bytes-per-second ceiling, and they pause while the main loop lags or a stream rebuffers.
+    A scan pauses for at most MAX_BACKOFF_PER_SCAN_S in total, so constant pressure slows it
+    down once instead of on every file. Bytes are what the scan thread itself reads (from
+    /proc), or the file size where that is not available.
+    """
+    NICE_INCREMENT = 10
+    IOPRIO_CLASS_IDLE = 3
+    BACKOFF_STEP_S = 0.2
+    MAX_BACKOFF_PER_SCAN_S = 60.0
+    PRESSURE_HOLD_S = 1.0
+
+    def __init__(self, max_files_per_second=0, max_bytes_per_second=0, low_priority=True, latency_threshold_ms=50):
+        self.max_files_per_second = max_files_per_second
+        self.max_bytes_per_second = max_bytes_per_second
+        self.low_priority = low_priority
+        self.latency_threshold_ms = latency_threshold_ms
+        self.playback_starved = False
+        self.backoff_seconds = 0.0
+        self._lock = threading.Lock()
+        self._active = 0
+        self._files_due = 0.0
+        self._bytes_due = 0.0
+        self._pressure_until = 0.0
+        self._thread_state = threading.local()
+
+    @property
+    def active(self):
+        return self._active
+
+    def begin_scan(self):
+        with self._lock:
+            self._active += 1
+
+    def end_scan(self):
+        with self._lock:
+            self._active -= 1
+
+    def enter_thread(self):
+        """Called at the start of a scan thread: lowers its CPU and I/O priority and starts counting its reads."""
+        if self.low_priority:
+            tid = threading.get_native_id()
+            try:
+                os.setpriority(os.PRIO_PROCESS, tid, min(os.getpriority(os.PRIO_PROCESS, tid) + self.NICE_INCREMENT, 19))
+            except (AttributeError, OSError) as e:
+                print(f"Scan governor: could not lower CPU priority: {e}", file=sys.stderr)
+            ionice = shutil.which("ionice")
+            if ionice:
+                subprocess.run([ionice, "-c", str(self.IOPRIO_CLASS_IDLE), "-p", str(tid)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        self._thread_state.read_bytes = self._thread_read_bytes()
+        self._thread_state.backoff_left = self.MAX_BACKOFF_PER_SCAN_S
+
+    @staticmethod
+    def _thread_read_bytes():
+        try:
+            with open(f"/proc/self/task/{threading.get_native_id()}/io", 'r') as f:
+                for line in f:
+                    if line.startswith("rchar:"):
+                        return int(line.split()[1])
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def report_main_loop_lag(self, lag_ms):
+        if lag_ms > self.latency_threshold_ms:
+            self._pressure_until = time.monotonic() + self.PRESSURE_HOLD_S
+
+    def _under_pressure(self):
+        return self.playback_starved or time.monotonic() < self._pressure_until
+
+    def file_done(self, path):
+        """Called by a scan thread after each file. Sleeps as long as the ceilings and current pressure require."""
+        read_bytes = self._thread_read_bytes()
+        previous = getattr(self._thread_state, "read_bytes", None)
+        self._thread_state.read_bytes = read_bytes
+        if read_bytes is not None and previous is not None:
+            cost_bytes = read_bytes - previous
+        else:
+            try:
+                cost_bytes = os.path.getsize(path)
+            except OSError:
+                cost_bytes = 0
+        with self._lock:
+            now = time.monotonic()
+            if self.max_files_per_second > 0:
+                self._files_due = max(self._files_due, now) + 1.0 / self.max_files_per_second
+            if self.max_bytes_per_second > 0 and cost_bytes > 0:
+                self._bytes_due = max(self._bytes_due, now) + cost_bytes / self.max_bytes_per_second
+            delay = max(self._files_due, self._bytes_due) - now
+        if delay > 0:
+            time.sleep(delay)
+        backoff_left = getattr(self._thread_state, "backoff_left", self.MAX_BACKOFF_PER_SCAN_S)
+        waited = 0.0
+        while waited < backoff_left and self._under_pressure():
+            time.sleep(self.BACKOFF_STEP_S)
+            waited += self.BACKOFF_STEP_S
+        if waited:
+            self._thread_state.backoff_left = backoff_left - waited
+            with self._lock:
+                self.backoff_seconds += waited
+
+
+class MemoryBudget:
+    """
+    Central accounting of the bytes held by Namo's in-memory caches. Each cache reports
+    (bytes, entries) and can be asked to shrink to a byte target. enforce() first holds
+    every cache to its own budget. If the total is still over the global budget, it shrinks
+    caches in registration order, cheapest to rebuild first, until the total fits.
+    Caches registered without a shrink function are only reported.
+    """
+
+    def __init__(self, total_bytes=0):
+        self.total_bytes = total_bytes
+        self._caches = []
+        self._lock = threading.Lock()
+        self._enforce_scheduled = False
+
+    def register(self, name, usage, shrink=None, budget_bytes=0):
+        """usage() returns (bytes, entries); shrink(target_bytes) evicts down to about target_bytes. A budget of 0 means no own limit."""
+        self._caches.append({"name": name, "usage": usage, "shrink": shrink,
+                             "budget": budget_bytes, "evicted_bytes": 0})
+
+    def note_growth(self):
+        """Asks for an enforce() pass on the main loop soon. Safe to call from any thread."""
+        with self._lock:
+            if self._enforce_scheduled:
+                return
+            self._enforce_scheduled = True
+        GLib.idle_add(self._on_enforce_idle)
+
+    def _on_enforce_idle(self):
+        with self._lock:
+            self._enforce_scheduled = False
+        self.enforce()
+        return GLib.SOURCE_REMOVE
+
+    def _shrink(self, cache, used, target_bytes):
+        try:
+            cache["shrink"](max(0, target_bytes))
+            remaining = cache["usage"]()[0]
+        except Exception as e:
+            print(f"Memory budget: could not shrink {cache['name']}: {e}", file=sys.stderr)
+            return 0
+        freed = max(0, used - remaining)
+        cache["evicted_bytes"] += freed
+        return freed
+
+    def enforce(self):
+        """Evicts from the caches until each fits its own budget and all of them fit the global one."""
+        evictable = [cache for cache in self._caches if cache["shrink"]]
+        usage = {}
+        for cache in evictable:
+            used = cache["usage"]()[0]
+            if cache["budget"] > 0 and used > cache["budget"]:
+                used -= self._shrink(cache, used, cache["budget"])
+            usage[cache["name"]] = used
+        if self.total_bytes > 0:
+            excess = sum(usage.values()) - self.total_bytes
+            for cache in evictable:
+                if excess <= 0:
+                    break
+                used = usage[cache["name"]]
+                excess -= self._shrink(cache, used, used - excess)
+
+    def report(self):
+        """Returns a list of dicts (name, bytes, entries, budget, evicted_bytes), one per cache."""
+        rows = []
+        for cache in self._caches:
+            used, entries = cache["usage"]()
+            rows.append({"name": cache["name"], "bytes": used, "entries": entries,
+                         "budget": cache["budget"] if cache["shrink"] else None,
+                         "evicted_bytes": cache["evicted_bytes"]})
+        return rows
+
+
+class CoverTextureCache:
+    """Decoded, scaled cover pixbufs keyed by the image's SHA-1, least recently used first."""
+
+    def __init__(self):
+        self._pixbufs = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _pixbuf_size(pixbuf):
+        return pixbuf.get_rowstride() * pixbuf.get_height()
+
+    def get(self, key):
+        with self._lock:
+            pixbuf = self._pixbufs.pop(key, None)
+            if pixbuf is not None:
+                self._pixbufs[key] = pixbuf
+            return pixbuf
+
+    def put(self, key, pixbuf):
+        with self._lock:
+            previous = self._pixbufs.pop(key, None)
+            if previous is not None:
+                self._bytes -= self._pixbuf_size(previous)
+            self._pixbufs[key] = pixbuf
+            self._bytes += self._pixbuf_size(pixbuf)
+
+    def memory_usage(self):
+        with self._lock:
+            return self._bytes, len(self._pixbufs)
+
+    def trim(self, target_bytes):
+        with self._lock:
+            while self._pixbufs and self._bytes > target_bytes:
+                pixbuf = self._pixbufs.pop(next(iter(self._pixbufs)))
+                self._bytes -= self._pixbuf_size(pixbuf)
+
+
+class MainLoopWatchdog:
+    """
+    Opt-in detector for main-loop stalls. A heartbeat timeout on the main loop records how
+    late each beat runs, which is how long other callbacks held the loop, in a latency
+    histogram. A helper thread watches the heartbeat. When it is overdue by more than the
+    threshold, the helper captures the main thread's Python stack with sys._current_frames()
+    and logs it. The heartbeat then logs the stall's full duration once the loop recovers.
+    The histogram and recent stalls are exported as JSON.
+    """
+    HEARTBEAT_MS = 50
+    EXPORT_INTERVAL_S = 60
+    BUCKET_UPPER_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+    MAX_STALL_RECORDS = 50
+
+    def __init__(self, stall_threshold_ms, export_path):
+        self.stall_threshold_ms = stall_threshold_ms
+        self.export_path = export_path
+        self.counts = [0] * (len(self.BUCKET_UPPER_MS) + 1)
+        self.stalls = deque(maxlen=self.MAX_STALL_RECORDS)
+        self._lock = threading.Lock()
+        self._main_thread_id = threading.main_thread().ident
+        self._last_beat = None
+        self._open_stall = None
+        self._stop = threading.Event()
+        self._heartbeat_id = None
+        self._export_id = None
+
+    def start(self):
+        """Starts the heartbeat on the main loop and the watching thread. Call from the main thread."""
+        self._heartbeat_id = GLib.timeout_add(self.HEARTBEAT_MS, self._on_heartbeat)
+        self._export_id = GLib.timeout_add_seconds(self.EXPORT_INTERVAL_S, self._on_export_timer)
+        threading.Thread(target=self._watch, name="watchdog", daemon=True).start()
+        print(f"Watchdog: reporting main-loop stalls over {self.stall_threshold_ms} ms")
+
+    def stop(self):
+        self._stop.set()
+        for source_id in (self._heartbeat_id, self._export_id):
+            if source_id:
+                GLib.source_remove(source_id)
+        self._heartbeat_id = self._export_id = None
+        self.export()
+        print(f"Watchdog: {self.summary()}")
+
+    def _on_heartbeat(self):
+        now = time.monotonic()
+        with self._lock:
+            last_beat = self._last_beat
+            self._last_beat = now
+            stall = self._open_stall
+            self._open_stall = None
+        if last_beat is not None:
+            late_ms = max(0.0, (now - last_beat) * 1000 - self.HEARTBEAT_MS)
+            self.counts[bisect.bisect_left(self.BUCKET_UPPER_MS, late_ms)] += 1
+            if stall is not None:
+                stall["duration_ms"] = round(late_ms)
+                print(f"Watchdog: main loop was blocked for {late_ms:.0f} ms", file=sys.stderr)
+        return GLib.SOURCE_CONTINUE
+
+    def _watch(self):
+        interval_s = max(self.stall_threshold_ms / 4000, 0.01)
+        while not self._stop.wait(interval_s):
+            with self._lock:
+                if self._last_beat is None or self._open_stall is not None:
+                    continue
+                overdue_ms = (time.monotonic() - self._last_beat) * 1000 - self.HEARTBEAT_MS
+                if overdue_ms < self.stall_threshold_ms:
+                    continue
+                frame = sys._current_frames().get(self._main_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame else "(main thread stack unavailable)\n"
+                self._open_stall = {"at": time.time(), "detected_after_ms": round(overdue_ms),
+                                    "duration_ms": None, "stack": stack}
+                self.stalls.append(self._open_stall)
+            print(f"Watchdog: main loop stalled for {overdue_ms:.0f} ms so far; main thread stack:\n{stack}",
+                  end="", file=sys.stderr)
+
+    def _on_export_timer(self):
+        self.export()
+        return GLib.SOURCE_CONTINUE
+
+    def export(self):
+        """Writes the latency histogram and recent stalls to export_path as JSON."""
+        labels = [f"<={upper}ms" for upper in self.BUCKET_UPPER_MS] + [f">{self.BUCKET_UPPER_MS[-1]}ms"]
+        with self._lock:
+            data = {"heartbeat_ms": self.HEARTBEAT_MS,
+                    "stall_threshold_ms": self.stall_threshold_ms,
+                    "latency_histogram": dict(zip(labels, self.counts)),
+                    "stalls": list(self.stalls)}
+        tmp_path = self.export_path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.export_path), exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=1)
+            os.replace(tmp_path, self.export_path)
+        except OSError as e:
+            print(f"Watchdog: could not write {self.export_path}: {e}", file=sys.stderr)
+
+    def summary(self):
+        beats = sum(self.counts)
+        late = sum(self.counts[self.BUCKET_UPPER_MS.index(self.HEARTBEAT_MS) + 1:])
+        return f"{beats} heartbeats, {late} over {self.HEARTBEAT_MS} ms late, {len(self.stalls)} stalls recorded"
+
+
+class MediaCache:
+    """
+    Size-bounded on-disk cache of remote tracks, keyed by the song's stable URI.
+    Entries are evicted least-recently-played first once the byte budget is exceeded.
+    Every entry records its size, mtime and SHA-256 so truncated or corrupt files are dropped.
+    """
+    INDEX_FILE = "index.json"
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._downloading = set()
+        self._index_dirty = False
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _index_path(self):
+        return os.path.join(self.cache_dir, self.INDEX_FILE)
+
+    def _key(self, song_uri):
+        return hashlib.sha1(song_uri.encode('utf-8')).hexdigest()
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), 'r') as f:
+                entries = json.load(f)
+            if isinstance(entries, dict):
+                self._entries = entries
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Media cache: could not read index, starting empty: {e}", file=sys.stderr)
+
+    def _save_index_locked(self):
+        self._index_dirty = False
+        tmp_path = self._index_path() + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self._index_path())
+        except OSError as e:
+            print(f"Media cache: could not write index: {e}", file=sys.stderr)
+
+    def _remove_entry_locked(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            try:
+                os.remove(os.path.join(self.cache_dir, entry['file']))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Media cache: could not remove {entry['file']}: {e}", file=sys.stderr)
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(entry['size'] for entry in self._entries.values())
+
+    def lookup(self, song_uri, touch=True):
+        """
+        Returns the local path of a cached copy of song_uri, or None. Marks the entry as recently
+        used unless touch is False (for prerolling or waveforms, which do not mean it was played).
+        """
+        key = self._key(song_uri)
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+            path = os.path.join(self.cache_dir, entry['file'])
+            try:
+                size_ok = os.path.getsize(path) == entry['size']
+            except OSError:
+                size_ok = False
+            if not size_ok:
+                print(f"Media cache: dropping incomplete entry for {song_uri}", file=sys.stderr)
+                self._remove_entry_locked(key)
+                self._save_index_locked()
+                return None
+            if touch:
+                entry['last_access'] = time.time()
+                self._index_dirty = True
+            return path
+
+    def touch(self, song_uri):
+        """Marks a cached entry as recently used, if there is one."""
+        with self._lock:
+            entry = self._entries.get(self._key(song_uri))
+            if entry:
+                entry['last_access'] = time.time()
+                self._index_dirty = True
+
+    def contains(self, song_uri):
+        with self._lock:
+            return self._key(song_uri) in self._entries
+
+    def flush(self):
+        """Writes pending last-access updates to the index."""
+        with self._lock:
+            if self._index_dirty:
+                self._save_index_locked()
+
+    def verify(self, full=False):
+        """
+        Checks every entry and drops the ones whose content no longer matches. Meant for a
+        background thread. Entries whose size and mtime are unchanged are trusted; only the
+        others are re-hashed, unless full is True, which re-hashes everything.
+        """
+        with self._lock:
+            snapshot = dict(self._entries)
+        corrupt = []
+        rehashed = {}
+        for key, entry in snapshot.items():
+            path = os.path.join(self.cache_dir, entry['file'])
+            try:
+                stat = os.stat(path)
+            except OSError:
+                corrupt.append(key)
+                continue
+            if stat.st_size != entry['size']:
+                corrupt.append(key)
+                continue
+            if not full and entry.get('mtime') == stat.st_mtime:
+                continue
+            digest = hashlib.sha256()
+            try:
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                        digest.update(chunk)
+            except OSError:
+                corrupt.append(key)
+                continue
+            if digest.hexdigest() != entry['sha256']:
+                corrupt.append(key)
+            else:
+                rehashed[key] = stat.st_mtime
+        if corrupt or rehashed:
+            with self._lock:
+                for key in corrupt:
+                    print(f"Media cache: integrity check failed for {self._entries.get(key, {}).get('uri')}", file=sys.stderr)
+                    self._remove_entry_locked(key)
+                for key, mtime in rehashed.items():
+                    if key in self._entries:
+                        self._entries[key]['mtime'] = mtime
+                self._save_index_locked()
+        print(f"Media cache: checked {len(snapshot)} entries, re-hashed {len(rehashed) + len(corrupt)}, dropped {len(corrupt)}.")
+
+    def download_async(self, song_uri, source_url):
+        """Starts a background download of source_url into the cache unless it is cached or already downloading."""
+        key = self._key(song_uri)
+        with self._lock:
+            if key in self._entries or key in self._downloading:
+                return
+            self._downloading.add(key)
+        thread = threading.Thread(target=self._download_thread, args=(key, song_uri, source_url), daemon=True)
+        thread.start()
+
+    def _download_thread(self, key, song_uri, source_url):
+        file_name = key + ".media"
+        tmp_path = os.path.join(self.cache_dir, file_name + ".part")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with urllib.request.urlopen(source_url, timeout=30) as response, open(tmp_path, 'wb') as f:
+                for chunk in iter(lambda: response.read(self.CHUNK_SIZE), b''):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+                expected = response.headers.get('Content-Length')
+            if expected is not None and int(expected) != size:
+                raise IOError(f"short read ({size} of {expected} bytes)")
+            os.replace(tmp_path, os.path.join(self.cache_dir, file_name))
+            mtime = os.stat(os.path.join(self.cache_dir, file_name)).st_mtime
+        except Exception as e:
+            print(f"Media cache: download failed for {song_uri}: {e}", file=sys.stderr)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            with self._lock:
+                self._downloading.discard(key)
+            return
+
+        with self._lock:
+            self._downloading.discard(key)
+            self._entries[key] = {
+                'uri': song_uri,
+                'file': file_name,
+                'size': size,
+                'sha256': digest.hexdigest(),
+                'mtime': mtime,
+                'last_access': time.time(),
+            }
+            self._evict_locked()
+            self._save_index_locked()
+        print(f"Media cache: stored {song_uri} ({size} bytes)")
+
+    def _evict_locked(self):
+        total = sum(entry['size'] for entry in self._entries.values())
+        if total <= self.max_bytes:
+            return
+        for key, entry in sorted(self._entries.items(), key=lambda item: item[1]['last_access']):
+            if total <= self.max_bytes:
+                break
+            print(f"Media cache: evicting {entry['uri']} ({entry['size']} bytes)")
+            total -= entry['size']
+            self._remove_entry_locked(key)
+
+
+
+class AlbumArtFetcher:
+    """
+    Downloads Bandcamp album covers in the background. Requests for a URL that is already
+    being downloaded share its future, so every track of an album gets the same GLib.Bytes.
+    Finished downloads are forgotten; covers are kept by the playlist's art store.
+    """
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="album-art")
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def fetch_async(self, art_url):
+        """Returns a Future resolving to the cover as GLib.Bytes, or None if it could not be fetched."""
+        with self._lock:
+            future = self._futures.get(art_url)
+            if future is not None:
+                return future
+            future = self._executor.submit(self._fetch, art_url)
+            self._futures[art_url] = future
+        future.add_done_callback(lambda done: self._forget(art_url, done))
+        return future
+
+    def _forget(self, art_url, future):
+        with self._lock:
+            if self._futures.get(art_url) is future:
+                del self._futures[art_url]
+
+    def _fetch(self, art_url):
+        data = bc_scraper.fetch_album_art(art_url)
+        return GLib.Bytes.new(data) if data else None
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ReplayGainStore:
+    """
+    Persistent loudness results and the queue of albums still waiting for analysis,
+    kept in one JSON file so an interrupted analysis resumes after a restart.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._tracks = {}
+        self._pending = []
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self._tracks = data.get('tracks', {})
+            self._pending = data.get('pending', [])
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"ReplayGain: could not read {self.path}, starting empty: {e}", file=sys.stderr)
+
+    def _save_locked(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'tracks': self._tracks, 'pending': self._pending}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"ReplayGain: could not write {self.path}: {e}", file=sys.stderr)
+
+    def get(self, uri):
+        with self._lock:
+            return self._tracks.get(uri)
+
+    def has(self, uri):
+        with self._lock:
+            return uri in self._tracks
+
+    def pending_albums(self):
+        with self._lock:
+            return [list(album) for album in self._pending]
+
+    def add_pending(self, albums):
+        with self._lock:
+            queued = {uri for album in self._pending for uri in album}
+            for album in albums:
+                album = [uri for uri in album if uri not in queued and uri not in self._tracks]
+                if album:
+                    self._pending.append(album)
+                    queued.update(album)
+            self._save_locked()
+
+    def complete_album(self, album, results):
+        """Stores an album's results and drops it from the pending queue."""
+        with self._lock:
+            self._tracks.update(results)
+            self._pending = [pending for pending in self._pending if pending != album]
+            self._save_locked()
+
+
+class ReplayGainAnalyzer:
+    """
+    Background ReplayGain analysis with GStreamer's rganalysis element.
+
+    Albums (tracks sharing a folder) are analyzed in parallel, one worker thread and
+    pipeline per album. Decoding runs on GStreamer's own threads, so albums spread across
+    cores. Tracks of an album go through one pipeline with num-tracks set, so the last
+    track also yields the album gain. shutdown() stops running pipelines; their albums
+    stay pending and are analyzed again on the next start.
+    """
+    MESSAGE_TIMEOUT_S = 60
+    STOP_POLL_S = 0.25
+
+    def __init__(self, store, max_workers=0):
+        self.store = store
+        self.max_workers = max_workers or os.cpu_count() or 2
+        self._executor = None
+        self._lock = threading.Lock()
+        self._active = set()
+        self._pipelines = set()
+        self._stop = threading.Event()
+
+    def analyze(self, uris):
+        """Queues local URIs that have no results yet, grouped into albums by folder, and starts the workers."""
+        albums = {}
+        for uri in uris:
+            if not uri.startswith("file://") or self.store.has(uri):
+                continue
+            folder = os.path.dirname(unquote(urlparse(uri).path))
+            albums.setdefault(folder, []).append(uri)
+        self.store.add_pending(list(albums.values()))
+        self.resume()
+
+    def resume(self):
+        """Submits every pending album that is not already being processed."""
+        with self._lock:
+            if self._executor is None:
+                self._stop.clear()
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="rganalysis")
+            for album in self.store.pending_albums():
+                key = tuple(album)
+                if key not in self._active:
+                    self._active.add(key)
+                    self._executor.submit(self._analyze_album, album)
+
+    def shutdown(self):
+        """Cancels queued albums and stops the running pipelines without waiting for the workers."""
+        self._stop.set()
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            pipelines = list(self._pipelines)
+        for pipeline in pipelines:
+            pipeline.set_state(Gst.State.NULL)
+
+    def _analyze_album(self, album):
+        try:
+            results = self._run_album_pipeline(album)
+            if results is None:
+                return
+            self.store.complete_album(album, results)
+            print(f"ReplayGain: analyzed {len(results)} tracks in {os.path.dirname(unquote(urlparse(album[0]).path))}")
+        except Exception as e:
+            print(f"ReplayGain: analysis failed for album starting with {album[0]}: {e}", file=sys.stderr)
+        finally:
+            with self._lock:
+                self._active.discard(tuple(album))
+
+    def _run_album_pipeline(self, album):
+        """
+        Analyzes an album's tracks in order through one pipeline and returns {uri: gains},
+        or None if shutdown() stopped it.
+        rganalysis keeps its album accumulator only while it stays running, so the pipeline
+        stays PLAYING for the whole album. Between tracks only the decoding elements upstream
+        of it are restarted. Each track's EOS is stopped at rganalysis' source pad, which
+        keeps fakesink from finishing, and is reported on the bus instead.
+        A track that fails is stored with empty results so it is not retried forever. The
+        album gain is then dropped as incomplete, and the pipeline restarts from scratch so
+        the failed track's partial data cannot leak into the next one.
+        """
+        pipeline = Gst.parse_launch(
+            "uridecodebin name=src ! audioconvert name=convert ! audioresample name=resample ! "
+            f"rganalysis name=rg forced=true num-tracks={len(album)} ! fakesink sync=false")
+        src = pipeline.get_by_name("src")
+        rg = pipeline.get_by_name("rg")
+        upstream = (pipeline.get_by_name("resample"), pipeline.get_by_name("convert"), src)
+        convert_sink_pad = pipeline.get_by_name("convert").get_static_pad("sink")
+        bus = pipeline.get_bus()
+
+        def on_pad_added(decodebin, pad):
+            caps = pad.get_current_caps() or pad.query_caps(None)
+            if caps and caps.to_string().startswith("audio/") and not convert_sink_pad.is_linked():
+                pad.link(convert_sink_pad)
+
+        def on_rg_src_event(pad, info):
+            if info.get_event().type == Gst.EventType.EOS:
+                bus.post(Gst.Message.new_application(rg, Gst.Structure.new_empty("track-done")))
+                return Gst.PadProbeReturn.DROP
+            return Gst.PadProbeReturn.OK
+
+        src.connect("pad-added", on_pad_added)
+        rg.get_static_pad("src").add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, on_rg_src_event)
+        results = {}
+        album_gain = album_peak = None
+        album_complete = True
+        running = False
+        with self._lock:
+            if self._stop.is_set():
+                return None
+            self._pipelines.add(pipeline)
+        try:
+            for uri in album:
+                if running:
+                    for element in upstream:
+                        element.set_state(Gst.State.NULL)
+                    src.set_property("uri", uri)
+                    for element in upstream:
+                        element.sync_state_with_parent()
+                else:
+                    src.set_property("uri", uri)
+                    pipeline.set_state(Gst.State.PLAYING)
+                    running = True
+                track = {}
+                deadline = time.monotonic() + self.MESSAGE_TIMEOUT_S
+                while True:
+                    message = bus.timed_pop_filtered(
+                        int(self.STOP_POLL_S * Gst.SECOND),
+                        Gst.MessageType.TAG | Gst.MessageType.APPLICATION | Gst.MessageType.ERROR)
+                    if self._stop.is_set():
+                        return None
+                    if message is None and time.monotonic() < deadline:
+                        continue
+                    deadline = time.monotonic() + self.MESSAGE_TIMEOUT_S
+                    if message is None or message.type == Gst.MessageType.ERROR:
+                        reason = message.parse_error()[0].message if message else "timed out"
+                        print(f"ReplayGain: could not analyze {uri}: {reason}", file=sys.stderr)
+                        track = None
+                        break
+                    if message.type == Gst.MessageType.APPLICATION:
+                        if message.get_structure().get_name() == "track-done":
+                            break
+                        continue
+                    tags = message.parse_tag()
+                    for tag, key in ((Gst.TAG_TRACK_GAIN, 'track_gain'), (Gst.TAG_TRACK_PEAK, 'track_peak'),
+                                     (Gst.TAG_ALBUM_GAIN, 'album_gain'), (Gst.TAG_ALBUM_PEAK, 'album_peak')):
+                        found, value = tags.get_double(tag)
+                        if found:
+                            track[key] = value
+
+                if track is None:
+                    results[uri] = {}
+                    album_complete = False
+                    pipeline.set_state(Gst.State.NULL)
+                    running = False
+                    continue
+                album_gain = track.pop('album_gain', album_gain)
+                album_peak = track.pop('album_peak', album_peak)
+                results[uri] = track
+        finally:
+            with self._lock:
+                self._pipelines.discard(pipeline)
+            pipeline.set_state(Gst.State.NULL)
+
+        if album_complete and album_gain is not None:
+            for track in results.values():
+                track['album_gain'] = album_gain
+                track['album_peak'] = album_peak
+        return results
+
+
+class PeakSummaryGenerator:
+    """
+    Background waveform summaries for the seek bar.
+
+    Tracks are decoded to low-rate mono through an appsink with sync disabled, so a
+    worker runs far faster than realtime. Each summary is a compact array of interleaved
+    per-bucket (min, max) int8 pairs, stored under the cache directory keyed by the URI
+    (plus size and mtime for local files) and kept in a small in-memory LRU.
+    shutdown() stops running decodes without writing or reporting a summary.
+    """
+    SAMPLE_RATE = 8000
+    BLOCK_SAMPLES = 256
+    MAX_BUCKETS = 1000
+    MEMORY_ENTRIES = 32
+    PULL_TIMEOUT_S = 60
+    STOP_POLL_S = 0.25
+
+    def __init__(self, cache_dir, max_workers=0):
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._active = set()
+        self._pipelines = set()
+        self._stop = threading.Event()
+        self._memory = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def lookup(self, uri):
+        """Returns the in-memory summary for uri, or None."""
+        with self._lock:
+            peaks = self._memory.pop(uri, None)
+            if peaks is not None:
+                self._memory[uri] = peaks
+            return peaks
+
+    def request(self, uri, source_uri, callback=None):
+        """
+        Computes (or loads) the summary of uri by decoding source_uri in a worker.
+        callback(uri, peaks) runs on the main loop when it is ready; peaks is None on failure.
+        """
+        with self._lock:
+            if uri in self._active:
+                return
+            self._active.add(uri)
+            if self._executor is None:
+                self._stop.clear()
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="peaks")
+            self._executor.submit(self._summarize, uri, source_uri, callback)
+
+    def shutdown(self):
+        """Cancels queued summaries and stops the running pipelines without waiting for the workers."""
+        self._stop.set()
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            pipelines = list(self._pipelines)
+        for pipeline in pipelines:
+            pipeline.set_state(Gst.State.NULL)
+
+    def _cache_path(self, uri, source_uri):
+        key = uri
+        if source_uri.startswith("file://"):
+            try:
+                stat = os.stat(unquote(urlparse(source_uri).path))
+                key = f"{uri}|{stat.st_size}|{stat.st_mtime_ns}"
+            except OSError:
+                pass
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + ".peaks")
+
+    def _remember(self, uri, peaks):
+        with self._lock:
+            self._memory.pop(uri, None)
+            self._memory[uri] = peaks
+            while len(self._memory) > self.MEMORY_ENTRIES:
+                del self._memory[next(iter(self._memory))]
+
+    def memory_usage(self):
+        with self._lock:
+            return sum(len(peaks) * peaks.itemsize for peaks in self._memory.values()), len(self._memory)
+
+    def trim_memory(self, target_bytes):
+        """Forgets least recently used summaries until at most target_bytes remain; they stay cached on disk."""
+        with self._lock:
+            used = sum(len(peaks) * peaks.itemsize for peaks in self._memory.values())
+            while self._memory and used > target_bytes:
+                peaks = self._memory.pop(next(iter(self._memory)))
+                used -= len(peaks) * peaks.itemsize
+
+    def _summarize(self, uri, source_uri, callback):
+        peaks = None
+        try:
+            path = self._cache_path(uri, source_uri)
+            try:
+                with open(path, 'rb') as f:
+                    peaks = array('b', f.read())
+            except FileNotFoundError:
+                started = time.monotonic()
+                peaks = self._decode_peaks(source_uri)
+                if peaks is None:
+                    return
+                tmp_path = path + ".tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(peaks.tobytes())
+                os.replace(tmp_path, path)
+                print(f"Peaks: summarized {uri} in {time.monotonic() - started:.1f} s")
+            self._remember(uri, peaks)
+        except Exception as e:
+            print(f"Peaks: could not summarize {uri}: {e}", file=sys.stderr)
+            peaks = None
+        finally:
+            with self._lock:
+                self._active.discard(uri)
+        if callback:
+            GLib.idle_add(callback, uri, peaks)
+
+    def _decode_peaks(self, source_uri):
+        """
+        Decodes source_uri and returns interleaved (min, max) int8 pairs, at most MAX_BUCKETS
+        of them, or None if shutdown() stopped it.
+        """
+        pipeline = Gst.parse_launch(
+            "uridecodebin name=src ! audioconvert name=convert ! audioresample ! "
+            f"audio/x-raw,format=S16LE,channels=1,rate={self.SAMPLE_RATE} ! "
+            "appsink name=sink sync=false max-buffers=8")
+        src = pipeline.get_by_name("src")
+        sink = pipeline.get_by_name("sink")
+        convert_sink_pad = pipeline.get_by_name("convert").get_static_pad("sink")
+
+        def on_pad_added(decodebin, pad):
+            caps = pad.get_current_caps() or pad.query_caps(None)
+            if caps and caps.to_string().startswith("audio/") and not convert_sink_pad.is_linked():
+                pad.link(convert_sink_pad)
+
+        src.connect("pad-added", on_pad_added)
+        src.set_property("uri", source_uri)
+        bus = pipeline.get_bus()
+        block_mins = array('h')
+        block_maxs = array('h')
+        pending = array('h')
+        block = self.BLOCK_SAMPLES
+        with self._lock:
+            if self._stop.is_set():
+                return None
+            self._pipelines.add(pipeline)
+        pipeline.set_state(Gst.State.PLAYING)
+        try:
+            deadline = time.monotonic() + self.PULL_TIMEOUT_S
+            while True:
+                sample = sink.emit("try-pull-sample", int(self.STOP_POLL_S * Gst.SECOND))
+                if self._stop.is_set():
+                    return None
+                if sample is None:
+                    message = bus.pop_filtered(Gst.MessageType.ERROR)
+                    if message is not None:
+                        raise RuntimeError(message.parse_error()[0].message)
+                    if sink.get_property("eos"):
+                        break
+                    if time.monotonic() < deadline:
+                        continue
+                    raise RuntimeError("timed out waiting for decoded audio")
+                deadline = time.monotonic() + self.PULL_TIMEOUT_S
+                buffer = sample.get_buffer()
+                decoded = array('h', buffer.extract_dup(0, buffer.get_size()))
+                if sys.byteorder == 'big':
+                    decoded.byteswap()
+                pending.extend(decoded)
+                full = len(pending) - len(pending) % block
+                for start in range(0, full, block):
+                    chunk = pending[start:start + block]
+                    block_mins.append(min(chunk))
+                    block_maxs.append(max(chunk))
+                del pending[:full]
+        finally:
+            with self._lock:
+                self._pipelines.discard(pipeline)
+            pipeline.set_state(Gst.State.NULL)
+        if pending:
+            block_mins.append(min(pending))
+            block_maxs.append(max(pending))
+
+        n_blocks = len(block_mins)
+        n_buckets = min(n_blocks, self.MAX_BUCKETS)
+        peaks = array('b')
+        for bucket in range(n_buckets):
+            start = bucket * n_blocks // n_buckets
+            end = (bucket + 1) * n_blocks // n_buckets
+            peaks.append(min(block_mins[start:end]) >> 8)
+            peaks.append(max(block_maxs[start:end]) >> 8)
+        return peaks
+
+
+class DuplicateFinder:
+    """
+    Finds duplicate playlist entries in stages, each narrowing the candidates for the next:
+    identical paths, then files of equal size compared by a partial and then a full content
+    hash, then (optionally) tracks with the same folded title and artist and a similar
+    duration, compared by Chromaprint fingerprints. File I/O and the fpcalc processes run
+    on a worker pool.
+    """
+    PARTIAL_HASH_BYTES = 64 * 1024
+    CHUNK_SIZE = 1024 * 1024
+    DURATION_TOLERANCE_S = 2
+    FINGERPRINT_SECONDS = 120
+    FINGERPRINT_MIN_SIMILARITY = 0.85
+
+    def __init__(self, max_workers=0, use_fingerprints=False):
+        self.max_workers = max_workers or os.cpu_count() or 2
+        self.fpcalc_path = shutil.which("fpcalc") if use_fingerprints else None
+        if use_fingerprints and not self.fpcalc_path:
+            print("Duplicates: fpcalc (Chromaprint) not found, skipping audio fingerprints.")
+
+    def find(self, rows):
+        """
+        rows is a sequence of (row_id, uri, title, artist, duration_ns). Returns a list of duplicate groups,
+        each a list of row ids in the order they were given. Blocking; run it off the main loop.
+        """
+        parent = {}
+
+        def root(row_id):
+            while parent[row_id] != row_id:
+                parent[row_id] = parent[parent[row_id]]
+                row_id = parent[row_id]
+            return row_id
+
+        def union(a, b):
+            parent[root(b)] = root(a)
+
+        order = {}
+        by_identity = {}
+        for index, (row_id, uri, title, artist, duration_ns) in enumerate(rows):
+            parent[row_id] = row_id
+            order[row_id] = index
+            if uri.startswith("file://"):
+                identity = os.path.realpath(unquote(urlparse(uri).path))
+            else:
+                identity = uri
+            if identity in by_identity:
+                union(by_identity[identity][0], row_id)
+            else:
+                by_identity[identity] = (row_id, duration_ns, (fold_text(title or ""), fold_text(artist or "")))
+
+        files = [(row_id, path, duration_ns) for path, (row_id, duration_ns, _) in by_identity.items()
+                 if path.startswith("/")]
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="dedup") as executor:
+            sizes = dict(zip((path for _, path, _ in files), executor.map(self._file_size, (path for _, path, _ in files))))
+            by_size = {}
+            for row_id, path, _ in files:
+                if sizes[path] is not None:
+                    by_size.setdefault(sizes[path], []).append((row_id, path))
+            self._union_equal(executor, [group for group in by_size.values() if len(group) > 1], union)
+
+            if self.fpcalc_path:
+                by_names = {}
+                for path, (row_id, duration_ns, names) in by_identity.items():
+                    if path.startswith("/") and root(row_id) == row_id and duration_ns > 0:
+                        by_names.setdefault(names, []).append((row_id, path, duration_ns))
+                self._union_similar_audio(executor, [group for group in by_names.values() if len(group) > 1], union)
+
+        groups = {}
+        for row_id in parent:
+            groups.setdefault(root(row_id), []).append(row_id)
+        return sorted((sorted(group, key=order.__getitem__) for group in groups.values() if len(group) > 1),
+                      key=lambda group: order[group[0]])
+
+    def _union_equal(self, executor, size_groups, union):
+        """Within each equal-size group, joins files whose partial and then full hashes match."""
+        for hash_function in (self._partial_hash, self._full_hash):
+            candidates = [entry for group in size_groups for entry in group]
+            digests = dict(zip(candidates, executor.map(hash_function, (path for _, path in candidates))))
+            next_groups = []
+            for group in size_groups:
+                by_digest = {}
+                for entry in group:
+                    if digests[entry] is not None:
+                        by_digest.setdefault(digests[entry], []).append(entry)
+                next_groups.extend(matches for matches in by_digest.values() if len(matches) > 1)
+            size_groups = next_groups
+        for group in size_groups:
+            for row_id, _ in group[1:]:
+                union(group[0][0], row_id)
+
+    def _union_similar_audio(self, executor, name_groups, union):
+        """
+        Within each group of tracks sharing a folded title and artist, joins tracks of similar
+        duration whose fingerprints match closely enough. Only tracks with a partner in their
+        group are fingerprinted, so unrelated songs of similar length never cost an fpcalc run.
+        """
+        tolerance_ns = self.DURATION_TOLERANCE_S * Gst.SECOND
+        candidate_groups = []
+        for group in name_groups:
+            group.sort(key=lambda entry: entry[2])
+            candidates = set()
+            for previous, current in zip(group, group[1:]):
+                if current[2] - previous[2] <= tolerance_ns:
+                    candidates.update((previous, current))
+            if candidates:
+                candidate_groups.append(sorted(candidates, key=lambda entry: entry[2]))
+        all_candidates = [entry for candidates in candidate_groups for entry in candidates]
+        if not all_candidates:
+            return
+        fingerprints = dict(zip(all_candidates, executor.map(self._fingerprint, (path for _, path, _ in all_candidates))))
+        for candidates in candidate_groups:
+            for index, (row_id, _, duration_ns) in enumerate(candidates):
+                fingerprint = fingerprints[candidates[index]]
+                if not fingerprint:
+                    continue
+                for other in candidates[index + 1:]:
+                    if other[2] - duration_ns > tolerance_ns:
+                        break
+                    other_fingerprint = fingerprints[other]
+                    if other_fingerprint and self._similarity(fingerprint, other_fingerprint) >= self.FINGERPRINT_MIN_SIMILARITY:
+                        union(row_id, other[0])
+
+    def _file_size(self, path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return None
+
+    def _partial_hash(self, path):
+        """Hashes the first and last PARTIAL_HASH_BYTES, which differ whenever tags or audio differ in practice."""
+        digest = hashlib.sha1()
+        try:
+            with open(path, 'rb') as f:
+                digest.update(f.read(self.PARTIAL_HASH_BYTES))
+                f.seek(max(0, os.fstat(f.fileno()).st_size - self.PARTIAL_HASH_BYTES))
+                digest.update(f.read(self.PARTIAL_HASH_BYTES))
+        except OSError:
+            return None
+        return digest.digest()
+
+    def _full_hash(self, path):
+        digest = hashlib.sha256()
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                    digest.update(chunk)
+        except OSError:
+            return None
+        return digest.digest()
+
+    def _fingerprint(self, path):
+        """Returns the raw Chromaprint fingerprint of the first FINGERPRINT_SECONDS as a list of ints, or None."""
+        try:
+            result = subprocess.run([self.fpcalc_path, "-raw", "-length", str(self.FINGERPRINT_SECONDS), path],
+                                    capture_output=True, text=True, timeout=60)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print(f"Duplicates: fpcalc failed for {path}: {e}", file=sys.stderr)
+            return None
+        for line in result.stdout.splitlines():
+            if line.startswith("FINGERPRINT="):
+                try:
+                    return [int(value) for value in line[len("FINGERPRINT="):].split(",") if value]
+                except ValueError:
+                    return None
+        return None
+
+    def _similarity(self, a, b):
+        """Fraction of equal bits between two aligned raw fingerprints."""
+        n = min(len(a), len(b))
+        if n == 0:
+            return 0.0
+        differing = sum(bin((x ^ y) & 0xFFFFFFFF).count("1") for x, y in zip(a, b))
+        return 1.0 - differing / (32 * n)
+
+
+PLAYLIST_EXTENSIONS = (".m3u", ".m3u8", ".pls", ".xspf")
+XSPF_NAMESPACE = "http://xspf.org/ns/0/"
+
+
+def _playlist_entry_uri(location, base_dir):
+    """Turns a playlist location (URL, file URI, absolute or relative path) into a URI."""
+    location = location.strip()
+    if "://" in location:
+        return normalize_uri(location)
+    if os.sep == "/" and "\\" in location and "/" not in location:
+        location = location.replace("\\", "/")
+    path = location if os.path.isabs(location) else os.path.join(base_dir, location)
+    return file_uri(os.path.normpath(path))
+
+
+def _title_from_uri(uri):
+    return os.path.splitext(os.path.basename(unquote(urlparse(uri).path)))[0] or uri
+
+
+def _read_m3u(path, base_dir):
+    encoding = "utf-8-sig" if path.lower().endswith(".m3u8") else "utf-8"
+    title = artist = None
+    duration_ns = 0
+    with open(path, 'r', encoding=encoding, errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("#EXTINF:"):
+                head, _, display = line[len("#EXTINF:"):].partition(",")
+                try:
+                    duration_ns = max(0, int(float(head.split()[0]) * Gst.SECOND)) if head.split() else 0
+                except ValueError:
+                    duration_ns = 0
+                artist, separator, title = (display + " ").partition(" - ")
+                if separator:
+                    title = title.strip()
+                else:
+                    artist, title = None, display
+                continue
+            if line.startswith("#"):
+                continue
+            uri = _playlist_entry_uri(line, base_dir)
+            yield (uri, title or None, artist or None, duration_ns)
+            title = artist = None
+            duration_ns = 0
+
+
+def _read_pls(path, base_dir):
+    """Reads File/Title/Length keys. Entries are expected in order, as every writer emits them."""
+    current_index = None
+    entry = {}
+
+    def finish():
+        if entry.get("file"):
+            uri = _playlist_entry_uri(entry["file"], base_dir)
+            try:
+                duration_ns = max(0, int(entry.get("length", "0")) * Gst.SECOND)
+            except ValueError:
+                duration_ns = 0
+            return (uri, entry.get("title") or None, None, duration_ns)
+        return None
+
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            key, separator, value = line.strip().partition("=")
+            if not separator:
+                continue
+            key = key.strip().lower()
+            for field in ("file", "title", "length"):
+                if key.startswith(field) and key[len(field):].isdigit():
+                    index = int(key[len(field):])
+                    if index != current_index:
+                        row = finish()
+                        if row:
+                            yield row
+                        current_index = index
+                        entry = {}
+                    entry[field] = value.strip()
+                    break
+    row = finish()
+    if row:
+        yield row
+
+
+def _read_xspf(path, base_dir):
+    """
+    Parses tracks with iterparse and detaches each one from its parent after use, so memory
+    stays flat however many tracks the file lists.
+    """
+    base_uri = file_uri(base_dir) + "/"
+
+    def local_name(tag):
+        return tag.rsplit("}", 1)[-1]
+
+    open_elements = []
+    for event, element in ElementTree.iterparse(path, events=("start", "end")):
+        if event == "start":
+            open_elements.append(element)
+            continue
+        open_elements.pop()
+        if local_name(element.tag) != "track":
+            continue
+        fields = {local_name(child.tag): (child.text or "").strip() for child in element}
+        if open_elements:
+            open_elements[-1].remove(element)
+        location = fields.get("location")
+        if not location:
+            continue
+        uri = normalize_uri(urljoin(base_uri, location) if "://" not in location else location)
+        try:
+            duration_ns = max(0, int(fields.get("duration") or 0) * Gst.MSECOND)
+        except ValueError:
+            duration_ns = 0
+        yield (uri, fields.get("title") or None, fields.get("creator") or None, duration_ns)
+
+
+def read_playlist_file(path):
+    """
+    Yields (uri, title, artist, duration_ns) for each entry of an M3U/M3U8, PLS or XSPF file,
+    reading it incrementally. Relative locations are resolved against the playlist's folder.
+    title and artist are None when the file does not give them.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".m3u", ".m3u8"):
+        return _read_m3u(path, base_dir)
+    if extension == ".pls":
+        return _read_pls(path, base_dir)
+    if extension == ".xspf":
+        return _read_xspf(path, base_dir)
+    raise ValueError(f"Unsupported playlist format: {extension}")
+
+
+def _m3u_location(uri, base_dir):
+    """Local files inside the playlist's folder are written relative to it, others as absolute paths."""
+    if not uri.startswith("file://"):
+        return uri
+    file_path = unquote(urlparse(uri).path)
+    relative = os.path.relpath(file_path, base_dir)
+    return file_path if relative.startswith("..") else relative
+
+
+def write_playlist_file(path, rows):
+    """
+    Writes (uri, title, artist, duration_ns) rows as M3U/M3U8, PLS or XSPF, chosen by extension.
+    Rows are written as they are consumed, into a temporary file that replaces path at the end
+    and is removed if writing fails. Missing titles and artists are left out.
+    Returns the number of entries written.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in PLAYLIST_EXTENSIONS:
+        raise ValueError(f"Unsupported playlist format: {extension}")
+    tmp_path = path + ".tmp"
+    try:
+        count = _write_playlist_entries(tmp_path, extension, base_dir, rows)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return count
+
+
+def _write_playlist_entries(tmp_path, extension, base_dir, rows):
+    count = 0
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        if extension in (".m3u", ".m3u8"):
+            f.write("#EXTM3U\n")
+            for uri, title, artist, duration_ns in rows:
+                count += 1
+                seconds = duration_ns // Gst.SECOND if duration_ns > 0 else -1
+                display = f"{artist} - {title or ''}" if artist else title or ""
+                f.write(f"#EXTINF:{seconds},{display}\n{_m3u_location(uri, base_dir)}\n")
+        elif extension == ".pls":
+            f.write("[playlist]\n")
+            for uri, title, artist, duration_ns in rows:
+                count += 1
+                seconds = duration_ns // Gst.SECOND if duration_ns > 0 else -1
+                f.write(f"File{count}={_m3u_location(uri, base_dir)}\n")
+                if title:
+                    f.write(f"Title{count}={title}\n")
+                f.write(f"Length{count}={seconds}\n")
+            f.write(f"NumberOfEntries={count}\nVersion=2\n")
+        else:
+            f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<playlist version="1" xmlns="{XSPF_NAMESPACE}">\n  <trackList>\n')
+            for uri, title, artist, duration_ns in rows:
+                count += 1
+                f.write(f"    <track>\n      <location>{xml_escape(uri)}</location>\n")
+                if title:
+                    f.write(f"      <title>{xml_escape(title)}</title>\n")
+                if artist:
+                    f.write(f"      <creator>{xml_escape(artist)}</creator>\n")
+                if duration_ns > 0:
+                    f.write(f"      <duration>{duration_ns // Gst.MSECOND}</duration>\n")
+                f.write("    </track>\n")
+            f.write("  </trackList>\n</playlist>\n")
+    return count
+
+
 class NamoWindow(Adw.ApplicationWindow):
+    FOLDER_ART_NAMES = ("cover", "folder", "front", "album", "albumart")
+    FOLDER_ART_EXTENSIONS = (".jpg", ".jpeg", ".png")
+    FOLDER_ART_MAX_BYTES = 16 * 1024 * 1024
+    FOLDER_ART_CACHE_ENTRIES = 256
+    PLAYLIST_IMPORT_BATCH = 2000
+    EXPORT_CHUNK_ROWS = 1000
+    SCAN_BATCH_SIZE = 100
+    SMART_REFRESH_DELAY_MS = 250
+    GOVERNOR_PROBE_MS = 100
+    MEMORY_ENFORCE_INTERVAL_S = 30
+    DEFAULT_PLAYLIST_NAME = "Playlist"
+    PLAY_FLAG_DOWNLOAD = 1 << 7
     PLAY_ICON = "media-playback-start-symbolic"
     PAUSE_ICON = "media-playback-pause-symbolic"
+    PROGRESS_UPDATE_INTERVAL_US = 250 * 1000
+    SCRUB_SEEK_INTERVAL_MS = 100
+    SCRUB_SEEK_TIMEOUT_MS = 500
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.current_song = None
         self._playlist_file_path = os.path.expanduser("~/.config/namo/playlist.json")
+        self.library = Library(LIBRARY_FILE_PATH)
+        self.current_playlist_name = self.DEFAULT_PLAYLIST_NAME
+        self._library_opened = False
+        self._updating_playlist_selector = False
+        self._smart_refresh_id = None
         self.duration_ns = 0 
         self._is_seeking = False 
         self._seek_value_ns = 0 
         self._was_playing_before_seek = False 
-        self._init_player()
+        self._stream_retry_uri = None 
+        self._wants_playing = False
+        self._buffering = False
+        self._is_live = False
+        self.stream_metrics = StreamMetrics()
+        self.memory_budget = MemoryBudget(settings["memory_budget_bytes"])
+        self.cover_textures = CoverTextureCache()
+        self.scan_governor = ScanGovernor(settings["scan_max_files_per_second"], settings["scan_max_bytes_per_second"],
+                                          settings["scan_low_priority"], settings["scan_backoff_latency_ms"])
+        self._governor_probe_id = None
+        self._governor_probe_at = 0.0
+        self._preroll_lock = threading.Lock()
+        self._preroll = None 
+        self._pending_gapless = None 
+        self._preroll_refresh_id = None 
+        self._displayed_art = None 
+        self._switch_started_at = None 
+        self._switch_is_remote = False 
+        self._progress_tick_id = None 
+        self._last_progress_update_us = 0 
+        self._pending_scrub_ns = None 
+        self._scrub_seek_in_flight = False 
+        self._last_scrub_seek_time = 0.0 
+        self._scrub_timer_id = None 
+        self._folder_art_lock = threading.Lock()
+        self._folder_art = {} 
+        self.replaygain_store = ReplayGainStore(os.path.join(CACHE_DIR, "replaygain.json"))
+        self.replaygain_analyzer = ReplayGainAnalyzer(self.replaygain_store, settings["replaygain_workers"])
+        if self.replaygain_store.pending_albums():
+            print("ReplayGain: resuming pending loudness analysis.")
+            GLib.idle_add(self._on_resume_replaygain_idle)
+        self._waveform_peaks = None 
+        self.peak_generator = None
+        if settings["waveform_enabled"]:
+            self.peak_generator = PeakSummaryGenerator(os.path.join(CACHE_DIR, "peaks"), settings["waveform_workers"])
+        self.album_art_fetcher = AlbumArtFetcher()
+        self.media_cache = None
+        if settings["media_cache_enabled"]:
+            self.media_cache = MediaCache(os.path.join(CACHE_DIR, "media"), settings["media_cache_max_bytes"])
+            threading.Thread(target=self.media_cache.verify, daemon=True).start()
+        self.player = None
+        self.rgvolume = None
+        self.discoverer = None
+        self._discovered_executor = None
+        self._first_paint_handler = None
+        self.connect("map", self._on_window_mapped)
         self._setup_actions() 
 
         self.set_title("Namo Media Player")
@@ -109,9 +2997,33 @@ class NamoWindow(Adw.ApplicationWindow):
         
         main_menu = Gio.Menu()
         
+        main_menu.append("New Playlist", "win.new_playlist")
+        main_menu.append("New Smart Playlist...", "win.new_smart_playlist")
+        main_menu.append("Delete Playlist", "win.delete_playlist")
         main_menu.append("Open Playlist", "win.open_playlist")
         main_menu.append("Save Playlist", "win.save_playlist")
         main_menu.append("Add Folder...", "win.add_folder_new") 
+
+        sort_menu = Gio.Menu()
+        sort_menu.append("Load Order", "win.sort_by::none")
+        sort_menu.append("Artist", "win.sort_by::artist")
+        sort_menu.append("Title", "win.sort_by::title")
+        sort_menu.append("Duration", "win.sort_by::duration")
+        sort_menu.append("Path", "win.sort_by::path")
+        main_menu.append_submenu("Sort By", sort_menu)
+
+        playback_menu = Gio.Menu()
+        playback_menu.append("Shuffle", "win.shuffle")
+        repeat_section = Gio.Menu()
+        repeat_section.append("No Repeat", "win.repeat::none")
+        repeat_section.append("Repeat All", "win.repeat::all")
+        repeat_section.append("Repeat One", "win.repeat::one")
+        playback_menu.append_section(None, repeat_section)
+        playback_menu.append("Play Selected Next", "win.play_next")
+        main_menu.append_submenu("Playback", playback_menu)
+        main_menu.append("Find Duplicates", "win.find_duplicates")
+        main_menu.append("Analyze Loudness", "win.analyze_loudness")
+        main_menu.append("Memory Usage", "win.memory_usage")
         
         section = Gio.Menu()
         section.append("About", "win.about")
@@ -144,6 +3056,11 @@ class NamoWindow(Adw.ApplicationWindow):
         import_bc_button.connect("clicked", self._on_import_bandcamp_clicked)
         header.pack_end(import_bc_button) 
 
+        search_button = Gtk.ToggleButton()
+        search_button.set_icon_name("system-search-symbolic")
+        search_button.set_tooltip_text("Search Playlist")
+        header.pack_end(search_button)
+
 
         
         main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
@@ -180,8 +3097,20 @@ class NamoWindow(Adw.ApplicationWindow):
         self.progress_scale.set_draw_value(False) 
         self.progress_scale.set_hexpand(True)
         self.progress_scale.set_sensitive(False) 
+        self.progress_scale.connect("map", self._on_progress_scale_mapped)
+        self.progress_scale.connect("unmap", self._on_progress_scale_unmapped)
+
         
-        main_box.append(self.progress_scale)
+        self.waveform_area = Gtk.DrawingArea()
+        self.waveform_area.set_content_height(32)
+        self.waveform_area.set_draw_func(self._draw_waveform)
+        self.progress_scale.connect("value-changed", lambda scale: self.waveform_area.queue_draw())
+        progress_overlay = Gtk.Overlay()
+        progress_overlay.set_child(self.waveform_area)
+        progress_overlay.add_overlay(self.progress_scale)
+        if self.peak_generator:
+            self.progress_scale.add_css_class("waveform-scale")
+        main_box.append(progress_overlay)
 
         
         drag_controller = Gtk.GestureDrag()
@@ -196,9 +3125,11 @@ class NamoWindow(Adw.ApplicationWindow):
         playlist_header_box.set_margin_start(12) 
         playlist_header_box.set_margin_end(12)
 
-        playlist_label = Gtk.Label(label="Playlist", xalign=0, hexpand=True) 
-        playlist_label.add_css_class("title-4")
-        playlist_header_box.append(playlist_label)
+        self.playlist_names = Gtk.StringList()
+        self.playlist_dropdown = Gtk.DropDown(model=self.playlist_names, hexpand=True, halign=Gtk.Align.START)
+        self.playlist_dropdown.set_tooltip_text("Playlist")
+        self.playlist_dropdown.connect("notify::selected", self._on_playlist_dropdown_selected)
+        playlist_header_box.append(self.playlist_dropdown)
 
         self.remaining_time_label = Gtk.Label(label="", xalign=1, halign=Gtk.Align.END) 
         self.remaining_time_label.add_css_class("caption") 
@@ -206,6 +3137,20 @@ class NamoWindow(Adw.ApplicationWindow):
 
         main_box.append(playlist_header_box) 
 
+        self.search_entry = Gtk.SearchEntry()
+        self.search_entry.set_placeholder_text("Search artist or title")
+        self.search_entry.set_hexpand(True)
+        self.search_entry.connect("search-changed", self._on_search_changed)
+        self.search_entry.connect("stop-search", self._on_search_stopped)
+        self.search_bar = Gtk.SearchBar()
+        self.search_bar.set_child(self.search_entry)
+        self.search_bar.connect_entry(self.search_entry)
+        self.search_bar.set_key_capture_widget(self)
+        self.search_bar.connect("notify::search-mode-enabled", self._on_search_mode_changed)
+        main_box.append(self.search_bar)
+        search_button.bind_property("active", self.search_bar, "search-mode-enabled",
+                                    GObject.BindingFlags.BIDIRECTIONAL)
+
         scrolled_window = Gtk.ScrolledWindow()
         scrolled_window.set_vexpand(True)
         scrolled_window.set_hexpand(False)
@@ -213,14 +3158,18 @@ class NamoWindow(Adw.ApplicationWindow):
         main_box.append(scrolled_window)
 
         
-        self.playlist_store = Gio.ListStore(item_type=Song) 
+        self.playlist_store = PlaylistModel() 
         self.playlist_store.connect("items-changed", lambda store, pos, rem, add: self._update_remaining_time()) 
+        self.playlist_store.connect("items-changed", lambda store, pos, rem, add: self._schedule_preroll_refresh())
 
         factory = Gtk.SignalListItemFactory()
         factory.connect("setup", self._on_playlist_item_setup)
         factory.connect("bind", self._on_playlist_item_bind)
 
-        self.selection_model = Gtk.SingleSelection(model=self.playlist_store)
+        self.playlist_view_model = PlaylistViewModel(self.playlist_store)
+        self.playlist_view_model.connect("items-changed", lambda view, pos, rem, add: self._schedule_preroll_refresh())
+        self.play_queue = PlayQueue(self.playlist_store, self.playlist_view_model)
+        self.selection_model = Gtk.SingleSelection(model=self.playlist_view_model)
         self.selection_model.connect("selection-changed", self._on_playlist_selection_changed)
         self.selection_model.connect("selection-changed", lambda sel, pos, n_items: self._update_remaining_time()) 
 
@@ -236,13 +3185,25 @@ class NamoWindow(Adw.ApplicationWindow):
         self.playlist_view.add_controller(key_controller)
 
         
-        self._load_playlist()
+        self._setup_memory_budget()
         self._update_remaining_time() 
 
     
     def _setup_actions(self):
         action_group = Gio.SimpleActionGroup()
 
+        new_playlist_action = Gio.SimpleAction.new("new_playlist", None)
+        new_playlist_action.connect("activate", self._on_new_playlist_action)
+        action_group.add_action(new_playlist_action)
+
+        smart_playlist_action = Gio.SimpleAction.new("new_smart_playlist", None)
+        smart_playlist_action.connect("activate", self._on_new_smart_playlist_action)
+        action_group.add_action(smart_playlist_action)
+
+        delete_playlist_action = Gio.SimpleAction.new("delete_playlist", None)
+        delete_playlist_action.connect("activate", self._on_delete_playlist_action)
+        action_group.add_action(delete_playlist_action)
+
         open_action = Gio.SimpleAction.new("open_playlist", None)
         open_action.connect("activate", self._on_open_playlist_action)
         action_group.add_action(open_action)
@@ -255,78 +3216,453 @@ class NamoWindow(Adw.ApplicationWindow):
         add_folder_action.connect("activate", self._on_add_folder_action)
         action_group.add_action(add_folder_action)
 
+        duplicates_action = Gio.SimpleAction.new("find_duplicates", None)
+        duplicates_action.connect("activate", self._on_find_duplicates_action)
+        action_group.add_action(duplicates_action)
+
+        analyze_action = Gio.SimpleAction.new("analyze_loudness", None)
+        analyze_action.connect("activate", self._on_analyze_loudness_action)
+        action_group.add_action(analyze_action)
+
+        memory_action = Gio.SimpleAction.new("memory_usage", None)
+        memory_action.connect("activate", self._on_memory_usage_action)
+        action_group.add_action(memory_action)
+
+        sort_action = Gio.SimpleAction.new_stateful("sort_by", GLib.VariantType.new("s"), GLib.Variant.new_string("none"))
+        sort_action.connect("change-state", self._on_sort_by_action)
+        action_group.add_action(sort_action)
+
+        shuffle_action = Gio.SimpleAction.new_stateful("shuffle", None, GLib.Variant.new_boolean(False))
+        shuffle_action.connect("change-state", self._on_shuffle_action)
+        action_group.add_action(shuffle_action)
+
+        repeat_action = Gio.SimpleAction.new_stateful("repeat", GLib.VariantType.new("s"), GLib.Variant.new_string("none"))
+        repeat_action.connect("change-state", self._on_repeat_action)
+        action_group.add_action(repeat_action)
+
+        play_next_action = Gio.SimpleAction.new("play_next", None)
+        play_next_action.connect("activate", self._on_play_next_action)
+        action_group.add_action(play_next_action)
+
         about_action = Gio.SimpleAction.new("about", None)
         about_action.connect("activate", self._on_about_action)
         action_group.add_action(about_action)
 
         self.insert_action_group("win", action_group)
 
-    def _init_player(self):
-        """Initialize GStreamer player and discoverer."""
-        
-        self.discoverer = GstPbutils.Discoverer.new(5 * Gst.SECOND) 
-        self.discoverer.connect("discovered", self._on_discoverer_discovered)
-        self.discoverer.connect("finished", self._on_discoverer_finished)
-        self.discoverer.start() 
+    def _on_window_mapped(self, window):
+        """Waits for the first frame to be drawn before building the player."""
+        if self.player is None and self._first_paint_handler is None:
+            frame_clock = self.get_frame_clock()
+            self._first_paint_handler = (frame_clock, frame_clock.connect("after-paint", self._on_first_paint))
+
+    def _on_first_paint(self, frame_clock):
+        frame_clock.disconnect(self._first_paint_handler[1])
+        print(f"Startup: first frame drawn {(time.monotonic() - STARTED_AT) * 1000:.0f} ms after start", flush=True)
+        GLib.idle_add(self._open_library)
+        GLib.idle_add(self._init_player)
+
+    def _get_discoverer(self):
+        """Creates and starts the GstPbutils.Discoverer on first use."""
+        if self.discoverer is None:
+            self.discoverer = GstPbutils.Discoverer.new(5 * Gst.SECOND) 
+            self.discoverer.connect("discovered", self._on_discoverer_discovered)
+            self.discoverer.connect("finished", self._on_discoverer_finished)
+            self.discoverer.start() 
+            self._discovered_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="discovered")
+        return self.discoverer
 
-        
+    def _init_player(self):
+        """Initialize the GStreamer player. Runs once, after the window's first frame."""
+        if self.player is not None:
+            return GLib.SOURCE_REMOVE
+        started = time.monotonic()
         self.player = Gst.ElementFactory.make("playbin", "player")
         if not self.player:
             print("ERROR: Could not create GStreamer playbin element.", file=sys.stderr)
             
-            return
+            return GLib.SOURCE_REMOVE
         
         rgvolume = Gst.ElementFactory.make("rgvolume", "rgvolume")
         if not rgvolume:
             print("ERROR: Could not create rgvolume element.", file=sys.stderr)
-            return
+            return GLib.SOURCE_REMOVE
 
         
+        rgvolume.set_property("album-mode", settings["replaygain_album_mode"])
         self.player.set_property("audio-filter", rgvolume)
+        self.rgvolume = rgvolume
+
+        if settings["gapless_playback"]:
+            self.player.connect("about-to-finish", self._on_about_to_finish)
+
+        if settings["stream_buffer_size"] > 0:
+            self.player.set_property("buffer-size", int(settings["stream_buffer_size"]))
+        if settings["stream_buffer_duration_s"] > 0:
+            self.player.set_property("buffer-duration", int(settings["stream_buffer_duration_s"] * Gst.SECOND))
+        if settings["progressive_download"]:
+            self.player.set_property("flags", self.player.get_property("flags") | self.PLAY_FLAG_DOWNLOAD)
 
         
         bus = self.player.get_bus()
         bus.add_signal_watch()
         bus.connect("message", self._on_player_message)
+        print(f"Startup: player ready in {(time.monotonic() - started) * 1000:.0f} ms")
+        return GLib.SOURCE_REMOVE
 
-    def play_uri(self, uri):
-        """Loads and starts playing a URI."""
+    def play_uri(self, uri, row_id=None):
+        """Loads and starts playing a URI. row_id picks the playlist row when the URI appears more than once."""
         if not self.player:
             self.current_song = None
             return
 
         
-        self.current_song = None
-        for i in range(self.playlist_store.get_n_items()):
-             song = self.playlist_store.get_item(i)
-             if song.uri == uri:
-                 self.current_song = song
-                 break
-
+        position = self.playlist_store.position_of_row(row_id) if row_id else self.playlist_store.find_uri(uri)
+        self.current_song = self.playlist_store.get_item(position) if position is not None else None
+        if self.current_song:
+            self.play_queue.set_current(self.current_song.row_id)
+
+        with self._preroll_lock:
+            self._pending_gapless = None
+        self._switch_started_at = time.monotonic()
         self._update_song_display(self.current_song)
+        self._show_waveform(self.current_song)
 
-        print(f"Playing URI: {uri}")
-        self.player.set_property("uri", uri)
-        self.player.set_state(Gst.State.PLAYING)
-        
-        self.play_pause_button.set_icon_name(self.PAUSE_ICON)
-        
         self.duration_ns = 0 
         self.progress_scale.set_value(0) 
+
+        self._apply_replaygain(uri)
+        playable_uri = self._playable_uri_now(uri)
+        if playable_uri:
+            self._start_playback(playable_uri)
+            self._cache_remote_track(uri, playable_uri)
+        else:
+            print(f"Resolving stream URL before playback: {uri}")
+            thread = threading.Thread(target=self._resolve_stream_thread, args=(uri,), daemon=True)
+            thread.start()
+
+        self._prefetch_upcoming_streams()
+        self._precompute_upcoming_peaks()
+        self._prepare_next_track()
+
+    def _apply_replaygain(self, uri):
+        """
+        Uses analyzed loudness for files without ReplayGain tags: rgvolume applies its
+        fallback-gain only when the stream carries no tags, so files are never rewritten.
+        """
+        if not self.rgvolume:
+            return
+        gains = self.replaygain_store.get(uri) or {}
+        gain = gains.get('album_gain') if settings["replaygain_album_mode"] else None
+        if gain is None:
+            gain = gains.get('track_gain', 0.0)
+        self.rgvolume.set_property("fallback-gain", gain)
+
+    def _on_analyze_loudness_action(self, action, param):
+        """Handles the 'win.analyze_loudness' action: queues every local track without results."""
+        uris = [row[0] for row in self.playlist_store.iter_rows(with_art=False)]
+        print(f"ReplayGain: queueing loudness analysis for {len(uris)} playlist entries.")
+        self.replaygain_analyzer.analyze(uris)
+
+    def _on_find_duplicates_action(self, action, param):
+        """Handles the 'win.find_duplicates' action: scans the playlist for duplicates in a background thread."""
+        rows = [(self.playlist_store.row_id_at(position), uri, title, artist, duration_ns)
+                for position, (uri, title, artist, duration_ns, _)
+                in enumerate(self.playlist_store.iter_rows(with_art=False))]
+        print(f"Duplicates: scanning {len(rows)} playlist entries.")
+        thread = threading.Thread(target=self._find_duplicates_thread, args=(rows,), daemon=True)
+        thread.start()
+
+    def _find_duplicates_thread(self, rows):
+        started = time.monotonic()
+        finder = DuplicateFinder(settings["duplicate_workers"], settings["duplicate_fingerprints"])
+        try:
+            groups = finder.find(rows)
+        except Exception as e:
+            print(f"Duplicates: scan failed: {e}", file=sys.stderr)
+            return
+        print(f"Duplicates: found {len(groups)} groups in {time.monotonic() - started:.1f} s")
+        GLib.idle_add(self._on_duplicates_found, groups)
+
+    def _on_duplicates_found(self, groups):
+        """Main-loop callback: reports the duplicate groups and offers to remove the extra entries."""
+        redundant = sum(len(group) - 1 for group in groups)
+        if not groups:
+            body = "No duplicate tracks were found in the playlist."
+        else:
+            examples = []
+            for group in groups[:5]:
+                position = self.playlist_store.position_of_row(group[0])
+                if position is not None:
+                    song = self.playlist_store.get_item(position)
+                    examples.append(f"{song.artist} - {song.title} ({len(group)} copies)")
+            body = f"{redundant} duplicate entries in {len(groups)} groups.\n\n" + "\n".join(examples)
+        dialog = Adw.MessageDialog.new(self, "Find Duplicates", body)
+        dialog.add_response("close", "_Close")
+        if groups:
+            dialog.add_response("remove", "_Remove Duplicates")
+            dialog.set_response_appearance("remove", Adw.ResponseAppearance.DESTRUCTIVE)
+        dialog.connect("response", self._on_duplicates_dialog_response, groups)
+        dialog.present()
+        return GLib.SOURCE_REMOVE
+
+    def _on_duplicates_dialog_response(self, dialog, response_id, groups):
+        """Keeps one entry per group (the playing one if it is in the group, else the first) and removes the rest."""
+        if response_id != "remove":
+            return
+        current_row_id = self.current_song.row_id if self.current_song else 0
+        redundant = set()
+        for group in groups:
+            keeper = current_row_id if current_row_id in group else group[0]
+            redundant.update(row_id for row_id in group if row_id != keeper)
+        self.playlist_store.remove_rows(redundant)
+        print(f"Duplicates: removed {len(redundant)} entries.")
+        self._update_remaining_time()
+
+    def _on_resume_replaygain_idle(self):
+        self.replaygain_analyzer.resume()
+        return GLib.SOURCE_REMOVE
+
+    def _playable_uri_now(self, uri, touch=True):
+        """
+        Returns a URI playbin can open right away (media cache, cached stream URL or the URI itself), or None if it needs resolving first.
+        touch=False leaves the media cache's recently-used order alone, for tracks that are only being prerolled.
+        """
+        cached_path = self.media_cache.lookup(uri, touch=touch) if self.media_cache and self._is_remote_uri(uri) else None
+        if cached_path:
+            print(f"Using media cache for: {uri}")
+            return pathlib.Path(cached_path).as_uri()
+        if self._needs_stream_resolution(uri):
+            return bc_scraper.cached_stream_url(uri) if bc_scraper else None
+        return uri
+
+    def _start_playback(self, playable_uri):
+        """
+        Hands a directly playable URI to playbin and starts playing.
+        A running pipeline is only dropped to READY (which flushes it) rather than NULL,
+        so the audio sink and the rgvolume filter stay open across track switches.
+        """
+        print(f"Playing URI: {playable_uri}")
+        current_state = self.player.get_state(0).state
+        if current_state in (Gst.State.PAUSED, Gst.State.PLAYING):
+            self.player.set_state(Gst.State.READY)
+        self._switch_is_remote = self._is_remote_uri(playable_uri)
+        self._buffering = False
+        self.scan_governor.playback_starved = False
+        self._wants_playing = True
+        if self._switch_is_remote:
+            self.stream_metrics.start_track(playable_uri)
+        else:
+            self.stream_metrics.finish_track()
+        self.player.set_property("uri", playable_uri)
+        self._is_live = self.player.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.NO_PREROLL
         
+        self.play_pause_button.set_icon_name(self.PAUSE_ICON)
+
+    def _on_buffering(self, percent):
+        """Pauses playback while a network source buffers (see handle_buffering). Live sources are never paused."""
+        if self._is_live or not self.player:
+            return
+        self.scan_governor.playback_starved = percent < 100 and self._wants_playing
+        was_buffering = self._buffering
+        self._buffering = handle_buffering(self.player, self.stream_metrics, percent,
+                                           was_buffering, self._wants_playing)
+        if self._buffering:
+            self.time_label.set_label(f"Buffering {percent}%")
+        elif was_buffering and not self._wants_playing:
+            self._update_progress()
+
+    def _is_remote_uri(self, uri):
+        return bool(uri) and uri.startswith(("http://", "https://"))
+
+    def _cache_remote_track(self, song_uri, source_url):
+        """Downloads a remote track into the media cache in the background, if caching is enabled."""
+        if self.media_cache and self._is_remote_uri(source_url):
+            self.media_cache.download_async(song_uri, source_url)
+
+    def _needs_stream_resolution(self, uri):
+        """True for Bandcamp track page URIs, which must be resolved to a signed stream URL."""
+        if not uri or not uri.startswith(("http://", "https://")) or not bandcamp_available():
+            return False
+        parsed = urlparse(uri)
+        host = (parsed.hostname or "").lower()
+        return (host == "bandcamp.com" or host.endswith(".bandcamp.com")) and parsed.path.startswith("/track/")
+
+    def _resolve_stream_thread(self, page_uri):
+        """Background thread: resolves a track page to a stream URL, then starts playback on the main loop."""
+        try:
+            stream_url = load_bc_scraper().resolve_stream_url(page_uri)
+        except Exception as e:
+            print(f"Error resolving stream URL for {page_uri}: {e}", file=sys.stderr)
+            stream_url = None
+        GLib.idle_add(self._on_stream_url_resolved, page_uri, stream_url)
+
+    def _on_stream_url_resolved(self, page_uri, stream_url):
+        """Main-loop callback: plays the resolved stream unless the user has moved on."""
+        if not self.current_song or self.current_song.uri != page_uri:
+            print(f"Discarding resolved stream URL for {page_uri}; track is no longer current.")
+            return GLib.SOURCE_REMOVE
+        if stream_url:
+            self._start_playback(stream_url)
+            self._cache_remote_track(page_uri, stream_url)
+        else:
+            print(f"Could not resolve a stream URL for {page_uri}", file=sys.stderr)
+            self._update_song_display(None)
+            self._show_waveform(None)
+            self.current_song = None
+        return GLib.SOURCE_REMOVE
+
+    def _play_row(self, row_id):
+        """Plays a row chosen by the play queue and moves the list selection to it."""
+        position = self.playlist_store.position_of_row(row_id)
+        if position is None:
+            return
+        self.play_uri(self.playlist_store.get_uri(position), row_id=row_id)
+        view_position = self.playlist_view_model.view_position(self.current_song)
+        if view_position is not None:
+            self.selection_model.set_selected(view_position)
+
+    def _upcoming_songs(self, count):
+        """Returns up to `count` songs that follow the current song in play-queue order."""
+        if not self.current_song:
+            return []
+        songs = []
+        for row_id in self.play_queue.upcoming(count):
+            position = self.playlist_store.position_of_row(row_id)
+            if position is not None:
+                songs.append(self.playlist_store.get_item(position))
+        return songs
+
+    def _prepare_next_track(self):
+        """Resolves the next track's playable URI and cover art ahead of time so about-to-finish can switch gaplessly."""
+        if not settings["gapless_playback"]:
+            return
+        upcoming = self._upcoming_songs(1)
+        next_song = upcoming[0] if upcoming else None
+        with self._preroll_lock:
+            previous = self._preroll
+        if next_song is None:
+            with self._preroll_lock:
+                self._preroll = None
+            return
+
+        playable_uri = self._playable_uri_now(next_song.uri, touch=False)
+        if previous and previous[0] is next_song:
+            art_pixbuf = previous[2]
+        else:
+            art_pixbuf = self._decode_album_art(next_song)
+        with self._preroll_lock:
+            self._preroll = (next_song, playable_uri, art_pixbuf)
+        if playable_uri:
+            print(f"Prerolled next track: {next_song.title}")
+
+    def _schedule_preroll_refresh(self):
+        """Coalesces preroll recomputation after playlist edits into a single idle callback."""
+        if self.current_song and self._preroll_refresh_id is None:
+            self._preroll_refresh_id = GLib.idle_add(self._on_preroll_refresh_idle)
+
+    def _on_preroll_refresh_idle(self):
+        self._preroll_refresh_id = None
+        self._prepare_next_track()
+        return GLib.SOURCE_REMOVE
+
+    def _on_about_to_finish(self, playbin):
+        """Streaming-thread callback: queues the prerolled next URI so playbin switches tracks without a state change."""
+        with self._preroll_lock:
+            preroll = self._preroll
+            self._preroll = None
+        if not preroll or not preroll[1]:
+            print("About to finish: no prerolled track, playback will stop at EOS.")
+            return
+        with self._preroll_lock:
+            self._pending_gapless = preroll
+        playbin.set_property("uri", preroll[1])
+
+    def _on_gapless_track_started(self):
+        """
+        Main-loop handler for the STREAM_START of a track queued by about-to-finish.
+        The queued track's fallback gain is applied here rather than in about-to-finish,
+        which fires while the previous track still has seconds of audio left to play.
+        """
+        with self._preroll_lock:
+            pending = self._pending_gapless
+            self._pending_gapless = None
+        if pending is None:
+            return
+        song, playable_uri, art_pixbuf = pending
+        print(f"Gapless switch to: {song.title}")
+        self._apply_replaygain(song.uri)
+
+        if self.play_queue.advance() != song.row_id:
+            self.play_queue.set_current(song.row_id)
+        self.current_song = song
+        self.duration_ns = 0
+        self._displayed_art = (song, art_pixbuf)
+        view_position = self.playlist_view_model.view_position(song)
+        if view_position is not None:
+            self.selection_model.set_selected(view_position)
+        self._update_song_display(song, art_pixbuf=art_pixbuf)
+        self._show_waveform(song)
+        if self._is_remote_uri(playable_uri):
+            self.stream_metrics.start_track(playable_uri)
+            self.stream_metrics.first_audio()
+        else:
+            self.stream_metrics.finish_track()
+        if self.media_cache:
+            self.media_cache.touch(song.uri)
+        self._cache_remote_track(song.uri, playable_uri)
+        self._prefetch_upcoming_streams()
+        self._precompute_upcoming_peaks()
+        self._prepare_next_track()
+
+    def _prefetch_upcoming_streams(self):
+        """Resolves stream URLs (and fills the media cache) for the next few tracks in the background."""
+        upcoming_uris = [song.uri for song in self._upcoming_songs(settings["stream_prefetch_count"])
+                         if self._is_remote_uri(song.uri)]
+        if self.media_cache:
+            upcoming_uris = [uri for uri in upcoming_uris if not self.media_cache.contains(uri)]
+        else:
+            upcoming_uris = [uri for uri in upcoming_uris
+                             if self._needs_stream_resolution(uri)
+                             and not (bc_scraper and bc_scraper.cached_stream_url(uri))]
+        if upcoming_uris:
+            thread = threading.Thread(target=self._prefetch_streams_thread, args=(upcoming_uris,), daemon=True)
+            thread.start()
+
+    def _prefetch_streams_thread(self, song_uris):
+        """Background thread: warms the stream URL cache and the media cache for upcoming tracks."""
+        for song_uri in song_uris:
+            stream_url = song_uri
+            if self._needs_stream_resolution(song_uri):
+                try:
+                    stream_url = load_bc_scraper().resolve_stream_url(song_uri)
+                except Exception as e:
+                    print(f"Error prefetching stream URL for {song_uri}: {e}", file=sys.stderr)
+                    continue
+            if stream_url:
+                self._cache_remote_track(song_uri, stream_url)
+        GLib.idle_add(self._schedule_preroll_refresh)
 
     def toggle_play_pause(self, button=None):
         """Toggles playback state."""
         if not self.player: return
 
         state = self.player.get_state(0).state
-        if state == Gst.State.PLAYING:
+        if self._buffering and state == Gst.State.PAUSED:
+            self._wants_playing = not self._wants_playing
+            self.scan_governor.playback_starved = self._wants_playing
+            print("Buffering: playback will " + ("resume" if self._wants_playing else "stay paused") + " when the buffer is full")
+            self.play_pause_button.set_icon_name(self.PAUSE_ICON if self._wants_playing else self.PLAY_ICON)
+        elif state == Gst.State.PLAYING:
             print("Pausing playback")
+            self._wants_playing = False
+            self.scan_governor.playback_starved = False
             self.player.set_state(Gst.State.PAUSED)
             self.play_pause_button.set_icon_name(self.PLAY_ICON)
         elif state == Gst.State.PAUSED or state == Gst.State.READY:
              
             print("Resuming/Starting playback")
+            self._wants_playing = True
             self.player.set_state(Gst.State.PLAYING)
             self.play_pause_button.set_icon_name(self.PAUSE_ICON)
         elif state == Gst.State.NULL:
@@ -411,12 +3747,7 @@ class NamoWindow(Adw.ApplicationWindow):
         if n_press == 2:
             print(f"Double-clicked/Activated song: {song.title}")
             if song and song.uri:
-                 
-                 if self.player:
-                     print("Stopping current playback due to activation.")
-                     self.player.set_state(Gst.State.NULL)
-                 
-                 self.play_uri(song.uri)
+                 self.play_uri(song.uri, row_id=song.row_id)
             else:
                  print("Cannot play activated item (no URI?).")
 
@@ -436,14 +3767,35 @@ class NamoWindow(Adw.ApplicationWindow):
         """Handles key presses on the playlist view, specifically Delete/Backspace."""
         if keyval == Gdk.KEY_Delete or keyval == Gdk.KEY_BackSpace:
             position = self.selection_model.get_selected()
-            if position != Gtk.INVALID_LIST_POSITION:
-                print(f"Deleting item at position: {position}")
-                self.playlist_store.remove(position)
+            source_position = self.playlist_view_model.source_position(position) if position != Gtk.INVALID_LIST_POSITION else None
+            if source_position is not None:
+                print(f"Deleting item at position: {source_position}")
+                self.playlist_store.remove(source_position)
                 
                 
                 return True 
         return False 
 
+    def _on_sort_by_action(self, action, value):
+        """Handles the 'win.sort_by' action: re-sorts the playlist view without touching the playlist itself."""
+        field = value.get_string()
+        action.set_state(value)
+        self.playlist_view_model.set_sort_field(None if field == "none" else field)
+
+    def _on_search_mode_changed(self, search_bar, pspec):
+        if search_bar.get_search_mode():
+            self.playlist_store.enable_search_index()
+        else:
+            self.search_entry.set_text("")
+            self.playlist_view_model.set_filter_text("")
+
+    def _on_search_changed(self, entry):
+        """Filters the playlist view as the user types; lookups go through the trigram index."""
+        self.playlist_view_model.set_filter_text(entry.get_text())
+
+    def _on_search_stopped(self, entry):
+        self.search_bar.set_search_mode(False)
+
     def _on_add_clicked(self, button):
         """Handles the Add button click: shows a Gtk.FileDialog."""
         dialog = Gtk.FileDialog.new()
@@ -509,54 +3861,191 @@ class NamoWindow(Adw.ApplicationWindow):
         folder_path = folder_gio_file.get_path()
         if folder_path and os.path.isdir(folder_path):
             print(f"Starting background scan thread for: {folder_path}")
-            thread = threading.Thread(target=self._scan_folder_thread, args=(folder_path,), daemon=True)
+            self.scan_governor.begin_scan()
+            self._start_governor_probe()
+            thread = threading.Thread(target=self._scan_folder_thread,
+                                      args=(folder_path, self.current_playlist_name), daemon=True)
             thread.start()
         else:
             print(f"Cannot scan folder: Invalid path or not a directory ({folder_path})", file=sys.stderr)
 
-    def _scan_folder_thread(self, folder_path):
-        """Background thread function to recursively scan a folder for audio files."""
+    def _start_governor_probe(self):
+        """Measures main-loop latency for the scan governor while scans are running."""
+        if self._governor_probe_id is None:
+            self._governor_probe_at = time.monotonic()
+            self._governor_probe_id = GLib.timeout_add(self.GOVERNOR_PROBE_MS, self._on_governor_probe)
+
+    def _on_governor_probe(self):
+        now = time.monotonic()
+        lag_ms = (now - self._governor_probe_at) * 1000 - self.GOVERNOR_PROBE_MS
+        self._governor_probe_at = now
+        self.scan_governor.report_main_loop_lag(lag_ms)
+        if self.scan_governor.active > 0:
+            return GLib.SOURCE_CONTINUE
+        self._governor_probe_id = None
+        return GLib.SOURCE_REMOVE
+
+    def _scan_folder_thread(self, folder_path, playlist_name):
+        """Background thread function to recursively scan a folder for audio files into playlist_name."""
+        try:
+            self.scan_governor.enter_thread()
+            self._scan_folder(folder_path, playlist_name)
+        finally:
+            self.scan_governor.end_scan()
+
+    def _scan_folder(self, folder_path, playlist_name):
         print(f"Thread '{threading.current_thread().name}': Scanning {folder_path}")
         audio_extensions = {".mp3", ".flac", ".ogg", ".opus", ".m4a", ".wav", ".aac"}
         files_found = 0
         files_added = 0
+        present_uris = set()
+        walk_errors = []
 
         try:
-            for root, _, filenames in os.walk(folder_path):
+            for root, _, filenames in os.walk(folder_path, onerror=walk_errors.append):
+                folder_art = None
+                scanned_songs = []
                 for filename in filenames:
                     if filename.lower().endswith(tuple(audio_extensions)):
                         files_found += 1
                         full_path = os.path.join(root, filename)
                         try:
-                            file_uri = pathlib.Path(full_path).as_uri()
+                            track_uri = file_uri(full_path)
+                            present_uris.add(track_uri)
+                            if folder_art is None:
+                                folder_art = self._get_folder_art(root, filenames) or False
                             
-                            song_object = self._discover_uri_sync(file_uri, full_path)
+                            song_object = self._discover_uri_sync(track_uri, full_path, folder_art or None)
 
                             if song_object:
                                 files_added += 1
-                                
-                                GLib.idle_add(self.playlist_store.append, song_object)
-                                
-                                
+                                scanned_songs.append(song_object)
+                                if len(scanned_songs) >= self.SCAN_BATCH_SIZE:
+                                    self._add_scanned_songs(scanned_songs, playlist_name)
+                                    scanned_songs = []
                                 
                         except Exception as file_proc_err:
                             print(f"Thread '{threading.current_thread().name}': Error processing file {full_path}: {file_proc_err}", file=sys.stderr)
+                        self.scan_governor.file_done(full_path)
+                self._add_scanned_songs(scanned_songs, playlist_name)
+
+            if walk_errors:
+                print(f"Thread '{threading.current_thread().name}': {len(walk_errors)} folders could not be read; keeping their library entries.", file=sys.stderr)
+            else:
+                removed_ids = self.library.remove_missing(folder_path, present_uris)
+                if removed_ids:
+                    print(f"Thread '{threading.current_thread().name}': Removed {len(removed_ids)} missing files from the library.")
+                    GLib.idle_add(self._schedule_smart_refresh)
 
         except Exception as walk_err:
             print(f"Thread '{threading.current_thread().name}': Error walking directory {folder_path}: {walk_err}", file=sys.stderr)
 
-        print(f"Thread '{threading.current_thread().name}': Finished scanning {folder_path}. Found: {files_found}, Added: {files_added}")
+        print(f"Thread '{threading.current_thread().name}': Finished scanning {folder_path}. Found: {files_found}, Added: {files_added}, "
+              f"backed off {self.scan_governor.backoff_seconds:.1f} s in total")
 
 
-    def _discover_uri_sync(self, uri, filepath):
+    def _add_scanned_songs(self, songs, playlist_name):
+        """Background thread: records scanned songs in the library, then adds them to playlist_name as one batch."""
+        if not songs:
+            return
+        arts = [song.album_art_data for song in songs]
+        track_ids = self.library.add_tracks([(song.uri, song.known_title, song.known_artist, song.album or None,
+                                              song.duration, art)
+                                             for song, art in zip(songs, arts)])
+        rows = [(song.uri, song.known_title, song.known_artist, song.duration, art, track_id)
+                for song, art, track_id in zip(songs, arts, track_ids)]
+        GLib.idle_add(self._on_library_tracks_added, rows, playlist_name)
+
+    def _on_library_tracks_added(self, rows, playlist_name):
+        """
+        Main-loop callback for tracks a scan or import has put in the library for playlist_name,
+        the playlist shown when it started. They are appended to the shown rows while that
+        playlist is still shown, and to its stored track ids otherwise. A smart playlist is
+        refreshed instead, as its query decides membership.
+        """
+        if self.library.is_smart(playlist_name):
+            self._schedule_smart_refresh()
+        elif playlist_name == self.current_playlist_name:
+            self.playlist_store.extend_rows(rows)
+        else:
+            self.library.append_to_playlist(playlist_name, [row[5] for row in rows])
+        return GLib.SOURCE_REMOVE
+
+    def _schedule_smart_refresh(self):
+        if self._smart_refresh_id is None and self.library.is_smart(self.current_playlist_name):
+            self._smart_refresh_id = GLib.timeout_add(self.SMART_REFRESH_DELAY_MS, self._refresh_smart_playlist)
+        return GLib.SOURCE_REMOVE
+
+    def _refresh_smart_playlist(self):
+        """Applies the smart playlist's current results to the shown rows, touching only rows that changed."""
+        self._smart_refresh_id = None
+        if not self.library.is_smart(self.current_playlist_name):
+            return GLib.SOURCE_REMOVE
+        wanted = self.library.load_playlist(self.current_playlist_name) or array('q')
+        wanted_ids = set(wanted)
+        shown = self.playlist_store.track_ids()
+        shown_ids = set(shown)
+        stale_rows = {self.playlist_store.row_id_at(position)
+                      for position, track_id in enumerate(shown) if track_id not in wanted_ids}
+        if stale_rows:
+            self.playlist_store.remove_rows(stale_rows)
+        new_ids = [track_id for track_id in wanted if track_id not in shown_ids]
+        if new_ids:
+            self.playlist_store.extend_rows(self.library.get_rows(new_ids))
+        return GLib.SOURCE_REMOVE
+
+    def _get_folder_art(self, directory, filenames=None):
+        """
+        Returns the sidecar cover (cover.jpg, folder.png, ...) of a directory as GLib.Bytes, or None.
+        Each directory is probed once; the same object is then shared by all of its tracks.
+        The FOLDER_ART_CACHE_ENTRIES most recently used directories are remembered.
+        filenames, when the caller already listed the directory, saves another listing.
+        Reads the disk, so it must not run on the main loop.
+        """
+        with self._folder_art_lock:
+            if directory in self._folder_art:
+                art = self._folder_art.pop(directory)
+                self._folder_art[directory] = art
+                return art
+        if filenames is None:
+            try:
+                filenames = os.listdir(directory)
+            except OSError:
+                filenames = []
+        candidates = {}
+        for filename in filenames:
+            stem, extension = os.path.splitext(filename.lower())
+            if stem in self.FOLDER_ART_NAMES and extension in self.FOLDER_ART_EXTENSIONS:
+                candidates.setdefault(self.FOLDER_ART_NAMES.index(stem), filename)
+        art = None
+        for _, filename in sorted(candidates.items()):
+            path = os.path.join(directory, filename)
+            try:
+                if os.path.getsize(path) > self.FOLDER_ART_MAX_BYTES:
+                    continue
+                with open(path, 'rb') as f:
+                    art = GLib.Bytes.new(f.read())
+                break
+            except OSError as e:
+                print(f"Could not read folder art {path}: {e}", file=sys.stderr)
+        with self._folder_art_lock:
+            art = self._folder_art.pop(directory, art)
+            self._folder_art[directory] = art
+            while len(self._folder_art) > self.FOLDER_ART_CACHE_ENTRIES:
+                del self._folder_art[next(iter(self._folder_art))]
+            return art
+
+    def _discover_uri_sync(self, uri, filepath, folder_art=None):
         """
         Synchronous helper to discover metadata and art for a single file path.
         Runs within the background folder scanning thread.
-        Uses Mutagen primarily. Returns a Song object or None.
+        Uses Mutagen primarily, falling back to folder_art when the file has no embedded cover.
+        Returns a Song object or None.
         """
         
         mutagen_title = None
         mutagen_artist = None
+        mutagen_album = None
         album_art_bytes = None
         album_art_glib_bytes = None
         duration_ns = 0 
@@ -565,6 +4054,7 @@ class NamoWindow(Adw.ApplicationWindow):
             if not os.path.exists(filepath):
                  print(f"Sync Discover Error: File path does not exist: {filepath}", file=sys.stderr)
                  return None
+            mutagen = load_mutagen()
 
             
             try:
@@ -573,6 +4063,7 @@ class NamoWindow(Adw.ApplicationWindow):
                 if audio_easy:
                     mutagen_title = audio_easy.get('title', [None])[0]
                     mutagen_artist = audio_easy.get('artist', [None])[0]
+                    mutagen_album = audio_easy.get('album', [None])[0]
                     
                     duration_str = audio_easy.get('length', [None])[0]
                     if duration_str:
@@ -615,7 +4106,7 @@ class NamoWindow(Adw.ApplicationWindow):
 
         
         
-        final_title = mutagen_title if mutagen_title else os.path.splitext(os.path.basename(filepath))[0]
+        final_title = mutagen_title
         final_artist = mutagen_artist 
         
         duration_to_store = duration_ns if isinstance(duration_ns, int) and duration_ns >= 0 else 0
@@ -623,10 +4114,14 @@ class NamoWindow(Adw.ApplicationWindow):
         
         try:
             song = Song(uri=uri, title=final_title, artist=final_artist, duration=duration_to_store)
+            if mutagen_album:
+                song.album = mutagen_album
 
             
             if album_art_glib_bytes:
                  song.album_art_data = album_art_glib_bytes
+            elif folder_art:
+                 song.album_art_data = folder_art
 
             
             return song
@@ -637,14 +4132,15 @@ class NamoWindow(Adw.ApplicationWindow):
     
     def _discover_and_add_uri(self, uri):
         
+        uri = normalize_uri(uri)
         print(f"Starting ASYNC discovery for: {uri}") 
-        self.discoverer.discover_uri_async(uri)
+        self._get_discoverer().discover_uri_async(uri)
 
     def _on_discoverer_discovered(self, discoverer, info, error):
         """Callback when GstDiscoverer finishes discovering a URI."""
         
         print(f"--- ASYNC _on_discoverer_discovered called for URI: {info.get_uri()} ---") 
-        uri = info.get_uri()
+        uri = normalize_uri(info.get_uri())
 
         
         if error:
@@ -685,6 +4181,7 @@ class NamoWindow(Adw.ApplicationWindow):
                          print(f"Mutagen error: File path does not exist: {filepath}", file=sys.stderr)
                     else:
                         print(f"Attempting to read tags/art with Mutagen: {filepath}")
+                        mutagen = load_mutagen()
                         
                         try:
                             audio_easy = mutagen.File(filepath, easy=True)
@@ -763,7 +4260,7 @@ class NamoWindow(Adw.ApplicationWindow):
             print(f"Discovered OK: URI='{song_to_add.uri}', Title='{song_to_add.title}', Artist='{song_to_add.artist}', Duration={song_to_add.duration / Gst.SECOND:.2f}s, Art Assigned={song_to_add.album_art_data is not None}")
 
             
-            GLib.idle_add(self.playlist_store.append, song_to_add)
+            self._discovered_executor.submit(self._finish_discovered_song, song_to_add)
             print(f"Scheduled add for: {final_title or 'Unknown Title'}")
 
         elif result == GstPbutils.DiscovererResult.TIMEOUT:
@@ -777,6 +4274,16 @@ class NamoWindow(Adw.ApplicationWindow):
              print(f"Discovery Result: {uri} - {result}", file=sys.stderr)
 
 
+    def _finish_discovered_song(self, song):
+        """
+        Worker for discovered files: falls back to the folder's cover when the file has no
+        embedded art, then adds the song on the main loop. A single worker keeps the order
+        in which files were discovered.
+        """
+        if song.album_art_data is None and song.uri.startswith('file://'):
+            song.album_art_data = self._get_folder_art(os.path.dirname(unquote(urlparse(song.uri).path)))
+        GLib.idle_add(self.playlist_store.append, song)
+
     def _on_discoverer_finished(self, discoverer):
         print("--- _on_discoverer_finished called ---") 
 
@@ -786,7 +4293,22 @@ class NamoWindow(Adw.ApplicationWindow):
         if t == Gst.MessageType.ERROR:
             err, dbg = message.parse_error()
             print(f"ERROR: {err.message} ({dbg})", file=sys.stderr)
+
+            song = self.current_song
+            if (song and self._needs_stream_resolution(song.uri)
+                    and self._stream_retry_uri != song.uri):
+                print(f"Stream failed, refreshing stream URL once for: {song.uri}")
+                self._stream_retry_uri = song.uri
+                if bc_scraper:
+                    bc_scraper.invalidate_stream_url(song.uri)
+                self.player.set_state(Gst.State.NULL)
+                self.play_uri(song.uri, row_id=song.row_id)
+                return True
             
+            self.stream_metrics.finish_track()
+            self._buffering = False
+            self.scan_governor.playback_starved = False
+            self._wants_playing = False
             if self.player:
                 self.player.set_state(Gst.State.NULL)
                 self.play_pause_button.set_icon_name(self.PLAY_ICON)
@@ -797,8 +4319,12 @@ class NamoWindow(Adw.ApplicationWindow):
                 self.current_song = None
         elif t == Gst.MessageType.EOS:
             print("End-of-stream reached.")
+            self.stream_metrics.finish_track()
+            self._buffering = False
+            self.scan_governor.playback_starved = False
+            self._wants_playing = False
             if self.player:
-                self.player.set_state(Gst.State.NULL) 
+                self.player.set_state(Gst.State.READY) 
                 self.play_pause_button.set_icon_name(self.PLAY_ICON)
                 self.progress_scale.set_value(0)
                 self.progress_scale.set_sensitive(False)
@@ -806,20 +4332,21 @@ class NamoWindow(Adw.ApplicationWindow):
                 self.song_label.set_label("<No Song Playing>")
                 self.current_song = None
                 
-                print("EOS: Selecting next song.")
-                self._on_next_clicked() 
-
-                
-                new_pos = self.selection_model.get_selected()
-                if new_pos != Gtk.INVALID_LIST_POSITION:
-                    next_song = self.playlist_store.get_item(new_pos)
-                    if next_song and next_song.uri:
-                        print(f"EOS: Playing next song: {next_song.title}")
-                        self.play_uri(next_song.uri)
-                    else:
-                        print("EOS: Next song has no URI or could not be retrieved.")
+                next_row_id = self.play_queue.advance()
+                if next_row_id is not None:
+                    print("EOS: Playing next song from the play queue.")
+                    self._play_row(next_row_id)
                 else:
-                    print("EOS: No next song selected (end of playlist or error).")
+                    print("EOS: End of the play queue.")
+                    self.player.set_state(Gst.State.NULL)
+        elif t == Gst.MessageType.BUFFERING:
+            self._on_buffering(message.parse_buffering())
+        elif t == Gst.MessageType.ASYNC_DONE:
+            self.stream_metrics.seek_done()
+            if self._scrub_seek_in_flight:
+                self._on_scrub_seek_done()
+        elif t == Gst.MessageType.STREAM_START:
+            self._on_gapless_track_started()
         elif t == Gst.MessageType.STATE_CHANGED:
             old_state, new_state, pending_state = message.parse_state_changed()
             
@@ -827,24 +4354,24 @@ class NamoWindow(Adw.ApplicationWindow):
                 print(f"State changed from {old_state.value_nick} to {new_state.value_nick}")
                 if new_state == Gst.State.PLAYING:
                     self.play_pause_button.set_icon_name(self.PAUSE_ICON)
-                    
-                    
-                    if not hasattr(self, '_progress_timer_id') or self._progress_timer_id is None:
-                         self._progress_timer_id = GLib.timeout_add_seconds(1, self._update_progress)
-                    
-                    
-                         self._progress_timer_id = GLib.timeout_add_seconds(1, self._update_progress)
+                    self._stream_retry_uri = None
+                    self.stream_metrics.first_audio()
+                    if self._switch_started_at is not None:
+                        latency_ms = (time.monotonic() - self._switch_started_at) * 1000
+                        kind = "remote" if self._switch_is_remote else "local"
+                        print(f"Track switch latency ({kind}): {latency_ms:.0f} ms")
+                        self._switch_started_at = None
+                    self._start_progress_updates()
                 elif new_state == Gst.State.PAUSED:
-                    self.play_pause_button.set_icon_name(self.PLAY_ICON)
-                    
+                    self.play_pause_button.set_icon_name(
+                        self.PAUSE_ICON if self._buffering and self._wants_playing else self.PLAY_ICON)
+                    self._stop_progress_updates()
+                    if not self._buffering:
+                        self._update_progress()
                 elif new_state == Gst.State.READY or new_state == Gst.State.NULL:
                     self.play_pause_button.set_icon_name(self.PLAY_ICON)
                     self.progress_scale.set_value(0)
-                    
-                    
-                    if hasattr(self, '_progress_timer_id') and self._progress_timer_id is not None:
-                        GLib.source_remove(self._progress_timer_id)
-                        self._progress_timer_id = None
+                    self._stop_progress_updates()
         elif t == Gst.MessageType.DURATION_CHANGED:
              
              self.duration_ns = self.player.query_duration(Gst.Format.TIME)[1]
@@ -860,7 +4387,30 @@ class NamoWindow(Adw.ApplicationWindow):
 
         
         return True
-    def _update_song_display(self, song):
+    def _decode_album_art(self, song):
+        """Decodes a song's embedded album art into a 64x64 pixbuf, or returns None."""
+        glib_bytes_data = song.album_art_data
+        if not glib_bytes_data:
+            return None
+        raw_bytes_data = glib_bytes_data.get_data() 
+        key = hashlib.sha1(raw_bytes_data).digest()
+        cached = self.cover_textures.get(key)
+        if cached is not None:
+            return cached
+        try:
+            loader = GdkPixbuf.PixbufLoader()
+            loader.write(raw_bytes_data)
+            loader.close()
+            pixbuf = loader.get_pixbuf()
+            scaled = pixbuf.scale_simple(64, 64, GdkPixbuf.InterpType.BILINEAR)
+            self.cover_textures.put(key, scaled)
+            self.memory_budget.note_growth()
+            return scaled
+        except Exception as e:
+            print(f"Error loading album art for '{song.title}': {e}", file=sys.stderr)
+            return None
+
+    def _update_song_display(self, song, art_pixbuf=None):
         """Updates the song title, artist, time label (0:00 / Duration), and cover art."""
         if song:
             
@@ -877,22 +4427,15 @@ class NamoWindow(Adw.ApplicationWindow):
             self.time_label.set_label(f"0:00 / {duration_str}")
 
             
-            glib_bytes_data = song.album_art_data
-            
-            if glib_bytes_data:
-                raw_bytes_data = glib_bytes_data.get_data() 
-                try:
-                    loader = GdkPixbuf.PixbufLoader()
-                    loader.write(raw_bytes_data)
-                    loader.close()
-                    pixbuf = loader.get_pixbuf()
-                    
-                    scaled_pixbuf = pixbuf.scale_simple(64, 64, GdkPixbuf.InterpType.BILINEAR)
-                    self.cover_image.set_from_pixbuf(scaled_pixbuf)
-                    
-                except Exception as e:
-                    print(f"Error loading album art in _update_song_display for '{song.title}': {e}", file=sys.stderr)
-                    self.cover_image.set_from_icon_name("audio-x-generic-symbolic") 
+            if art_pixbuf is not None:
+                scaled_pixbuf = art_pixbuf
+            elif self._displayed_art and self._displayed_art[0] is song:
+                scaled_pixbuf = self._displayed_art[1]
+            else:
+                scaled_pixbuf = self._decode_album_art(song)
+            self._displayed_art = (song, scaled_pixbuf)
+            if scaled_pixbuf:
+                self.cover_image.set_from_pixbuf(scaled_pixbuf)
             else:
                 
                 self.cover_image.set_from_icon_name("audio-x-generic-symbolic") 
@@ -906,23 +4449,78 @@ class NamoWindow(Adw.ApplicationWindow):
 
 
     
+    def _peak_source_uri(self, uri):
+        """Returns a local URI the peak generator can decode for uri, or None for remote tracks not in the media cache."""
+        if not self._is_remote_uri(uri):
+            return uri
+        cached_path = self.media_cache.lookup(uri, touch=False) if self.media_cache else None
+        return pathlib.Path(cached_path).as_uri() if cached_path else None
+
+    def _show_waveform(self, song):
+        """Shows the song's peak summary behind the seek bar, computing it in the background if needed."""
+        self._waveform_peaks = None
+        if song and self.peak_generator:
+            self._waveform_peaks = self.peak_generator.lookup(song.uri)
+            if self._waveform_peaks is None:
+                source_uri = self._peak_source_uri(song.uri)
+                if source_uri:
+                    self.peak_generator.request(song.uri, source_uri, self._on_peaks_ready)
+        self.waveform_area.queue_draw()
+
+    def _precompute_upcoming_peaks(self):
+        """Queues peak summaries for the next few tracks so they are ready when playback reaches them."""
+        if not self.peak_generator:
+            return
+        for song in self._upcoming_songs(settings["waveform_prefetch_count"]):
+            if self.peak_generator.lookup(song.uri) is None:
+                source_uri = self._peak_source_uri(song.uri)
+                if source_uri:
+                    self.peak_generator.request(song.uri, source_uri)
+
+    def _on_peaks_ready(self, uri, peaks):
+        """Main-loop callback from the peak generator."""
+        if peaks and self.current_song and self.current_song.uri == uri:
+            self._waveform_peaks = peaks
+            self.waveform_area.queue_draw()
+        return GLib.SOURCE_REMOVE
+
+    def _draw_waveform(self, area, cr, width, height):
+        """Draws the current peak summary as mirrored bars, with the played part highlighted."""
+        peaks = self._waveform_peaks
+        if not peaks or width <= 0:
+            return
+        n_buckets = len(peaks) // 2
+        adj = self.progress_scale.get_adjustment()
+        span = adj.get_upper() - adj.get_lower()
+        played_x = width * (adj.get_value() - adj.get_lower()) / span if span > 0 else 0
+        mid = height / 2
+        scale = mid / 128
+        played = []
+        unplayed = []
+        for x in range(width):
+            bucket = x * n_buckets // width
+            low = peaks[2 * bucket] * scale
+            high = peaks[2 * bucket + 1] * scale
+            (played if x < played_x else unplayed).append((x, mid - high, max(1.0, high - low)))
+        for bars, rgba in ((played, (0.21, 0.52, 0.89, 0.8)), (unplayed, (0.5, 0.5, 0.5, 0.45))):
+            cr.set_source_rgba(*rgba)
+            for x, top, bar_height in bars:
+                cr.rectangle(x, top, 1, bar_height)
+            cr.fill()
+
     def _update_remaining_time(self):
         """Calculates and updates the remaining playlist time label."""
-        total_remaining_ns = 0
         selected_index = self.selection_model.get_selected()
 
         
         
         start_index = 0
         if selected_index != Gtk.INVALID_LIST_POSITION:
-            start_index = selected_index + 1
+            source_position = self.playlist_view_model.source_position(selected_index)
+            if source_position is not None:
+                start_index = source_position + 1
 
-        n_items = self.playlist_store.get_n_items()
-        for i in range(start_index, n_items):
-            song = self.playlist_store.get_item(i)
-            
-            if song and isinstance(song.duration, int) and song.duration > 0:
-                total_remaining_ns += song.duration
+        total_remaining_ns = self.playlist_store.total_duration(start_index)
 
         formatted_string = ""
         if total_remaining_ns > 0:
@@ -944,33 +4542,46 @@ class NamoWindow(Adw.ApplicationWindow):
 
     
 
-    def _update_progress(self):
-        
-        if self._is_seeking:
-            
-            return True 
-        """Timer callback to update playback progress."""
-        if not self.player or not self.current_song:
-            
-            if hasattr(self, '_progress_timer_id') and self._progress_timer_id is not None:
-                GLib.source_remove(self._progress_timer_id)
-                self._progress_timer_id = None
-            return False 
+    def _start_progress_updates(self):
+        """
+        Starts the single progress updater. It runs off the progress scale's frame clock,
+        so it never stacks up like timers do and produces no wakeups while the window is hidden.
+        """
+        if self._progress_tick_id is None and self.progress_scale.get_mapped():
+            self._last_progress_update_us = 0
+            self._progress_tick_id = self.progress_scale.add_tick_callback(self._on_progress_tick)
+
+    def _stop_progress_updates(self):
+        if self._progress_tick_id is not None:
+            self.progress_scale.remove_tick_callback(self._progress_tick_id)
+            self._progress_tick_id = None
+
+    def _on_progress_tick(self, widget, frame_clock):
+        """Frame-clock tick: refreshes the progress display at most every PROGRESS_UPDATE_INTERVAL_US."""
+        frame_time_us = frame_clock.get_frame_time()
+        if frame_time_us - self._last_progress_update_us >= self.PROGRESS_UPDATE_INTERVAL_US:
+            self._last_progress_update_us = frame_time_us
+            self._update_progress()
+        return GLib.SOURCE_CONTINUE
+
+    def _on_progress_scale_mapped(self, widget):
+        if self.player and self.player.get_state(0).state == Gst.State.PLAYING:
+            self._start_progress_updates()
+
+    def _on_progress_scale_unmapped(self, widget):
+        self._stop_progress_updates()
 
-        state = self.player.get_state(0).state
-        if state != Gst.State.PLAYING and state != Gst.State.PAUSED:
-            
-            self._progress_timer_id = None
-            return False
+    def _update_progress(self):
+        """Queries the playback position and refreshes the time label and progress scale."""
+        if self._is_seeking or not self.player or not self.current_song:
+            return GLib.SOURCE_REMOVE
 
         
-        
         if self.duration_ns <= 0:
              ok, new_duration_ns = self.player.query_duration(Gst.Format.TIME)
              if ok:
                  self.duration_ns = new_duration_ns 
              else:
-                 print("Could not query duration in timer.")
                  self.duration_ns = 0 
         
         ok_pos, position_ns = self.player.query_position(Gst.Format.TIME)
@@ -990,16 +4601,9 @@ class NamoWindow(Adw.ApplicationWindow):
 
             
             adj = self.progress_scale.get_adjustment()
-            adj.set_value(pos_sec)
-
+            adj.set_value(position_ns / Gst.SECOND)
 
-        
-        
-        if state == Gst.State.PLAYING:
-            return True 
-        else:
-            self._progress_timer_id = None 
-            return False 
+        return GLib.SOURCE_REMOVE
 
 
     
@@ -1009,13 +4613,8 @@ class NamoWindow(Adw.ApplicationWindow):
         print("Seek drag begin")
         self._is_seeking = True
         
-        self._was_playing_before_seek = (self.player.get_state(0).state == Gst.State.PLAYING)
+        self._was_playing_before_seek = bool(self.player) and self.player.get_state(0).state == Gst.State.PLAYING
         print(f"DEBUG: Drag begin. Was playing: {self._was_playing_before_seek}") 
-        
-        if hasattr(self, '_progress_timer_id') and self._progress_timer_id is not None:
-            print("Stopping progress timer for seek")
-            GLib.source_remove(self._progress_timer_id)
-            self._progress_timer_id = None
 
     def _on_seek_drag_update(self, gesture, offset_x, offset_y):
         """Called continuously while the user drags the progress scale."""
@@ -1041,6 +4640,8 @@ class NamoWindow(Adw.ApplicationWindow):
 
         
         self._seek_value_ns = int(target_value * Gst.SECOND)
+        if settings["live_scrubbing"]:
+            self._request_scrub_seek(self._seek_value_ns)
 
         
         pos_sec = int(target_value)
@@ -1052,58 +4653,90 @@ class NamoWindow(Adw.ApplicationWindow):
              self.time_label.set_label(f"{pos_sec // 60}:{pos_sec % 60:02d} / --:--")
 
 
+    def _request_scrub_seek(self, position_ns):
+        """
+        Coalesces scrub seeks: only the latest requested position is kept, at most one seek
+        is in flight (until ASYNC_DONE), and seeks are spaced by SCRUB_SEEK_INTERVAL_MS.
+        """
+        self._pending_scrub_ns = position_ns
+        if self._scrub_timer_id is not None:
+            return
+        now = time.monotonic()
+        if self._scrub_seek_in_flight:
+            if (now - self._last_scrub_seek_time) * 1000 < self.SCRUB_SEEK_TIMEOUT_MS:
+                return
+            self._scrub_seek_in_flight = False
+        wait_ms = self.SCRUB_SEEK_INTERVAL_MS - (now - self._last_scrub_seek_time) * 1000
+        if wait_ms > 0:
+            self._scrub_timer_id = GLib.timeout_add(int(wait_ms) + 1, self._on_scrub_timer)
+        else:
+            self._issue_scrub_seek()
+
+    def _on_scrub_timer(self):
+        self._scrub_timer_id = None
+        if self._is_seeking and self._pending_scrub_ns is not None:
+            self._request_scrub_seek(self._pending_scrub_ns)
+        return GLib.SOURCE_REMOVE
+
+    def _issue_scrub_seek(self):
+        position_ns = self._pending_scrub_ns
+        self._pending_scrub_ns = None
+        if position_ns is None or not self.player or self.duration_ns <= 0:
+            return
+        seek_flags = Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT | Gst.SeekFlags.SNAP_NEAREST
+        if self.player.seek_simple(Gst.Format.TIME, seek_flags, position_ns):
+            self.stream_metrics.note_seek()
+            self._scrub_seek_in_flight = True
+            self._last_scrub_seek_time = time.monotonic()
+
+    def _on_scrub_seek_done(self):
+        """ASYNC_DONE after a scrub seek: sends the newest pending position, if any."""
+        self._scrub_seek_in_flight = False
+        if self._is_seeking and self._pending_scrub_ns is not None:
+            self._request_scrub_seek(self._pending_scrub_ns)
+
+    def _cancel_scrub_seeks(self):
+        if self._scrub_timer_id is not None:
+            GLib.source_remove(self._scrub_timer_id)
+            self._scrub_timer_id = None
+        self._pending_scrub_ns = None
+        self._scrub_seek_in_flight = False
+
     def _on_seek_drag_end(self, gesture, offset_x, offset_y):
         """Called when the user releases the progress scale after dragging."""
         print(f"Seek drag end: offset_x={offset_x:.2f}")
         if not self._is_seeking: return 
 
         self._is_seeking = False
+        self._cancel_scrub_seeks()
 
         
         if self.player and self.duration_ns > 0:
             print(f"Performing seek to: {self._seek_value_ns / Gst.SECOND:.2f}s")
-            seek_flags = Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT
+            if settings["live_scrubbing"]:
+                seek_flags = Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE
+            else:
+                seek_flags = Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT
             if not self.player.seek_simple(Gst.Format.TIME, seek_flags, self._seek_value_ns):
                 print("Seek failed.", file=sys.stderr)
             else:
+                self.stream_metrics.note_seek()
                 
                 final_seek_pos_sec = self._seek_value_ns / Gst.SECOND
                 self.progress_scale.set_value(final_seek_pos_sec)
-
-            
-            
-            
-            
-            state = self.player.get_state(0).state
-            if state == Gst.State.PLAYING:
-                 if not hasattr(self, '_progress_timer_id') or self._progress_timer_id is None:
-                     
-                     print("Scheduling delayed timer restart after seek.")
-                     GLib.timeout_add(100, self._restart_progress_timer) 
-            else:
-                 print("Not scheduling timer restart (player was not playing before seek)")
         else:
             print("Not seeking: Player invalid or duration unknown.")
-    
-    def _restart_progress_timer(self):
-        if not hasattr(self, '_progress_timer_id') or self._progress_timer_id is None:
-             
-             if self._was_playing_before_seek:
-                 print("Restarting progress timer after seek delay (was playing before).")
-                 self._progress_timer_id = GLib.timeout_add_seconds(1, self._update_progress)
-             else:
-                 print("Not restarting progress timer (was not playing before seek).")
-                 self._progress_timer_id = GLib.timeout_add_seconds(1, self._update_progress)
-        return GLib.SOURCE_REMOVE 
 
 
     
     def _on_import_bandcamp_clicked(self, button):
         """Shows a dialog to get the Bandcamp album URL."""
-        if not bc_scraper:
+        if not bandcamp_available():
             print("Bandcamp scraper not available.")
             
             return
+        
+        threading.Thread(target=load_bc_scraper, daemon=True).start()
 
         dialog = Adw.MessageDialog.new(self,
                                        "Import Bandcamp Album",
@@ -1144,22 +4777,33 @@ class NamoWindow(Adw.ApplicationWindow):
     def _start_bandcamp_import(self, url):
         
         print(f"Scheduling import thread for {url}")
-        thread = threading.Thread(target=self._run_bandcamp_import_thread, args=(url,), daemon=True)
+        thread = threading.Thread(target=self._run_bandcamp_import_thread,
+                                  args=(url, self.current_playlist_name), daemon=True)
         thread.start()
 
-    def _run_bandcamp_import_thread(self, url):
+    def _run_bandcamp_import_thread(self, url, playlist_name):
+        bc_scraper = load_bc_scraper()
         if not bc_scraper: return 
 
         print(f"Background thread started for: {url}")
+        stats = bc_scraper.FetchStats()
+        added_count = 0
+        art_futures = {}
+
+        def on_art_url(art_url):
+            art_futures[art_url] = self.album_art_fetcher.fetch_async(art_url)
+
         try:
             
-            track_infos = bc_scraper.get_album_track_info(url)
+            track_infos = bc_scraper.get_album_track_info(url, stats=stats, on_art_url=on_art_url)
             if not track_infos:
                 print("No tracks found or error during scraping.")
                 
                 return
 
             print(f"Scraped {len(track_infos)} tracks. Adding to playlist...")
+            rows = []
+            albums = []
             for info in track_infos:
                 
                 duration_str = "--:--"
@@ -1177,9 +4821,11 @@ class NamoWindow(Adw.ApplicationWindow):
                     print(f"Skipping track '{info.get('title')}' - no stream URL found.")
                     continue
 
+                song_uri = info.get("track_page_url") or stream_url
+
                 
-                title = html.unescape(info.get("title", "Unknown Title"))
-                artist = html.unescape(info.get("artist", "Unknown Artist"))
+                title = html.unescape(info["title"]) if info.get("title") else None
+                artist = html.unescape(info["artist"]) if info.get("artist") else None
 
                 
                 duration_ns_bc = 0
@@ -1191,22 +4837,31 @@ class NamoWindow(Adw.ApplicationWindow):
                     except (ValueError, TypeError):
                         pass 
 
-                song = Song(uri=stream_url,
-                            title=title,
-                            artist=artist,
-                            duration=duration_ns_bc) 
+                art = None
+                art_url = info.get("art_url")
+                if art_url:
+                    if art_url not in art_futures:
+                        on_art_url(art_url)
+                    art = art_futures[art_url].result()
 
-                
-                GLib.idle_add(self.playlist_store.append, song)
-                
+                rows.append((song_uri, title, artist, duration_ns_bc, art))
+                albums.append(html.unescape(info["album"]) if info.get("album") else None)
+                added_count += 1
                 
 
+            
+            track_ids = self.library.add_tracks([(uri, title, artist, album, duration_ns, art)
+                                                 for (uri, title, artist, duration_ns, art), album in zip(rows, albums)])
+            rows = [row + (track_id,) for row, track_id in zip(rows, track_ids)]
+            GLib.idle_add(self._on_library_tracks_added, rows, playlist_name)
             print("Finished adding Bandcamp tracks to playlist.")
             
 
         except Exception as e:
             
             print(f"Error in Bandcamp import thread: {e}", file=sys.stderr)
+        finally:
+            print(f"Bandcamp import summary for {url}: {added_count} tracks added; {stats.summary()}")
             
 
     
@@ -1221,29 +4876,43 @@ class NamoWindow(Adw.ApplicationWindow):
         if state in (Gst.State.PLAYING, Gst.State.PAUSED) and can_seek and position_ns > (3 * Gst.SECOND):
             print("Previous: Seeking to beginning.")
             seek_flags = Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT
-            self.player.seek_simple(Gst.Format.TIME, seek_flags, 0)
+            if self.player.seek_simple(Gst.Format.TIME, seek_flags, 0):
+                self.stream_metrics.note_seek()
         else:
             
-            print("Previous: Selecting previous track.")
-            current_pos = self.selection_model.get_selected()
-            if current_pos != Gtk.INVALID_LIST_POSITION and current_pos > 0:
-                self.selection_model.set_selected(current_pos - 1)
-            
+            row_id = self.play_queue.previous()
+            if row_id is not None:
+                print("Previous: Playing previous track.")
+                self._play_row(row_id)
 
     def _on_next_clicked(self, button=None): 
-        """Handles the Next button click or auto-plays next song."""
-        print("Next: Selecting next track.")
-        n_items = self.playlist_store.get_n_items()
-        if n_items == 0: return 
-
-        current_pos = self.selection_model.get_selected()
-
-        if current_pos != Gtk.INVALID_LIST_POSITION and current_pos < (n_items - 1):
-            self.selection_model.set_selected(current_pos + 1)
-        elif current_pos == Gtk.INVALID_LIST_POSITION and n_items > 0:
-             
-             self.selection_model.set_selected(0)
-        
+        """Handles the Next button click: skips to the next track of the play queue (ignoring repeat-one)."""
+        row_id = self.play_queue.advance(auto=False)
+        if row_id is not None:
+            print("Next: Playing next track.")
+            self._play_row(row_id)
+        else:
+            print("Next: End of the play queue.")
+
+    def _on_shuffle_action(self, action, value):
+        """Handles the 'win.shuffle' action."""
+        action.set_state(value)
+        self.play_queue.set_shuffle(value.get_boolean())
+        self._schedule_preroll_refresh()
+
+    def _on_repeat_action(self, action, value):
+        """Handles the 'win.repeat' action: none, all or one."""
+        action.set_state(value)
+        self.play_queue.set_repeat(value.get_string())
+        self._schedule_preroll_refresh()
+
+    def _on_play_next_action(self, action, param):
+        """Handles the 'win.play_next' action: queues the selected track after the current one and earlier picks."""
+        song = self.selection_model.get_selected_item()
+        if song:
+            print(f"Play next: {song.title}")
+            self.play_queue.play_next([song.row_id])
+            self._schedule_preroll_refresh()
 
     
     def _on_open_playlist_action(self, action, param): 
@@ -1253,16 +4922,9 @@ class NamoWindow(Adw.ApplicationWindow):
         dialog.set_modal(True)
 
         
-        json_filter = Gtk.FileFilter.new()
-        json_filter.set_name("Playlist Files (*.json)")
-        json_filter.add_mime_type("application/json")
-        json_filter.add_pattern("*.json")
-
-        
-        filters = Gio.ListStore.new(Gtk.FileFilter)
-        filters.append(json_filter)
+        filters = self._playlist_file_filters()
         dialog.set_filters(filters)
-        dialog.set_default_filter(json_filter) 
+        dialog.set_default_filter(filters.get_item(0)) 
 
         dialog.open(parent=self, cancellable=None, callback=self._on_open_dialog_finish)
 
@@ -1274,8 +4936,15 @@ class NamoWindow(Adw.ApplicationWindow):
                 filepath = gio_file.get_path()
                 print(f"Opening playlist from: {filepath}")
                 
-                self.playlist_store.remove_all()
-                self._load_playlist(filepath=filepath)
+                name = self._unique_playlist_name(os.path.splitext(os.path.basename(filepath))[0] or self.DEFAULT_PLAYLIST_NAME)
+                self._save_library_playlist()
+                self.library.create_playlist(name)
+                self._show_library_playlist(name)
+                self._set_playlist_names(self.library.playlist_names(), name)
+                if filepath.lower().endswith(PLAYLIST_EXTENSIONS):
+                    self._start_playlist_import(filepath)
+                else:
+                    self._load_playlist(filepath=filepath)
         except GLib.Error as e:
             if e.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED):
                 print("Open playlist cancelled.")
@@ -1291,15 +4960,9 @@ class NamoWindow(Adw.ApplicationWindow):
         dialog.set_initial_name("playlist.json")
 
         
-        json_filter = Gtk.FileFilter.new()
-        json_filter.set_name("Playlist Files (*.json)")
-        json_filter.add_mime_type("application/json")
-        json_filter.add_pattern("*.json")
-
-        filters = Gio.ListStore.new(Gtk.FileFilter)
-        filters.append(json_filter)
+        filters = self._playlist_file_filters()
         dialog.set_filters(filters)
-        dialog.set_default_filter(json_filter)
+        dialog.set_default_filter(filters.get_item(0))
 
         
         try:
@@ -1320,12 +4983,15 @@ class NamoWindow(Adw.ApplicationWindow):
             if gio_file:
                 filepath = gio_file.get_path()
                 
-                if not filepath.lower().endswith(".json"):
+                if filepath.lower().endswith(PLAYLIST_EXTENSIONS):
+                    self._export_playlist(filepath)
+                elif not filepath.lower().endswith(".json"):
                     filepath += ".json"
                     print(f"Appended .json extension. Saving to: {filepath}")
+                    self._save_playlist(filepath=filepath)
                 else:
                     print(f"Saving playlist to: {filepath}")
-                self._save_playlist(filepath=filepath)
+                    self._save_playlist(filepath=filepath)
         except GLib.Error as e:
             if e.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED):
                 print("Save playlist cancelled.")
@@ -1335,6 +5001,100 @@ class NamoWindow(Adw.ApplicationWindow):
 
     
 
+    def _playlist_file_filters(self):
+        """File dialog filters for every supported playlist format; the first one matches them all."""
+        formats = (("Namo Playlist (*.json)", ("*.json",)),
+                   ("M3U Playlist (*.m3u, *.m3u8)", ("*.m3u", "*.m3u8")),
+                   ("PLS Playlist (*.pls)", ("*.pls",)),
+                   ("XSPF Playlist (*.xspf)", ("*.xspf",)))
+        filters = Gio.ListStore.new(Gtk.FileFilter)
+        all_filter = Gtk.FileFilter.new()
+        all_filter.set_name("All Playlists")
+        filters.append(all_filter)
+        for name, patterns in formats:
+            file_filter = Gtk.FileFilter.new()
+            file_filter.set_name(name)
+            for pattern in patterns:
+                file_filter.add_pattern(pattern)
+                all_filter.add_pattern(pattern)
+            filters.append(file_filter)
+        return filters
+
+    def _start_playlist_import(self, filepath):
+        """Imports an M3U/M3U8, PLS or XSPF file in the background."""
+        thread = threading.Thread(target=self._import_playlist_thread,
+                                  args=(filepath, self.current_playlist_name), daemon=True)
+        thread.start()
+
+    def _import_playlist_thread(self, filepath, playlist_name):
+        """
+        Background thread: parses a playlist file incrementally and pushes rows in batches
+        into playlist_name.
+        At most two batches wait on the main loop at a time, so memory stays flat and the UI
+        keeps responding however large the file is.
+        """
+        in_flight = threading.BoundedSemaphore(2)
+        started = time.monotonic()
+        imported = 0
+        batch = []
+
+        def push(rows):
+            track_ids = self.library.add_tracks([(uri, title, artist, None, duration_ns, None)
+                                                 for uri, title, artist, duration_ns, _ in rows])
+            rows = [row + (track_id,) for row, track_id in zip(rows, track_ids)]
+            in_flight.acquire()
+            GLib.idle_add(self._on_playlist_import_batch, rows, playlist_name, in_flight)
+
+        try:
+            for uri, title, artist, duration_ns in read_playlist_file(filepath):
+                batch.append((uri, title, artist, duration_ns, None))
+                if len(batch) >= self.PLAYLIST_IMPORT_BATCH:
+                    push(batch)
+                    imported += len(batch)
+                    batch = []
+        except Exception as e:
+            print(f"Error importing playlist {filepath}: {e}", file=sys.stderr)
+        if batch:
+            push(batch)
+            imported += len(batch)
+        print(f"Imported {imported} entries from {filepath} in {time.monotonic() - started:.1f} s")
+
+    def _on_playlist_import_batch(self, rows, playlist_name, in_flight):
+        self._on_library_tracks_added(rows, playlist_name)
+        in_flight.release()
+        self._update_remaining_time()
+        return GLib.SOURCE_REMOVE
+
+    def _export_playlist(self, filepath):
+        """
+        Writes the playlist as M3U/M3U8, PLS or XSPF in the background. Only the row ids are
+        snapshotted up front; the writer asks the main loop for EXPORT_CHUNK_ROWS rows at a
+        time, so at most one chunk of rows is copied at once. Rows removed meanwhile are skipped.
+        """
+        row_ids = self.playlist_store.row_ids()
+        print(f"Exporting {len(row_ids)} entries to: {filepath}")
+
+        def rows():
+            for start in range(0, len(row_ids), self.EXPORT_CHUNK_ROWS):
+                chunk = Future()
+                GLib.idle_add(self._on_export_chunk_idle, row_ids[start:start + self.EXPORT_CHUNK_ROWS], chunk)
+                yield from chunk.result()
+
+        def export_thread():
+            try:
+                count = write_playlist_file(filepath, rows())
+                print(f"Exported {count} entries to: {filepath}")
+            except Exception as e:
+                print(f"Error exporting playlist to {filepath}: {e}", file=sys.stderr)
+
+        threading.Thread(target=export_thread, daemon=True).start()
+
+    def _on_export_chunk_idle(self, row_ids, chunk):
+        positions = [position for position in map(self.playlist_store.position_of_row, row_ids) if position is not None]
+        chunk.set_result([(uri, title, artist, duration_ns) for uri, title, artist, duration_ns, _
+                          in self.playlist_store.iter_rows(positions, with_art=False)])
+        return GLib.SOURCE_REMOVE
+
     def _on_add_folder_action(self, action, param): 
         """Handles the 'win.add_folder_new' action."""
         dialog = Gtk.FileDialog.new()
@@ -1397,6 +5157,235 @@ class NamoWindow(Adw.ApplicationWindow):
 
 
     
+    def _setup_memory_budget(self):
+        """Registers the in-memory caches with the memory budget, cheapest to rebuild first, and enforces it periodically."""
+        budget = self.memory_budget
+        budget.register("Cover textures", self.cover_textures.memory_usage, self.cover_textures.trim,
+                        settings["texture_memory_max_bytes"])
+        if self.peak_generator:
+            budget.register("Waveforms", self.peak_generator.memory_usage, self.peak_generator.trim_memory,
+                            settings["waveform_memory_max_bytes"])
+        budget.register("Metadata lookups", self._metadata_cache_usage, self._trim_metadata_caches,
+                        settings["metadata_memory_max_bytes"])
+        art_store = self.playlist_store.art_store
+        art_store.loader = self.library.art_by_digest
+        art_store.persisted = self.library.stored_art_digests
+        art_store.on_growth = budget.note_growth
+        budget.register("Album art",
+                        lambda: self.playlist_store.art_store.memory_usage(),
+                        lambda target: self.playlist_store.art_store.evict(target),
+                        settings["art_memory_max_bytes"])
+        budget.register("Stream URLs",
+                        lambda: bc_scraper.stream_url_cache_usage() if bc_scraper else (0, 0),
+                        lambda target: bc_scraper.trim_stream_urls(target) if bc_scraper else None,
+                        settings["stream_url_memory_max_bytes"])
+        budget.register("Playlist rows", self.playlist_store.memory_usage)
+        GLib.timeout_add_seconds(self.MEMORY_ENFORCE_INTERVAL_S, self._on_memory_enforce_timer)
+
+    def _on_memory_enforce_timer(self):
+        self.memory_budget.enforce()
+        return GLib.SOURCE_CONTINUE
+
+    def _metadata_cache_usage(self):
+        """Library lookup caches plus the per-folder cover cache."""
+        library_bytes, library_entries = self.library.cache_usage()
+        with self._folder_art_lock:
+            folder_art = {id(art): art for art in self._folder_art.values() if art}
+            entries = len(self._folder_art)
+        return library_bytes + sum(art.get_size() for art in folder_art.values()), library_entries + entries
+
+    def _trim_metadata_caches(self, target_bytes):
+        self.library.trim_cache(target_bytes)
+        if self._metadata_cache_usage()[0] > target_bytes:
+            with self._folder_art_lock:
+                self._folder_art.clear()
+
+    def _on_memory_usage_action(self, action, param):
+        """Handles the 'win.memory_usage' action: shows how much each cache holds against its budget."""
+        def format_bytes(count):
+            return f"{count / (1024 * 1024):.1f} MB"
+        lines = []
+        total = 0
+        for row in self.memory_budget.report():
+            total += row["bytes"]
+            budget = f" of {format_bytes(row['budget'])}" if row["budget"] else ""
+            evicted = f", {format_bytes(row['evicted_bytes'])} evicted" if row["evicted_bytes"] else ""
+            lines.append(f"{row['name']}: {format_bytes(row['bytes'])}{budget} ({row['entries']} entries{evicted})")
+        if self.memory_budget.total_bytes:
+            lines.append(f"\nCache budget: {format_bytes(self.memory_budget.total_bytes)}")
+        lines.append(f"Total: {format_bytes(total)}")
+        body = "\n".join(lines)
+        print(f"Memory usage:\n{body}")
+        dialog = Adw.MessageDialog.new(self, "Memory Usage", body)
+        dialog.add_response("close", "_Close")
+        dialog.add_response("trim", "_Apply Budgets")
+        dialog.connect("response", self._on_memory_usage_response)
+        dialog.present()
+
+    def _on_memory_usage_response(self, dialog, response_id):
+        if response_id == "trim":
+            self.memory_budget.enforce()
+
+    def _open_library(self):
+        """
+        Shows the first library playlist. On first run creates it, importing the old playlist.json
+        if there is one. Runs once, after the window's first frame.
+        """
+        if self._library_opened:
+            return GLib.SOURCE_REMOVE
+        self._library_opened = True
+        names = self.library.playlist_names()
+        if names:
+            self._show_library_playlist(names[0])
+        else:
+            names = [self.DEFAULT_PLAYLIST_NAME]
+            self.library.create_playlist(names[0])
+            self.current_playlist_name = names[0]
+            if os.path.exists(self._playlist_file_path):
+                print(f"Library: importing {self._playlist_file_path}")
+                self._load_playlist()
+                self._save_library_playlist()
+        self._set_playlist_names(names, self.current_playlist_name)
+        return GLib.SOURCE_REMOVE
+
+    def _set_playlist_names(self, names, selected_name):
+        """Refills the playlist selector without treating it as a user choice."""
+        self._updating_playlist_selector = True
+        try:
+            self.playlist_names.splice(0, self.playlist_names.get_n_items(), names)
+            if selected_name in names:
+                self.playlist_dropdown.set_selected(names.index(selected_name))
+        finally:
+            self._updating_playlist_selector = False
+
+    def _unique_playlist_name(self, base_name):
+        names = set(self.library.playlist_names())
+        name = base_name
+        suffix = 2
+        while name in names:
+            name = f"{base_name} {suffix}"
+            suffix += 1
+        return name
+
+    def _show_library_playlist(self, name):
+        """Replaces the shown rows with the library playlist called name."""
+        self.current_playlist_name = name
+        track_ids = self.library.load_playlist(name) or ()
+        self.playlist_store.remove_all()
+        self.playlist_store.extend_rows(self.library.get_rows(track_ids))
+        print(f"Library: showing playlist '{name}' ({self.playlist_store.get_n_items()} tracks)")
+
+    def _save_library_playlist(self):
+        """
+        Stores the shown rows as the current library playlist, first adding rows that are not in
+        the library yet. Does nothing until the library has been opened, so closing the window
+        before then cannot overwrite a playlist with an empty one.
+        """
+        if not self._library_opened:
+            return
+        track_ids = self.playlist_store.track_ids()
+        missing = [position for position, track_id in enumerate(track_ids) if not track_id]
+        if missing:
+            rows = [(uri, title, artist, None, duration_ns, art)
+                    for uri, title, artist, duration_ns, art in self.playlist_store.iter_rows(missing)]
+            new_ids = self.library.add_tracks(rows)
+            self.playlist_store.assign_track_ids(missing, new_ids)
+            for position, track_id in zip(missing, new_ids):
+                track_ids[position] = track_id
+        try:
+            self.library.save_playlist(self.current_playlist_name, track_ids)
+        except sqlite3.Error as e:
+            print(f"Error saving playlist '{self.current_playlist_name}' to the library: {e}", file=sys.stderr)
+
+    def _on_playlist_dropdown_selected(self, dropdown, pspec):
+        if self._updating_playlist_selector:
+            return
+        selected = dropdown.get_selected()
+        if selected == Gtk.INVALID_LIST_POSITION:
+            return
+        name = self.playlist_names.get_string(selected)
+        if name and name != self.current_playlist_name:
+            self._save_library_playlist()
+            self._show_library_playlist(name)
+
+    def _on_new_playlist_action(self, action, param):
+        """Handles the 'win.new_playlist' action: saves the shown playlist and switches to a new empty one."""
+        name = self._unique_playlist_name(self.DEFAULT_PLAYLIST_NAME)
+        self._save_library_playlist()
+        self.library.create_playlist(name)
+        self._show_library_playlist(name)
+        self._set_playlist_names(self.library.playlist_names(), name)
+
+    def _on_new_smart_playlist_action(self, action, param):
+        """Handles the 'win.new_smart_playlist' action: asks for the query fields; empty fields are ignored."""
+        grid = Gtk.Grid(row_spacing=6, column_spacing=12)
+        entries = {}
+        fields = (("name", "Name", self._unique_playlist_name("Smart Playlist")),
+                  ("artist", "Artist", ""),
+                  ("album", "Album", ""),
+                  ("folder", "Folder", ""),
+                  ("min_duration_s", "Longer than (min)", ""),
+                  ("max_duration_s", "Shorter than (min)", ""),
+                  ("added_within_days", "Added in the last (days)", ""))
+        for row, (key, label, text) in enumerate(fields):
+            grid.attach(Gtk.Label(label=label, xalign=0), 0, row, 1, 1)
+            entries[key] = Gtk.Entry(text=text, hexpand=True)
+            grid.attach(entries[key], 1, row, 1, 1)
+        dialog = Adw.MessageDialog.new(self, "New Smart Playlist",
+                                       "Tracks in the library that match every filled-in field.")
+        dialog.set_extra_child(grid)
+        dialog.add_response("cancel", "_Cancel")
+        dialog.add_response("create", "C_reate")
+        dialog.set_response_appearance("create", Adw.ResponseAppearance.SUGGESTED)
+        dialog.set_default_response("create")
+        dialog.connect("response", self._on_new_smart_playlist_response, entries)
+        dialog.present()
+
+    def _on_new_smart_playlist_response(self, dialog, response_id, entries):
+        if response_id != "create":
+            return
+        values = {key: entry.get_text().strip() for key, entry in entries.items()}
+        name = values.pop("name") or self._unique_playlist_name("Smart Playlist")
+        query = {}
+        try:
+            for key, text in values.items():
+                if not text:
+                    continue
+                if key.endswith("_duration_s"):
+                    query[key] = float(text) * 60
+                elif key == "added_within_days":
+                    query[key] = float(text)
+                else:
+                    query[key] = text
+            self._save_library_playlist()
+            self.library.create_smart_playlist(name, query)
+        except ValueError as e:
+            print(f"Could not create smart playlist '{name}': {e}", file=sys.stderr)
+            return
+        self._show_library_playlist(name)
+        self._set_playlist_names(self.library.playlist_names(), name)
+
+    def _on_delete_playlist_action(self, action, param):
+        """Handles the 'win.delete_playlist' action after asking for confirmation."""
+        dialog = Adw.MessageDialog.new(self, "Delete Playlist?",
+                                       f"'{self.current_playlist_name}' will be removed. Its tracks stay in the library.")
+        dialog.add_response("cancel", "_Cancel")
+        dialog.add_response("delete", "_Delete")
+        dialog.set_response_appearance("delete", Adw.ResponseAppearance.DESTRUCTIVE)
+        dialog.connect("response", self._on_delete_playlist_response, self.current_playlist_name)
+        dialog.present()
+
+    def _on_delete_playlist_response(self, dialog, response_id, name):
+        if response_id != "delete" or name != self.current_playlist_name:
+            return
+        self.library.delete_playlist(name)
+        names = self.library.playlist_names()
+        if not names:
+            names = [self.DEFAULT_PLAYLIST_NAME]
+            self.library.create_playlist(names[0])
+        self._show_library_playlist(names[0])
+        self._set_playlist_names(names, names[0])
+
     def _load_playlist(self, filepath=None):
         """Loads the playlist from a JSON file. Uses default if filepath is None."""
         path_to_use = filepath if filepath else self._playlist_file_path
@@ -1417,8 +5406,10 @@ class NamoWindow(Adw.ApplicationWindow):
                  print("Warning: Invalid playlist format (not a list). Starting empty.")
                  return
 
+            rows_to_add = []
+            art_by_b64 = {}
             for item in playlist_data:
-                if isinstance(item, dict):
+                if isinstance(item, dict) and isinstance(item.get('uri'), str):
                      
                      duration_ns_loaded = item.get('duration_ns')
                      if not isinstance(duration_ns_loaded, int) or duration_ns_loaded < 0:
@@ -1427,49 +5418,57 @@ class NamoWindow(Adw.ApplicationWindow):
                      
                      album_art_glib_bytes = None
                      album_art_b64 = item.get('album_art_b64')
-                     if album_art_b64:
+                     if album_art_b64 in art_by_b64:
+                         album_art_glib_bytes = art_by_b64[album_art_b64]
+                     elif album_art_b64:
                          try:
                              decoded_bytes = base64.b64decode(album_art_b64)
                              album_art_glib_bytes = GLib.Bytes.new(decoded_bytes)
+                             art_by_b64[album_art_b64] = album_art_glib_bytes
                          except Exception as decode_e:
                              print(f"Error decoding album art for {item.get('title')}: {decode_e}")
 
-                     song = Song(uri=item.get('uri'),
-                                 title=item.get('title'),
-                                 artist=item.get('artist'),
-                                 duration=duration_ns_loaded)
-                     
-                     if album_art_glib_bytes:
-                         song.album_art_data = album_art_glib_bytes
-                     self.playlist_store.append(song)
+                     rows_to_add.append((normalize_uri(item['uri']),
+                                         item.get('title'),
+                                         item.get('artist'),
+                                         duration_ns_loaded,
+                                         album_art_glib_bytes))
                 else:
                      print(f"Warning: Skipping invalid item in playlist: {item}")
 
+            self.playlist_store.extend_rows(rows_to_add)
+
         except json.JSONDecodeError:
             print(f"Error: Could not decode playlist JSON from {path_to_use}. Starting empty.")
         except Exception as e:
             print(f"Error loading playlist from {path_to_use}: {e}", file=sys.stderr)
 
     def _save_playlist(self, filepath=None):
-        """Saves the current playlist to a JSON file. Uses default if filepath is None."""
-        path_to_use = filepath if filepath else self._playlist_file_path
+        """Saves the current playlist to a JSON file, or to the library if filepath is None."""
+        if filepath is None:
+            self._save_library_playlist()
+            return
+        path_to_use = filepath
         playlist_data = []
-        for i in range(self.playlist_store.get_n_items()):
-            song = self.playlist_store.get_item(i)
+        b64_by_art = {}
+        for uri, title, artist, duration_ns, album_art_data in self.playlist_store.iter_rows():
             
-            duration_to_save = song.duration if isinstance(song.duration, int) and song.duration >= 0 else 0
+            duration_to_save = duration_ns if duration_ns >= 0 else 0
 
             
             song_data_to_save = {
-                'uri': song.uri,
-                'title': song.title,
-                'artist': song.artist,
+                'uri': uri,
+                'title': title,
+                'artist': artist,
                 'duration_ns': duration_to_save 
             }
             
-            if song.album_art_data:
-                 raw_bytes = song.album_art_data.get_data()
-                 song_data_to_save['album_art_b64'] = base64.b64encode(raw_bytes).decode('ascii')
+            if album_art_data:
+                 art_b64 = b64_by_art.get(id(album_art_data))
+                 if art_b64 is None:
+                     art_b64 = base64.b64encode(album_art_data.get_data()).decode('ascii')
+                     b64_by_art[id(album_art_data)] = art_b64
+                 song_data_to_save['album_art_b64'] = art_b64
 
             
             playlist_data.append(song_data_to_save)
@@ -1498,6 +5497,7 @@ class NamoApplication(Adw.Application):
                         **kwargs)
         GLib.set_application_name("Namo Media Player")
         self.window = None
+        self.watchdog = None
 
     def do_activate(self):
         
@@ -1522,24 +5522,47 @@ class NamoApplication(Adw.Application):
         else:
             print(f"Warning: style.css not found at {css_file}", file=sys.stderr)
 
+        if settings["watchdog_enabled"]:
+            self.watchdog = MainLoopWatchdog(settings["watchdog_stall_ms"], os.path.join(CACHE_DIR, "mainloop-latency.json"))
+            self.watchdog.start()
+
     def do_shutdown(self):
+        if self.watchdog:
+            self.watchdog.stop()
         
         if self.window:
              self.window._save_playlist()
+             self.window.stream_metrics.finish_track()
+             print(f"Stream stats: {self.window.stream_metrics.summary()}")
+             if self.window.media_cache:
+                 self.window.media_cache.flush()
 
         
+        if self.window:
+             self.window.replaygain_analyzer.shutdown()
+             if self.window.album_art_fetcher:
+                 self.window.album_art_fetcher.shutdown()
+             if self.window.peak_generator:
+                 self.window.peak_generator.shutdown()
         if self.window and hasattr(self.window, 'discoverer') and self.window.discoverer:
             print("Stopping discoverer...")
             self.window.discoverer.stop()
+            self.window._discovered_executor.shutdown(wait=False, cancel_futures=True)
         if self.window and hasattr(self.window, 'player') and self.window.player:
              print("Setting player to NULL state...")
              self.window.player.set_state(Gst.State.NULL)
+        if self.window:
+             self.window.library.close()
 
         Adw.Application.do_shutdown(self)
 
 
 def main():
     
+    try:
+        locale.setlocale(locale.LC_COLLATE, "")
+    except locale.Error as e:
+        print(f"Warning: Could not set collation locale ({e}), sorting uses the C locale.", file=sys.stderr)
     Gst.init(None)
     
     app = NamoApplication()